@@ -0,0 +1,181 @@
+# 附件存储模块
+# 图片/视频等附件按内容 sha256 命名存放在 config/media/ 下，相同文件只保存一份
+# 正文中以 kbmedia:<sha256> 引用附件；文件分段流式读写，读取时用 mmap，不会整体读入内存
+# 可选加密：每 SEGMENT_SIZE 字节明文单独封装为一个信封，支持随机读取
+import hashlib
+import mimetypes
+import mmap
+import os
+import re
+import tempfile
+import threading
+from urllib.parse import unquote
+from core.encryption import ENVELOPE_HEADER, NONCE_SIZE, encrypt_bytes, decrypt_bytes
+
+MEDIA_DIR = os.path.join(os.path.dirname(__file__), '../config/media')
+MEDIA_SCHEME = 'kbmedia'
+MEDIA_REF = re.compile(MEDIA_SCHEME + r':([0-9a-f]{64})')
+# 本地文件路径：旧版本插入的 <img src="file://..."> 或 Markdown 中的 ![](file://...)
+FILE_LINK = re.compile(r'(src="|\]\()file://([^")\s]+)("|\))')
+SEGMENT_SIZE = 1024 * 1024
+# 不压缩的信封：头部 + nonce + 16 字节 GCM 认证标签
+SEGMENT_OVERHEAD = ENVELOPE_HEADER.size + NONCE_SIZE + 16
+# 未被引用的附件至少保留这么久再回收，给插入后尚未保存的知识点留出时间
+GC_GRACE_SECONDS = 24 * 3600
+ENCRYPT_SETTING = 'encrypt_media'
+
+def media_url(digest):
+    return f'{MEDIA_SCHEME}:{digest}'
+
+class MediaReader:
+    """
+    按偏移读取附件内容。明文文件直接切片 mmap；加密文件按段解密，缓存最近一段。
+    """
+    def __init__(self, path, size, encrypted):
+        self.size = size
+        self.encrypted = encrypted
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(self._file.fileno()).st_size else None
+        self._segment = (None, b'')
+
+    def _load_segment(self, index):
+        if self._segment[0] != index:
+            start = index * (SEGMENT_SIZE + SEGMENT_OVERHEAD)
+            length = min(SEGMENT_SIZE, self.size - index * SEGMENT_SIZE) + SEGMENT_OVERHEAD
+            self._segment = (index, decrypt_bytes(self._map[start:start + length]))
+        return self._segment[1]
+
+    def read(self, offset, length):
+        length = max(0, min(length, self.size - offset))
+        if not length:
+            return b''
+        if not self.encrypted:
+            return self._map[offset:offset + length]
+        parts = []
+        while length > 0:
+            index, start = divmod(offset, SEGMENT_SIZE)
+            part = self._load_segment(index)[start:start + length]
+            parts.append(part)
+            offset += len(part)
+            length -= len(part)
+        return b''.join(parts)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+class AttachmentStore:
+    def __init__(self, db, root=None):
+        self.db = db
+        self.root = root or MEDIA_DIR
+        # 导入与回收互斥，避免回收删除刚导入的同名文件
+        self._lock = threading.Lock()
+        # (路径, mtime_ns, 大小) -> sha256：编辑器中的 file:// 链接在每次自动保存时都会再导入，文件没变时不再重新读取计算
+        self._imported = {}
+
+    def path_of(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def import_file(self, path, encrypt=None):
+        """
+        把文件导入附件库，返回 sha256。分段读写，大文件不会整体读入内存；已存在相同内容时不再重复保存。
+        encrypt 为 None 时按设置项 encrypt_media 决定。
+        """
+        if encrypt is None:
+            encrypt = self.db.get_setting(ENCRYPT_SETTING) == '1'
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(path, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+                for block in iter(lambda: src.read(SEGMENT_SIZE), b''):
+                    digest.update(block)
+                    size += len(block)
+                    # 媒体文件基本不可压缩，加密时不再压缩，保证每段密文长度固定
+                    dst.write(encrypt_bytes(block, codec='none') if encrypt else block)
+            digest = digest.hexdigest()
+            mime = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+            with self._lock:
+                if self.db.get_attachment(digest) and os.path.exists(self.path_of(digest)):
+                    os.remove(tmp)
+                else:
+                    os.makedirs(os.path.dirname(self.path_of(digest)), exist_ok=True)
+                    os.replace(tmp, self.path_of(digest))
+                self.db.add_attachment(digest, mime, size, os.path.basename(path), int(encrypt))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return digest
+
+    def info(self, digest):
+        # 返回 (hash, mime, size, name, encrypted)，不存在时返回 None
+        return self.db.get_attachment(digest)
+
+    def open(self, digest):
+        row = self.info(digest)
+        if row is None or not os.path.exists(self.path_of(digest)):
+            return None
+        return MediaReader(self.path_of(digest), row[2], row[4])
+
+    def read_all(self, digest):
+        # 供 QTextBrowser 显示图片等需要完整数据的场景
+        reader = self.open(digest)
+        if reader is None:
+            return None
+        try:
+            return reader.read(0, reader.size)
+        finally:
+            reader.close()
+
+    def absorb_file_links(self, text):
+        """
+        把正文中 file:// 路径的图片/视频导入附件库并替换为 kbmedia 引用；文件已不存在时保持原样。
+        """
+        def replace(match):
+            path = unquote(match.group(2))
+            digest = self._absorb_file(path)
+            if digest is None:
+                return match.group(0)
+            return match.group(1) + media_url(digest) + match.group(3)
+        return FILE_LINK.sub(replace, text) if 'file://' in text else text
+
+    def _absorb_file(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path):
+            return None
+        key = (path, st.st_mtime_ns, st.st_size)
+        digest = self._imported.get(key)
+        row = self.db.get_attachment(digest) if digest is not None else None
+        # 附件可能已被回收，库中和磁盘上都还在时才直接使用
+        if row and os.path.exists(self.path_of(digest)):
+            # 与 import_file 相同，刷新 added_at，避免尚未保存的引用被回收
+            self.db.add_attachment(*row)
+            return digest
+        digest = self._imported[key] = self.import_file(path)
+        return digest
+
+    def collect_garbage(self, min_age=GC_GRACE_SECONDS):
+        """
+        删除没有被任何知识点引用的附件及其文件，返回删除的数量。
+        """
+        with self._lock:
+            hashes = self.db.delete_orphan_attachments(min_age)
+            for digest in hashes:
+                try:
+                    os.remove(self.path_of(digest))
+                except FileNotFoundError:
+                    pass
+        return len(hashes)
+
+def start_garbage_collection(store):
+    # 启动后台线程回收附件，不阻塞界面
+    thread = threading.Thread(target=store.collect_garbage, name='media-gc', daemon=True)
+    thread.start()
+    return thread
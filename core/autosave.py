@@ -0,0 +1,164 @@
+# 自动保存模块
+# 编辑时记录未保存状态，停止输入一段时间或切换知识点时提交保存
+# 切块、加密、写库都在一个后台写线程中进行；同一知识点排队中的多次保存只写最后一次
+import threading
+import time
+from collections import OrderedDict
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+# 停止输入多久后自动保存
+IDLE_MS = 1500
+# 保存失败后隔多久重试
+RETRY_SECONDS = 5.0
+
+class SaveQueue(QObject):
+    """
+    单个后台写线程。submit() 返回序号，保存完成后发出 saved(kid, 序号)，失败时发出 failed(kid, 序号, 原因) 并稍后重试。
+    信号在写线程中发出，连接到界面对象时会自动排队到界面线程执行。
+    """
+    saved = pyqtSignal(int, int)
+    failed = pyqtSignal(int, int, str)
+
+    def __init__(self, store, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self._cond = threading.Condition()
+        # kid -> (序号, title, text)，同一知识点只保留最新的一份
+        self._pending = OrderedDict()
+        self._current = None
+        self._seq = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='autosave', daemon=True)
+        self._thread.start()
+
+    def submit(self, kid, title, text):
+        with self._cond:
+            self._seq += 1
+            self._pending.pop(kid, None)
+            self._pending[kid] = (self._seq, title, text)
+            self._cond.notify_all()
+            return self._seq
+
+    def pending(self, kid):
+        """
+        返回尚未写入数据库的 (title, text)，没有时返回 None。打开知识点时优先使用，避免读到旧内容。
+        """
+        with self._cond:
+            item = self._pending.get(kid)
+            if item is None and self._current is not None and self._current[0] == kid:
+                item = self._current[1]
+            return item[1:] if item else None
+
+    def pending_seq(self, kid):
+        # 返回该知识点尚未写完的保存序号，没有时返回 None；收到序号不小于它的 saved 信号即已写入
+        with self._cond:
+            item = self._pending.get(kid)
+            if item is None and self._current is not None and self._current[0] == kid:
+                item = self._current[1]
+            return item[0] if item else None
+
+    def wait(self, timeout=None):
+        # 等待队列写完，返回是否已全部写完
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._current is not None:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def close(self, timeout=None):
+        drained = self.wait(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        return drained
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                kid, item = self._pending.popitem(last=False)
+                self._current = (kid, item)
+            seq, title, text = item
+            try:
+                # 排队期间知识点已被删除时丢弃
+                if self.store.db.get_knowledge(kid) is not None:
+                    self.store.save(kid, title, text)
+                error = None
+            except Exception as e:
+                error = str(e) or e.__class__.__name__
+            # 先发信号再清除当前项，wait() 返回后写线程不会再访问本对象
+            if error is None:
+                self.saved.emit(kid, seq)
+            else:
+                self.failed.emit(kid, seq, error)
+            with self._cond:
+                self._current = None
+                if error is not None and kid not in self._pending:
+                    # 没有更新的版本排队时放回队列，稍后重试，修改不会丢失
+                    self._pending[kid] = item
+                self._cond.notify_all()
+                if error is not None:
+                    if self._closed:
+                        return
+                    self._cond.wait(RETRY_SECONDS)
+
+class Autosave(QObject):
+    """
+    跟踪当前知识点是否有未保存的修改：mark_dirty() 后停止输入 IDLE_MS 毫秒自动保存，flush() 立即提交。
+    source() 返回当前编辑内容 (kid, title, text)，没有可保存的知识点时返回 None。
+    保存状态通过 status_changed(文本) 通知，不弹出对话框。
+    """
+    status_changed = pyqtSignal(str)
+
+    def __init__(self, store, source, parent=None):
+        super().__init__(parent)
+        self.source = source
+        self.dirty = False
+        self._last_seq = 0
+        self.queue = SaveQueue(store, self)
+        self.queue.saved.connect(self._on_saved)
+        self.queue.failed.connect(self._on_failed)
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(IDLE_MS)
+        self._timer.timeout.connect(self.flush)
+
+    def mark_dirty(self):
+        self.dirty = True
+        self._timer.start()
+        self.status_changed.emit('有未保存的修改')
+
+    def flush(self, force=False):
+        # 提交当前修改，不等待写入完成；force 为真时即使没有修改也保存（手动保存）
+        # 返回保存序号，没有需要保存的内容时返回 None
+        self._timer.stop()
+        if not self.dirty and not force:
+            return None
+        snapshot = self.source()
+        self.dirty = False
+        if snapshot is None:
+            return None
+        self._last_seq = self.queue.submit(*snapshot)
+        self.status_changed.emit('正在保存…')
+        return self._last_seq
+
+    def pending(self, kid):
+        return self.queue.pending(kid)
+
+    def _on_saved(self, kid, seq):
+        if seq == self._last_seq and not self.dirty:
+            self.status_changed.emit(time.strftime('已保存 %H:%M:%S'))
+
+    def _on_failed(self, kid, seq, error):
+        self.status_changed.emit(f'保存失败，稍后重试：{error}')
+
+    def close(self, timeout=None):
+        # 退出前提交并写完所有修改
+        self.flush()
+        return self.queue.close(timeout)
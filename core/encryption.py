@@ -1,10 +1,45 @@
 # 加密模块
 # 提供加密/解密接口
-from cryptography.fernet import Fernet
+# 新数据使用二进制信封：magic(1) | version(1) | key_id(4) | codec(1) | nonce(12) | AES-GCM 密文
+# 明文先按 codec 压缩再加密；version 1 信封没有 codec 字节，旧数据为 base64(Fernet token) 字符串，解密时均兼容
+from cryptography.fernet import Fernet, MultiFernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 import base64
+import hashlib
 import os
+import lzma
+import struct
+import threading
+import time
+import zlib
 
 KEY_PATH = os.path.join(os.path.dirname(__file__), '../config/key.bin')
+# 轮换后保留的历史密钥，按 key_id 命名
+KEYS_DIR = os.path.join(os.path.dirname(__file__), '../config/keys')
+
+ENVELOPE_MAGIC = 0xC7
+ENVELOPE_VERSION = 2
+ENVELOPE_HEADER_V1 = struct.Struct('>BB4s')
+ENVELOPE_HEADER = struct.Struct('>BB4sB')
+NONCE_SIZE = 12
+
+# 压缩编码：codec_id -> (名称, 压缩函数, 解压函数)；codec_id 写入信封，已发布的编号不能改
+CODECS = {}
+CODEC_IDS = {}
+
+def register_codec(codec_id, name, compress, decompress):
+    CODECS[codec_id] = (name, compress, decompress)
+    CODEC_IDS[name] = codec_id
+
+register_codec(0, 'none', bytes, bytes)
+register_codec(1, 'zlib', lambda data: zlib.compress(data, 6), zlib.decompress)
+register_codec(2, 'lzma', lambda data: lzma.compress(data, preset=6), lzma.decompress)
+# 新写入默认使用的压缩方式，lzma 压缩率更高但更慢
+DEFAULT_CODEC = 'zlib'
+# base64(Fernet token) 的固定前缀，Fernet token 以版本字节 0x80 开头
+LEGACY_PREFIX = 'Z0FBQUFB'
 
 def generate_key():
     key = Fernet.generate_key()
@@ -19,14 +54,205 @@ def load_key():
     with open(KEY_PATH, 'rb') as f:
         return f.read()
 
-def encrypt_data(data: str) -> str:
-    key = load_key()
-    f = Fernet(key)
-    token = f.encrypt(data.encode())
-    return base64.b64encode(token).decode('utf-8')
-
-def decrypt_data(token_b64: str) -> str:
-    key = load_key()
-    f = Fernet(key)
-    token = base64.b64decode(token_b64)
-    return f.decrypt(token).decode()
+class KeyManager:
+    """
+    缓存密钥与 Fernet/AES-GCM 对象，避免每次加解密都读取 key.bin。
+    key.bin 为当前加密用的密钥；KEYS_DIR 中保存轮换前后的密钥，仅用于解密。
+    key.bin 或 KEYS_DIR 变化时自动重新加载；检查频率受 CHECK_INTERVAL 限制。
+    """
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._fernet = None
+        self._aeads = {}
+        self._subkeys = {}
+        self._key_id = None
+        self._active = None
+        self._signature = None
+        self._checked_at = 0.0
+
+    @staticmethod
+    def _stat_signature():
+        signature = []
+        for path in (KEY_PATH, KEYS_DIR):
+            try:
+                st = os.stat(path)
+                signature.append((st.st_ino, st.st_mtime_ns))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def cipher(self):
+        now = time.monotonic()
+        if self._fernet is not None and now - self._checked_at < self.CHECK_INTERVAL:
+            return self._fernet
+        with self._lock:
+            signature = self._stat_signature()
+            if self._fernet is None or signature[0] is None or signature != self._signature:
+                active = load_key().strip()
+                keys = [active] + [key for key in load_keyring() if key != active]
+                # MultiFernet 用第一个密钥加密，解密时依次尝试，兼容轮换前的旧格式数据
+                self._fernet = MultiFernet([Fernet(key) for key in keys])
+                self._aeads = dict(derive_aead(key) for key in keys)
+                self._key_id = key_id_of(active)
+                self._active = active
+                self._subkeys = {}
+                self._signature = self._stat_signature()
+            self._checked_at = now
+            return self._fernet
+
+    def aead(self):
+        # 返回当前密钥的 (key_id, AESGCM)，与 cipher() 共用同一份密钥缓存
+        self.cipher()
+        return self._key_id, self._aeads[self._key_id]
+
+    def aead_for(self, key_id):
+        self.cipher()
+        aead = self._aeads.get(key_id)
+        if aead is None:
+            raise ValueError(f'找不到对应的密钥: {key_id.hex()}')
+        return aead
+
+    def active_key_id(self):
+        self.cipher()
+        return self._key_id
+
+    def subkey(self, info: bytes) -> bytes:
+        # 由当前密钥按用途（info）派生的 32 字节子密钥，用于 HMAC 等非加密用途
+        self.cipher()
+        key = self._subkeys.get(info)
+        if key is None:
+            raw = base64.urlsafe_b64decode(self._active)
+            key = self._subkeys[info] = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=info).derive(raw)
+        return key
+
+    def invalidate(self):
+        # 外部替换 key.bin 后可调用，下次使用时强制重新读取
+        with self._lock:
+            self._fernet = None
+
+def key_id_of(key):
+    # 密钥指纹的前 4 字节，写入信封用于解密时选择密钥
+    return hashlib.sha256(base64.urlsafe_b64decode(key)).digest()[:4]
+
+def derive_aead(key):
+    """
+    由 Fernet 密钥派生 AES-256-GCM 密钥，返回 (key_id, AESGCM)。
+    """
+    raw = base64.urlsafe_b64decode(key)
+    derived = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b'knowledge-envelope-v1').derive(raw)
+    return key_id_of(key), AESGCM(derived)
+
+def load_keyring():
+    # KEYS_DIR 下所有 <key_id>.bin 密钥
+    if not os.path.isdir(KEYS_DIR):
+        return []
+    keys = []
+    for name in sorted(os.listdir(KEYS_DIR)):
+        if name.endswith('.bin'):
+            with open(os.path.join(KEYS_DIR, name), 'rb') as f:
+                keys.append(f.read().strip())
+    return keys
+
+def _write_key_file(path, key):
+    # 先写临时文件再替换，避免中途退出留下残缺的密钥文件
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(key)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def rotate_key():
+    """
+    生成新密钥并设为当前密钥（写入 key.bin），新旧密钥都保存在 KEYS_DIR 中，旧数据仍可解密。
+    返回新密钥的 key_id。
+    """
+    old = load_key().strip()
+    _write_key_file(os.path.join(KEYS_DIR, key_id_of(old).hex() + '.bin'), old)
+    new = Fernet.generate_key()
+    _write_key_file(os.path.join(KEYS_DIR, key_id_of(new).hex() + '.bin'), new)
+    _write_key_file(KEY_PATH, new)
+    _key_manager.invalidate()
+    return key_id_of(new)
+
+_key_manager = KeyManager()
+
+def get_key_manager():
+    return _key_manager
+
+def is_envelope(value):
+    return isinstance(value, (bytes, bytearray, memoryview)) and len(value) > ENVELOPE_HEADER_V1.size and value[0] == ENVELOPE_MAGIC
+
+def is_legacy_token(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value[:len(LEGACY_PREFIX)]) == LEGACY_PREFIX.encode()
+    return isinstance(value, str) and value.startswith(LEGACY_PREFIX)
+
+def is_encrypted_payload(value):
+    # 判断存储的正文是否为密文（新信封或旧 Fernet 格式），历史明文返回 False
+    return is_envelope(value) or is_legacy_token(value)
+
+def _compress(data, codec):
+    codec_id = CODEC_IDS[codec or DEFAULT_CODEC]
+    if codec_id:
+        packed = CODECS[codec_id][1](data)
+        # 压缩后没有变小（短文本）时直接存原文
+        if len(packed) < len(data):
+            return codec_id, packed
+    return 0, data
+
+def _seal(key_id, aead, data, codec=None):
+    codec_id, data = _compress(data, codec)
+    header = ENVELOPE_HEADER.pack(ENVELOPE_MAGIC, ENVELOPE_VERSION, key_id, codec_id)
+    nonce = os.urandom(NONCE_SIZE)
+    # 头部作为附加认证数据，篡改版本、key_id 或 codec 会导致解密失败
+    return header + nonce + aead.encrypt(nonce, data, header)
+
+def encrypt_bytes(data: bytes, codec=None) -> bytes:
+    return _seal(*_key_manager.aead(), data, codec)
+
+def decrypt_bytes(value) -> bytes:
+    if is_envelope(value):
+        value = bytes(value)
+        version = value[1]
+        if version == 1:
+            _, _, key_id = ENVELOPE_HEADER_V1.unpack_from(value)
+            codec_id = 0
+            header_end = ENVELOPE_HEADER_V1.size
+        elif version == 2:
+            _, _, key_id, codec_id = ENVELOPE_HEADER.unpack_from(value)
+            header_end = ENVELOPE_HEADER.size
+        else:
+            raise ValueError(f'不支持的密文版本: {version}')
+        if codec_id not in CODECS:
+            raise ValueError(f'不支持的压缩方式: {codec_id}')
+        nonce = value[header_end:header_end + NONCE_SIZE]
+        data = _key_manager.aead_for(key_id).decrypt(nonce, value[header_end + NONCE_SIZE:], value[:header_end])
+        return CODECS[codec_id][2](data)
+    # 旧格式：base64(Fernet token)
+    return _key_manager.cipher().decrypt(base64.b64decode(value))
+
+def encrypt_data(data: str, codec=None) -> bytes:
+    return encrypt_bytes(data.encode(), codec)
+
+def decrypt_data(token) -> str:
+    return decrypt_bytes(token).decode()
+
+def encrypt_many(items, codec=None):
+    # 批量加密，整批只取一次密钥
+    key_id, aead = _key_manager.aead()
+    return [_seal(key_id, aead, data.encode(), codec) for data in items]
+
+def decrypt_many(tokens):
+    return [decrypt_data(token) for token in tokens]
+
+def decode_content(value, encrypted=1) -> str:
+    # 读取存储的正文：密文（新信封或旧格式）解密，历史明文原样返回
+    if value is None:
+        return ''
+    if encrypted and is_encrypted_payload(value):
+        return decrypt_data(value)
+    return value.decode() if isinstance(value, (bytes, bytearray)) else value
@@ -0,0 +1,104 @@
+# 密钥轮换模块
+# 生成新密钥后，多进程并行把所有正文重新加密为新密钥，进度写入 settings 表，中断后可继续
+# 用法：python -m core.key_rotation [--batch-size N] [--workers N] [--no-rotate]
+import argparse
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from core.encryption import get_key_manager, rotate_key, decrypt_bytes, encrypt_bytes
+
+CHECKPOINT_KEY = 'key_rotation_checkpoint'
+
+def _init_worker():
+    # 子进程可能继承了父进程的密钥缓存，强制从磁盘重新读取
+    get_key_manager().invalidate()
+
+def _reencrypt_batch(rows):
+    """
+    在子进程中执行：解密并用当前密钥重新封装。返回 (new_body, row_id, old_body)，无法解密的行跳过。
+    """
+    result = []
+    for row_id, body in rows:
+        try:
+            plain = decrypt_bytes(body)
+        except Exception:
+            continue
+        result.append((encrypt_bytes(plain), row_id, body))
+    return result
+
+def load_checkpoint(db):
+    value = db.get_setting(CHECKPOINT_KEY)
+    return json.loads(value) if value else None
+
+def _stages(db):
+    # 依次处理的表：(名称, 读取函数, 写回函数)；进度中记录当前所处的阶段
+    return [
+        ('knowledge_content', db.get_encrypted_contents, db.replace_contents),
+        ('chunk', db.get_encrypted_chunks, db.replace_chunks),
+        ('knowledge_revision', db.get_encrypted_revisions, db.replace_revisions),
+    ]
+
+def reencrypt_all(db, batch_size=500, workers=None, progress=None):
+    """
+    把所有不是用当前密钥封装的正文（整体存储的正文、分块正文和历史版本）重新加密。
+    每批的写回与进度在同一事务中提交，中断后再次调用会从上次提交的位置继续。返回本次重新加密的行数。
+    """
+    key_id = get_key_manager().active_key_id()
+    checkpoint = load_checkpoint(db)
+    stages = _stages(db)
+    names = [name for name, _, _ in stages]
+    start_stage, after_id = 0, 0
+    if checkpoint and checkpoint.get('key_id') == key_id.hex():
+        # 早期版本的进度没有 stage 字段，只可能处于第一个阶段
+        start_stage = names.index(checkpoint.get('stage', names[0]))
+        after_id = checkpoint['after_id']
+    workers = workers or os.cpu_count() or 1
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        for name, fetch, replace in stages[start_stage:]:
+            pending = deque()
+            while True:
+                # 读取与加解密流水线化：同时保持 workers * 2 个批次在处理中
+                while len(pending) < workers * 2:
+                    rows = fetch(after_id, batch_size, exclude_key_id=key_id)
+                    if not rows:
+                        break
+                    after_id = rows[-1][0]
+                    pending.append((after_id, pool.submit(_reencrypt_batch, rows)))
+                if not pending:
+                    break
+                # 按提交顺序写回，保证进度位置单调递增
+                batch_end, future = pending.popleft()
+                with db.transaction():
+                    done += replace(future.result())
+                    db.set_setting(CHECKPOINT_KEY, json.dumps({'key_id': key_id.hex(), 'stage': name, 'after_id': batch_end}))
+                if progress:
+                    progress(done, name, batch_end)
+            after_id = 0
+    db.set_setting(CHECKPOINT_KEY, None)
+    return done
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='轮换加密密钥并重新加密全部知识点')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--no-rotate', action='store_true', help='不生成新密钥，只把旧密钥的数据重新加密为当前密钥')
+    args = parser.parse_args(argv)
+    from db.database import Database
+    db = Database()
+    checkpoint = load_checkpoint(db)
+    if checkpoint and checkpoint.get('key_id') == get_key_manager().active_key_id().hex():
+        print(f'继续上次未完成的轮换，从 {checkpoint.get("stage", "knowledge_content")} id {checkpoint["after_id"]} 之后开始')
+    elif not args.no_rotate:
+        key_id = rotate_key()
+        # 先写入进度，确保中断后重新运行时继续当前轮换而不是再生成一个新密钥
+        db.set_setting(CHECKPOINT_KEY, json.dumps({'key_id': key_id.hex(), 'stage': 'knowledge_content', 'after_id': 0}))
+        print(f'已生成新密钥 {key_id.hex()}，旧密钥保存在 config/keys/ 中')
+    done = reencrypt_all(db, args.batch_size, args.workers,
+        progress=lambda n, stage, last_id: print(f'已重新加密 {n} 条（{stage} id ≤ {last_id}）', file=sys.stderr))
+    print(f'完成，共重新加密 {done} 条正文/正文块/历史版本')
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,242 @@
 # Markdown渲染与代码高亮模块
+# 样式表按 Pygments 样式只生成一次；整篇渲染结果和每个代码块的高亮结果分别按内容哈希做 LRU 缓存
+import hashlib
+import re
+import threading
+from collections import OrderedDict
 import markdown
+from markdown.extensions import Extension
+from markdown.extensions.codehilite import CodeHilite, CodeHiliteExtension
+from markdown.extensions.fenced_code import FencedBlockPreprocessor
+from markdown.util import BLOCK_LEVEL_ELEMENTS
 from pygments.formatters import HtmlFormatter
 
+RENDER_CACHE_SIZE = 32
+HIGHLIGHT_CACHE_SIZE = 512
+
+# 连续空行（含只有空白的行），带分组以便保留围栏代码块中的原始空行
+BLANK_LINES_RE = re.compile(r'(\n(?:[ \t]*\n)+)')
+FENCE_LINE_RE = re.compile(r'^ {0,3}(`{3,}|~{3,})(.*)$', re.M)
+LIST_ITEM_RE = re.compile(r'^ {0,3}([*+-]|\d+[.)])\s')
+REFERENCE_RE = re.compile(r'^ {0,3}\[[^\]]+\]:\s*\S')
+QUOTE_LINE_RE = re.compile(r'^ {0,3}>', re.M)
+# 行首的 HTML 块级标签或注释开始一个原始 HTML 块，直到对应的结束标签为止，中间的空行不切开
+HTML_START_RE = re.compile(r'^ {0,3}<(!--|[a-zA-Z][a-zA-Z0-9-]*)', re.M)
+HTML_BLOCK_TAGS = frozenset(BLOCK_LEVEL_ELEMENTS) - {'hr'}
+_html_tag_res = {}
+
+def _fence_state(piece, fence):
+    # 返回处理完 piece 之后的围栏状态：None 表示不在围栏代码块中
+    if '```' not in piece and '~~~' not in piece:
+        return fence
+    for match in FENCE_LINE_RE.finditer(piece):
+        marker = match.group(1)
+        if fence is None:
+            fence = marker
+        elif marker[0] == fence[0] and len(marker) >= len(fence) and not match.group(2).strip():
+            fence = None
+    return fence
+
+def _html_state(piece, html):
+    """
+    返回处理完 piece 之后未闭合的原始 HTML 块：None，或 (标签名, 嵌套层数)，注释为 ('!--', 1)。
+    html 为 piece 开始时的状态；同名标签嵌套时按层数配对。
+    """
+    pos = 0
+    while True:
+        if html is None:
+            match = HTML_START_RE.search(piece, pos)
+            while match and match.group(1) != '!--' and match.group(1).lower() not in HTML_BLOCK_TAGS:
+                match = HTML_START_RE.search(piece, match.end())
+            if not match:
+                return None
+            name = match.group(1).lower()
+            html = (name, 0)
+            pos = match.start()
+        name, depth = html
+        if name == '!--':
+            end = piece.find('-->', pos)
+            if end < 0:
+                return ('!--', 1)
+            html, pos = None, end + 3
+            continue
+        tag_re = _html_tag_res.get(name)
+        if tag_re is None:
+            tag_re = _html_tag_res[name] = re.compile(rf'<(/?){name}(?=[\s/>])', re.I)
+        for match in tag_re.finditer(piece, pos):
+            depth += -1 if match.group(1) else 1
+            if not depth:
+                html, pos = None, match.end()
+                break
+        else:
+            return (name, depth)
+
+def _take_references(piece, fence, references):
+    # 取出围栏代码块之外的链接引用定义行，返回剩余文本；fence 为 piece 开始时的围栏状态
+    lines = []
+    for line in piece.split('\n'):
+        if fence is None and REFERENCE_RE.match(line):
+            references.append(line)
+            continue
+        lines.append(line)
+        fence = _fence_state(line, fence)
+    return '\n'.join(lines)
+
+def split_blocks(text):
+    """
+    把 Markdown 按空行切分为顶层块，围栏代码块、原始 HTML 块、缩进的续行、空行隔开的列表项和引用块不会被切开。
+    返回 (blocks, references)：references 为链接引用定义，渲染含链接的块时需要附加在后面。
+    """
+    blocks = []
+    references = []
+    current = []
+    fence = None
+    html = None
+    pieces = BLANK_LINES_RE.split(text)
+    # 偶数位为以空行分隔的文本段，奇数位为分隔用的空行
+    for i in range(0, len(pieces), 2):
+        piece = pieces[i]
+        if html is not None:
+            # 原始 HTML 块内保留原样的空行，链接引用定义也不取出
+            current.append(pieces[i - 1])
+            current.append(piece)
+            html = _html_state(piece, html)
+            continue
+        if fence is None:
+            if not piece.strip():
+                continue
+            if ']:' in piece:
+                piece = _take_references(piece, None, references)
+                if not piece.strip():
+                    continue
+            if current:
+                # 紧跟在引用块后的 > 行并入同一个引用块
+                if (piece[0] in ' \t' or (LIST_ITEM_RE.match(piece) and LIST_ITEM_RE.match(current[0]))
+                        or (QUOTE_LINE_RE.match(piece) and QUOTE_LINE_RE.search(current[-1]))):
+                    current.append('\n\n')
+                else:
+                    blocks.append(''.join(current))
+                    current = []
+            if '<' in piece:
+                html = _html_state(piece, None)
+        else:
+            # 围栏代码块内保留原样的空行
+            current.append(pieces[i - 1])
+            if ']:' in piece:
+                piece = _take_references(piece, fence, references)
+        current.append(piece)
+        fence = _fence_state(piece, fence)
+    if current:
+        blocks.append(''.join(current))
+    return blocks, references
+
+class LRUCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key):
+        value = self._data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+class _CachedFencedBlockPreprocessor(FencedBlockPreprocessor):
+    """
+    在 fenced_code 之前处理不带属性的代码块，高亮结果按 (语言, 代码) 缓存；
+    带属性或 hl_lines 的代码块留给 fenced_code 原样处理。
+    """
+    def __init__(self, md, renderer):
+        super().__init__(md, {})
+        self.renderer = renderer
+
+    def run(self, lines):
+        def replace(match):
+            if match.group('attrs') or match.group('hl_lines'):
+                return match.group(0)
+            html = self.renderer.highlight(match.group('code'), match.group('lang'))
+            return f'\n{self.md.htmlStash.store(html)}\n'
+        return self.FENCED_BLOCK_RE.sub(replace, '\n'.join(lines)).split('\n')
+
+class _CachedFencedCodeExtension(Extension):
+    def __init__(self, renderer):
+        super().__init__()
+        self.renderer = renderer
+
+    def extendMarkdown(self, md):
+        # fenced_code 的优先级为 25，数值越大越先执行
+        md.preprocessors.register(_CachedFencedBlockPreprocessor(md, self.renderer), 'cached_fenced_code', 26)
+
 class MarkdownRenderer:
-    def __init__(self):
-        self.md = markdown.Markdown(extensions=['fenced_code', 'codehilite'])
-        self.formatter = HtmlFormatter(style='default')
+    # 样式名 -> 样式表，所有实例共用
+    _css_cache = {}
+
+    def __init__(self, style='default'):
+        self.codehilite = CodeHiliteExtension()
+        self.md = markdown.Markdown(extensions=['fenced_code', self.codehilite, _CachedFencedCodeExtension(self)])
+        # markdown.Markdown 实例不能并发使用，预览在后台线程渲染
+        self._lock = threading.RLock()
+        self.render_cache = LRUCache(RENDER_CACHE_SIZE)
+        self.highlight_cache = LRUCache(HIGHLIGHT_CACHE_SIZE)
+        self.set_style(style)
+
+    def set_style(self, style):
+        # 切换代码高亮样式（如随主题切换），样式表只在第一次使用该样式时生成
+        self.style = style
+        css = self._css_cache.get(style)
+        if css is None:
+            css = self._css_cache[style] = HtmlFormatter(style=style).get_style_defs()
+        self.css_text = css
+        self.css = f'<style>{css}</style>'
+
+    def highlight(self, code, lang):
+        key = hashlib.sha256(f'{lang}\0{code}'.encode()).digest()
+        html = self.highlight_cache.get(key)
+        if html is None:
+            # 与 fenced_code + codehilite 的调用方式一致，输出完全相同
+            config = self.codehilite.getConfigs()
+            html = CodeHilite(code, lang=lang, style=config.pop('pygments_style', 'default'), **config).hilite(shebang=False)
+            self.highlight_cache.put(key, html)
+        return html
+
+    def render_body(self, text, cache=True):
+        # 只返回正文 HTML，不含样式表；逐块渲染时传 cache=False，避免挤掉整篇的缓存
+        with self._lock:
+            if not cache:
+                return self.md.reset().convert(text)
+            key = hashlib.sha256(text.encode()).digest()
+            html = self.render_cache.get(key)
+            if html is None:
+                html = self.md.reset().convert(text)
+                self.render_cache.put(key, html)
+            return html
 
     def render(self, text):
-        html = self.md.reset().convert(text)
-        style = f'<style>{self.formatter.get_style_defs()}</style>'
-        return style + html
+        return self.css + self.render_body(text)
+
+    def cache_info(self):
+        return {
+            'render_hits': self.render_cache.hits,
+            'render_misses': self.render_cache.misses,
+            'render_size': len(self.render_cache),
+            'highlight_hits': self.highlight_cache.hits,
+            'highlight_misses': self.highlight_cache.misses,
+            'highlight_size': len(self.highlight_cache),
+        }
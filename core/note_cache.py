@@ -0,0 +1,124 @@
+# 知识点正文缓存模块
+# 解密后的正文按字节数做 LRU 缓存，切换回最近打开过的知识点时不再读库和解密
+# 保存/删除知识点时通过数据库变更事件失效；同一子标题下的知识点可在后台线程预先解密
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+CACHE_LIMIT = 32 * 1024 * 1024
+# 一次预取的知识点数量上限
+PREFETCH_LIMIT = 20
+
+def _entry_size(title, text):
+    # 按 Python 字符串实际占用的内存计算
+    return sys.getsizeof(title) + sys.getsizeof(text)
+
+class NoteCache:
+    """
+    load(kid) 与 NoteStore.load 返回相同的 (title, text, format)，命中时直接返回缓存。
+    prefetch(kids) 在后台线程依次加载未缓存的知识点，新的预取请求会取消尚未完成的旧请求。
+    """
+    def __init__(self, store, limit=CACHE_LIMIT):
+        self.store = store
+        self.limit = limit
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # kid -> (title, text, format, size)，按最近使用排序
+        self._entries = OrderedDict()
+        self._total = 0
+        # 每次失效递增；加载期间发生过失效时，加载结果可能已过期，不放入缓存
+        self._version = 0
+        self._prefetch_generation = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='note-prefetch')
+        store.db.add_listener(self._on_change)
+
+    def get(self, kid):
+        with self._lock:
+            entry = self._entries.get(kid)
+            if entry is None:
+                return None
+            self._entries.move_to_end(kid)
+            return entry[:3]
+
+    def load(self, kid):
+        row = self.get(kid)
+        if row is not None:
+            self.hits += 1
+            return row
+        self.misses += 1
+        return self._load(kid)
+
+    def _load(self, kid):
+        version = self._version
+        row = self.store.load(kid)
+        # 解密失败的不缓存，下次重新尝试
+        if row is not None and row[1] is not None:
+            self._put(kid, row, version)
+        return row
+
+    def _put(self, kid, row, version):
+        title, text, format = row
+        size = _entry_size(title, text)
+        if size > self.limit:
+            return
+        with self._lock:
+            if version != self._version:
+                return
+            old = self._entries.pop(kid, None)
+            if old is not None:
+                self._total -= old[3]
+            self._entries[kid] = (title, text, format, size)
+            self._total += size
+            while self._total > self.limit:
+                _, evicted = self._entries.popitem(last=False)
+                self._total -= evicted[3]
+
+    def invalidate(self, kid=None):
+        # kid 为 None 时清空全部缓存
+        with self._lock:
+            self._version += 1
+            if kid is None:
+                self._entries.clear()
+                self._total = 0
+            else:
+                entry = self._entries.pop(kid, None)
+                if entry is not None:
+                    self._total -= entry[3]
+
+    def _on_change(self, event):
+        # 在提交写操作的线程中调用；正文保存也会发出 renamed 事件
+        if event.kind == 'knowledge':
+            if event.action in ('renamed', 'deleted'):
+                self.invalidate(event.id)
+        elif event.action == 'deleted':
+            # 删除分类/子标题会连带删除其下的知识点，事件中没有知识点 id
+            self.invalidate()
+
+    def prefetch(self, kids):
+        with self._lock:
+            self._prefetch_generation += 1
+            generation = self._prefetch_generation
+            kids = [kid for kid in kids if kid not in self._entries][:PREFETCH_LIMIT]
+        if kids:
+            self._executor.submit(self._prefetch, kids, generation)
+
+    def _prefetch(self, kids, generation):
+        for kid in kids:
+            if generation != self._prefetch_generation:
+                return
+            if kid in self._entries:
+                continue
+            try:
+                self._load(kid)
+            except Exception:
+                # 预取失败不影响正常打开，打开时会再次读取
+                continue
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries), 'bytes': self._total}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,393 @@
+# 正文格式模块
+# 新版本以 Markdown 原文保存正文；旧版本保存的是 QTextBrowser.toHtml() 生成的 Qt 富文本
+# 这里负责把 Qt 富文本还原为 Markdown，并在启动后于后台线程把旧知识点一次性转换
+import html
+import re
+import threading
+from html.parser import HTMLParser
+from PyQt5.QtCore import QObject, pyqtSignal
+from core.note_store import FORMAT_HTML
+
+CONVERTED_SETTING = 'markdown_converted'
+
+def is_qt_html(text):
+    # 旧版本导入的 .md 文件虽标记为 html，实际是 Markdown 原文，不能按 HTML 解析
+    head = text.lstrip()[:64].lower()
+    return head.startswith('<!doctype html') or head.startswith('<html')
+
+# 等宽字体的文字视为代码
+MONO_FONT_RE = re.compile(r'font-family:[^;"]*(courier|mono|consolas)', re.I)
+BOLD_RE = re.compile(r'font-weight:\s*(bold|[6-9]00)', re.I)
+MARGIN_RE = re.compile(r'margin-(top|bottom):\s*(\d+)px')
+BACKTICKS_RE = re.compile(r'`+')
+HEADING_TAGS = {f'h{level}': level for level in range(1, 7)}
+BLOCK_TAGS = {'p', 'pre', 'li', *HEADING_TAGS}
+# 直接转换为 Markdown 标记或原样保留为行内 HTML 的标签
+INLINE_TAGS = {'span', 'a', 'b', 'strong', 'i', 'em', 'code', 'u', 's', 'del', 'sub', 'sup'}
+# Qt 富文本会生成、可以完整转换的标签；出现其他标签时认为无法完整转换
+KNOWN_TAGS = {'html', 'head', 'meta', 'style', 'title', 'body', 'ul', 'ol', 'table', 'thead', 'tbody', 'tr', 'td', 'th',
+    'img', 'br', 'hr', *BLOCK_TAGS, *INLINE_TAGS}
+SKIPPED_TAGS = {'head', 'style', 'title'}
+
+def _wrap(text, before, after=None):
+    # 标记只包住去掉首尾空白的部分，'** 粗体 **' 这样的写法不会被识别为粗体
+    core = text.strip()
+    if not core:
+        return text
+    lead = text[:len(text) - len(text.lstrip())]
+    trail = text[len(text.rstrip()):]
+    return f'{lead}{before}{core}{before if after is None else after}{trail}'
+
+def _code_span(text):
+    # 反引号比代码中最长的连续反引号多一个
+    ticks = '`' * (max(map(len, BACKTICKS_RE.findall(text)), default=0) + 1)
+    pad = ' ' if text.strip().startswith('`') or text.strip().endswith('`') else ''
+    return _wrap(text, f'{ticks}{pad}', f'{pad}{ticks}')
+
+def _url(url):
+    # Markdown 链接地址中不能有空格和括号；file:// 路径导入附件库时会先 unquote
+    return url.replace(' ', '%20').replace('(', '%28').replace(')', '%29')
+
+class _QtHtmlConverter(HTMLParser):
+    """
+    逐个标签遍历 toHtml() 的结果：每个段落为一行，<pre> 连续的段落包成围栏代码块，标题、列表、粗体、斜体、
+    等宽文字、链接和图片转为对应的 Markdown 标记，表格原样保留为 HTML 表格。
+    颜色、字号、对齐等排版样式不保留；遇到无法表示的内容时 lossless 为 False。
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.lines = []
+        self.lossless = True
+        self._skip = 0
+        # 当前段落：{'tag', 'parts', 'empty', 'top', 'bottom'}；行内标签各自收集内容，结束时加上标记后并入外层
+        self._block = None
+        self._inline = []
+        self._links = 0
+        self._code = None
+        self._lists = []
+        # 上一个输出的段落是否为列表项，列表前需要空行与上文隔开
+        self._last_li = False
+        # 上一个输出的是刚结束的列表
+        self._list_ended = False
+        self._table = None
+        self._cell = None
+        self._bottom = 0
+        self._need_blank = False
+
+    # 输出
+    def _blank(self):
+        if self.lines and self.lines[-1] != '':
+            self.lines.append('')
+
+    def _put(self, lines, separate=False):
+        if separate or self._need_blank:
+            self._blank()
+        self.lines.extend(lines)
+        self._need_blank = False
+        self._list_ended = False
+
+    def _flush_code(self):
+        if self._code is None:
+            return
+        code, self._code = self._code, None
+        fence = '`' * max(3, max(map(len, BACKTICKS_RE.findall('\n'.join(code))), default=0) + 1)
+        self._put([fence, *code, fence], separate=True)
+        self._need_blank = True
+
+    # 段落
+    def _html_mode(self):
+        # 表格单元格中的内容写成 HTML，Markdown 不会处理 HTML 块中的标记
+        return self._cell is not None
+
+    def _start_block(self, tag, attrs):
+        self._end_block()
+        style = attrs.get('style') or ''
+        margins = dict(MARGIN_RE.findall(style))
+        self._block = {'tag': tag, 'parts': [], 'empty': '-qt-paragraph-type:empty' in style,
+            'top': int(margins.get('top', 0)), 'bottom': int(margins.get('bottom', 0))}
+
+    def _ensure_block(self):
+        if self._block is None:
+            self._start_block('p', {})
+
+    def _parts(self):
+        return self._inline[-1][2] if self._inline else self._block['parts']
+
+    def _end_block(self):
+        block = self._block
+        if block is None:
+            return
+        while self._inline:
+            self._close_inline()
+        self._block = None
+        text = '' if block['empty'] else ''.join(block['parts'])
+        tag = block['tag']
+        if self._cell is not None:
+            self._cell[2].append(text)
+            return
+        if tag == 'pre':
+            if self._code is None:
+                self._code = []
+            self._code.extend(text.split('\n'))
+            self._bottom = block['bottom']
+            return
+        self._flush_code()
+        separate = (block['top'] or self._bottom) and bool(text)
+        self._bottom = block['bottom']
+        if tag in HEADING_TAGS:
+            self._put(['#' * HEADING_TAGS[tag] + ' ' + text.replace('\n', ' ')], separate=True)
+            self._need_blank = True
+        elif tag == 'li' and self._lists:
+            kind = self._lists[-1]
+            if kind[0] == 'ol':
+                marker = f'{kind[1]}. '
+                kind[1] += 1
+            else:
+                marker = '- '
+            indent = '    ' * (len(self._lists) - 1)
+            first, *rest = text.split('\n')
+            if self._list_ended and len(self._lists) == 1:
+                # 紧接着的两个列表在 Markdown 中会合并为一个，用空注释隔开
+                self._put(['<!-- -->'], separate=True)
+            self._put([f'{indent}{marker}{first}', *(indent + ' ' * len(marker) + line for line in rest)],
+                separate=len(self._lists) == 1 and not self._last_li)
+        else:
+            self._put(text.split('\n'), separate=separate)
+
+    # 行内
+    def _open_inline(self, tag, wrappers):
+        self._ensure_block()
+        self._inline.append((tag, wrappers, []))
+
+    def _close_inline(self):
+        tag, wrappers, parts = self._inline.pop()
+        text = ''.join(parts)
+        for wrapper in wrappers:
+            text = wrapper(text)
+        if tag == 'a':
+            self._links -= 1
+        self._parts().append(text)
+
+    def _inline_wrappers(self, tag, attrs):
+        html_mode = self._html_mode()
+        style = attrs.get('style') or ''
+        heading = self._block is not None and self._block['tag'] in HEADING_TAGS
+        code = tag == 'code' or bool(MONO_FONT_RE.search(style))
+        bold = tag in ('b', 'strong') or (bool(BOLD_RE.search(style)) and not heading)
+        italic = tag in ('i', 'em') or 'font-style:italic' in style.replace(' ', '')
+        wrappers = []
+        if code and not (self._block is not None and self._block['tag'] == 'pre'):
+            wrappers.append((lambda text: _wrap(text, '<code>', '</code>')) if html_mode else _code_span)
+        if bold:
+            wrappers.append((lambda text: _wrap(text, '<b>', '</b>')) if html_mode else (lambda text: _wrap(text, '**')))
+        if italic:
+            wrappers.append((lambda text: _wrap(text, '<i>', '</i>')) if html_mode else (lambda text: _wrap(text, '*')))
+        # 以下在 Markdown 中没有对应写法，保留为行内 HTML
+        compact = style.replace(' ', '')
+        if tag in ('s', 'del') or 'line-through' in compact:
+            wrappers.append(lambda text: f'<del>{text}</del>')
+        if tag == 'u' or ('underline' in compact and not self._links and tag != 'a'):
+            wrappers.append(lambda text: f'<u>{text}</u>')
+        for name, key in (('sub', 'vertical-align:sub'), ('sup', 'vertical-align:super')):
+            if tag == name or key in compact:
+                wrappers.append(lambda text, name=name: f'<{name}>{text}</{name}>')
+        return wrappers
+
+    def _link_wrapper(self, href):
+        if self._html_mode():
+            return lambda text: f'<a href="{html.escape(href)}">{text}</a>'
+        return lambda text: f'[{text}]({_url(href)})'
+
+    def _image(self, attrs):
+        src = attrs.get('src') or ''
+        alt = attrs.get('alt') or ''
+        self._ensure_block()
+        if self._block['tag'] == 'pre':
+            self.lossless = False
+        if self._html_mode():
+            self._parts().append(f'<img src="{html.escape(src)}" alt="{html.escape(alt)}">')
+        else:
+            self._parts().append(f'![{alt}]({_url(src)})')
+
+    # HTMLParser 回调
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag not in KNOWN_TAGS:
+            self.lossless = False
+        if tag in SKIPPED_TAGS:
+            self._skip += 1
+        elif tag in BLOCK_TAGS:
+            if tag != 'li':
+                self._last_li = False
+            self._start_block(tag, attrs)
+        elif tag in ('ul', 'ol'):
+            self._end_block()
+            start = attrs.get('start') or '1'
+            self._lists.append([tag, int(start) if start.isdigit() else 1])
+        elif tag == 'table':
+            self._end_block()
+            if self._table is not None:
+                # 表格中嵌套的表格无法用一个 HTML 表格表示
+                self.lossless = False
+                return
+            self._flush_code()
+            self._table = []
+        elif tag == 'tr' and self._table is not None:
+            self._end_block()
+            self._table.append([])
+        elif tag in ('td', 'th') and self._table is not None:
+            self._end_block()
+            if not self._table:
+                self._table.append([])
+            span = ''.join(f' {name}="{html.escape(attrs[name])}"' for name in ('colspan', 'rowspan') if attrs.get(name))
+            self._cell = (tag, span, [])
+            self._table[-1].append(self._cell)
+        elif tag == 'br':
+            self._ensure_block()
+            if not self._block['empty']:
+                self._parts().append('<br>' if self._html_mode() else '\n')
+        elif tag == 'img':
+            self._image(attrs)
+        elif tag == 'hr':
+            self._end_block()
+            self._flush_code()
+            self._put(['---'], separate=True)
+            self._need_blank = True
+        elif tag == 'a':
+            href = attrs.get('href')
+            if href and self._block is not None and self._block['tag'] == 'pre':
+                self.lossless = False
+            self._open_inline(tag, ([self._link_wrapper(href)] if href else []) + self._inline_wrappers(tag, attrs))
+            self._links += 1
+        elif tag in INLINE_TAGS:
+            self._open_inline(tag, self._inline_wrappers(tag, attrs))
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in INLINE_TAGS:
+            # 关闭到对应的开始标签为止，忽略没有开始标签的结束标签
+            if any(item[0] == tag for item in self._inline):
+                while self._inline:
+                    if self._inline[-1][0] == tag:
+                        self._close_inline()
+                        break
+                    self._close_inline()
+        elif tag in BLOCK_TAGS:
+            if self._block is not None and self._block['tag'] == tag:
+                self._end_block()
+                if tag == 'li':
+                    self._last_li = True
+        elif tag in ('ul', 'ol'):
+            self._end_block()
+            if self._lists:
+                self._lists.pop()
+            if not self._lists:
+                self._last_li = False
+                self._need_blank = True
+                self._list_ended = True
+        elif tag in ('td', 'th'):
+            self._end_block()
+            self._cell = None
+        elif tag == 'table' and self._table is not None:
+            self._end_block()
+            self._cell = None
+            rows = [''.join(f'<{tag}{span}>' + '<br>'.join(blocks) + f'</{tag}>' for tag, span, blocks in row)
+                for row in self._table]
+            self._table = None
+            self._put(['<table>', *(f'<tr>{row}</tr>' for row in rows), '</table>'], separate=True)
+            self._need_blank = True
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+        in_pre = self._block is not None and self._block['tag'] == 'pre'
+        if not in_pre:
+            # 段落中的换行只是 toHtml 的排版，真正的换行为 <br>
+            data = data.replace('\n', '')
+            if not data or (self._block is None and not data.strip()):
+                return
+        self._ensure_block()
+        # 不换行空格与 <br>（QTextDocument 中的 U+2028）
+        data = data.replace('\xa0', ' ')
+        if self._html_mode():
+            data = html.escape(data, quote=False).replace('\u2028', '<br>')
+        else:
+            data = data.replace('\u2028', '\n')
+        self._parts().append(data)
+
+    def finish(self):
+        self.close()
+        self._end_block()
+        self._flush_code()
+        if self._table is not None:
+            self.lossless = False
+            self.handle_endtag('table')
+        return '\n'.join(self.lines).strip('\n') + '\n' if self.lines else ''
+
+def convert_html(text):
+    """
+    把 Qt 富文本还原为 Markdown，返回 (Markdown 文本, 是否完整转换)。不是 Qt 富文本时原样返回。
+    """
+    if not is_qt_html(text):
+        return text, True
+    converter = _QtHtmlConverter()
+    converter.feed(text)
+    markdown = converter.finish()
+    return markdown, converter.lossless
+
+def html_to_markdown(text):
+    """
+    把 Qt 富文本还原为用户输入的 Markdown 文本：每个段落一行，<pre> 段落包成围栏代码块，列表项补上列表标记，
+    标题、粗体、斜体、链接和图片转为 Markdown 标记，表格保留为 HTML。
+    """
+    return convert_html(text)[0]
+
+class HtmlConversion(QObject):
+    """
+    一次性把 format='html' 的知识点转换为 Markdown。转换只解析标记文本，不需要 QTextDocument，
+    在后台线程逐个进行：导入附件在写事务之外完成，每篇一个短事务写入，期间被用户修改过的知识点不覆盖。
+    全部完成后记录到 settings，之后不再执行；无法完整转换的知识点保持 html 格式，id 记录在 skipped 中。
+    finished(转换数量) 在后台线程中发出。
+    """
+    finished = pyqtSignal(int)
+    BATCH_SIZE = 20
+
+    def __init__(self, store, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.converted = 0
+        self.skipped = []
+        self._thread = None
+
+    def start(self):
+        if self.store.db.get_setting(CONVERTED_SETTING) == '1':
+            return None
+        self._thread = threading.Thread(target=self.run, name='html-conversion', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def run(self):
+        after_id = 0
+        while True:
+            kids = self.store.db.get_knowledge_ids_by_format(FORMAT_HTML, after_id, self.BATCH_SIZE)
+            if not kids:
+                break
+            after_id = kids[-1]
+            for kid in kids:
+                self._convert(kid)
+        self.store.db.set_setting(CONVERTED_SETTING, '1')
+        self.finished.emit(self.converted)
+
+    def _convert(self, kid):
+        row = self.store.load(kid)
+        # 解密失败的知识点保持原样，不覆盖
+        if row is None or row[1] is None:
+            return
+        title, text, format = row
+        markdown, lossless = convert_html(text)
+        if not lossless:
+            self.skipped.append(kid)
+            return
+        if self.store.save(kid, title, markdown, expect=(text, format)):
+            self.converted += 1
@@ -0,0 +1,194 @@
+# 知识点正文存储模块
+# 正文按内容切分为若干块（content-defined chunking），每块单独压缩加密，以 HMAC 作为块标识全局去重
+# 保存时只加密和写入库中还没有的块，改动一个字只会产生一两个新块；未分块的旧正文仍从 knowledge_content 读取
+import hmac
+import zlib
+from core.attachments import MEDIA_REF
+from core.encryption import get_key_manager, encrypt_bytes, decrypt_bytes, decode_content
+from core.revisions import RevisionStore
+from core.search_index import SearchIndex
+
+# 块大小范围；切分点只取在行尾，超过 CHUNK_MAX 的单行（如内嵌的 base64 图片）按定长切开
+CHUNK_MIN = 2 * 1024
+CHUNK_MAX = 64 * 1024
+# 行的 crc32 低 6 位全为 0 时作为切分点，平均约 64 行一块
+BOUNDARY_MASK = 0x3F
+CHUNK_HASH_INFO = b'knowledge-chunk-id-v1'
+CHUNK_HASH_SIZE = 16
+# knowledge.format：html 为旧版本保存的 Qt 富文本，markdown 为 Markdown 原文
+FORMAT_HTML = 'html'
+FORMAT_MARKDOWN = 'markdown'
+
+def split_chunks(data: bytes):
+    """
+    按内容切块：切分点只取决于附近的行内容，插入或删除只影响所在的块，前后的块保持不变。
+    """
+    view = memoryview(data)
+    size = len(data)
+    chunks = []
+    start = pos = 0
+    while pos < size:
+        end = data.find(b'\n', pos)
+        end = size if end < 0 else end + 1
+        if end - start > CHUNK_MAX:
+            if pos > start:
+                # 加上这一行会超长，先在行首切开
+                chunks.append(bytes(view[start:pos]))
+                start = pos
+            else:
+                chunks.append(bytes(view[start:start + CHUNK_MAX]))
+                start = pos = start + CHUNK_MAX
+            continue
+        line_crc = zlib.crc32(view[pos:end])
+        pos = end
+        if end - start >= CHUNK_MIN and line_crc & BOUNDARY_MASK == 0:
+            chunks.append(bytes(view[start:end]))
+            start = end
+    if start < size:
+        chunks.append(bytes(view[start:]))
+    return chunks
+
+def chunk_hash(key, chunk):
+    # 带密钥的哈希，数据库中看不出块的明文摘要
+    return hmac.new(key, chunk, 'sha256').digest()[:CHUNK_HASH_SIZE]
+
+class NoteStore:
+    """
+    知识点正文的读写入口，负责切块、加解密和去重，并维护正文对附件的引用。
+    传入 media（AttachmentStore）时，保存前把正文中的 file:// 本地路径导入附件库。
+    保存时被覆盖的旧版本记录在 revisions（RevisionStore）中，全文索引 search（SearchIndex）在同一事务中更新。
+    """
+    def __init__(self, db, media=None):
+        self.db = db
+        self.media = media
+        self.revisions = RevisionStore(db)
+        self.search = SearchIndex(db)
+
+    def load(self, kid):
+        """
+        返回 (title, text, format)，知识点不存在时返回 None；解密失败时 text 为 None。
+        """
+        row = self.db.get_knowledge(kid)
+        if not row:
+            return None
+        _, title, content, encrypted, format = row
+        try:
+            chunks = self.db.get_knowledge_chunks(kid)
+            if chunks:
+                text = b''.join(decrypt_bytes(chunk) for chunk in chunks).decode()
+            else:
+                # 兼容历史数据：整体存储的正文，不是密文时直接返回原文
+                text = decode_content(content, encrypted)
+        except Exception:
+            text = None
+        return title, text, format or FORMAT_HTML
+
+    def save(self, kid, title, text, format=FORMAT_MARKDOWN, expect=None):
+        """
+        expect 为 (text, format) 时，只有库中的正文和格式仍与之相同才写入，用于后台改写，不覆盖期间用户的修改。
+        返回是否已写入。
+        """
+        text = self._absorb(text)
+        with self.db.transaction():
+            old = self.load(kid)
+            if expect is not None and (old is None or old[1:] != tuple(expect)):
+                return False
+            self._write(kid, title, text, format)
+            if old is not None:
+                self.revisions.record(kid, old[1], text)
+        return True
+
+    def load_revision(self, kid, seq):
+        # 还原知识点的第 seq 个历史版本；无法解密或还原时返回 None
+        row = self.load(kid)
+        if row is None:
+            return None
+        try:
+            return self.revisions.text(kid, seq, row[1])
+        except Exception:
+            return None
+
+    def create(self, title, category_id, subtitle_id, text, format=FORMAT_MARKDOWN):
+        text = self._absorb(text)
+        with self.db.transaction():
+            kid = self.db.add_knowledge(title, category_id, subtitle_id, None, encrypted=1, format=format)
+            self._write(kid, title, text, format)
+        return kid
+
+    def create_many(self, rows, format=FORMAT_MARKDOWN):
+        """
+        rows: (title, category_id, subtitle_id, text)，一次事务批量写入，返回新 id 列表。
+        导入附件、切块和计算索引词元都在写事务之外完成，事务内只加密库中还没有的块并用 executemany 写入。
+        """
+        rows = [(title, category_id, subtitle_id, self._absorb(text)) for title, category_id, subtitle_id, text in rows]
+        if not rows:
+            return []
+        chunks, bodies = self._split_many(text for _, _, _, text in rows)
+        documents = [self.search.document(title, text, format) for title, _, _, text in rows]
+        with self.db.transaction():
+            # 与 _write 相同，在写事务中查找已有块
+            known = self.db.find_chunks(chunks)
+            new_chunks = {digest: encrypt_bytes(chunk) for digest, chunk in chunks.items() if digest not in known}
+            kids = self.db.add_knowledges_bulk((title, category_id, subtitle_id, '', 1, format)
+                for title, category_id, subtitle_id, _ in rows)
+            self.db.add_knowledge_chunks_bulk(zip(kids, bodies), new_chunks)
+            self.db.add_knowledge_attachments_bulk((kid, digest) for kid, row in zip(kids, rows)
+                for digest in set(MEDIA_REF.findall(row[3])))
+            self.db.index_knowledges_bulk((kid, *document) for kid, document in zip(kids, documents))
+        return kids
+
+    def save_many(self, rows, format=FORMAT_MARKDOWN):
+        """
+        rows: (kid, title, text)，批量改写已有知识点，一次事务写入正文块、附件引用、全文索引和历史版本。
+        与 create_many 相同，导入附件、切块和计算索引词元都在写事务之外完成；已被删除的知识点跳过。
+        """
+        # 同一知识点出现多次时只保存最后一次的内容
+        rows = {kid: (title, text) for kid, title, text in rows}
+        rows = [(kid, title, self._absorb(text)) for kid, (title, text) in rows.items()]
+        if not rows:
+            return
+        chunks, bodies = self._split_many(text for _, _, text in rows)
+        documents = [self.search.document(title, text, format) for _, title, text in rows]
+        with self.db.transaction():
+            olds = [self.load(kid) for kid, _, _ in rows]
+            kept = [i for i, old in enumerate(olds) if old is not None]
+            known = self.db.find_chunks(chunks)
+            needed = {digest for i in kept for digest in bodies[i]}
+            new_chunks = {digest: encrypt_bytes(chunks[digest]) for digest in needed if digest not in known}
+            self.db.update_knowledges_bulk(((rows[i][0], rows[i][1], bodies[i], format) for i in kept), new_chunks)
+            self.db.set_knowledge_attachments_bulk((rows[i][0], MEDIA_REF.findall(rows[i][2])) for i in kept)
+            self.db.reindex_knowledges_bulk((rows[i][0], *documents[i]) for i in kept)
+            for i in kept:
+                self.revisions.record(rows[i][0], olds[i][1], rows[i][2])
+
+    def _split_many(self, texts):
+        # 返回 ({hash: 块明文}, [每篇正文按顺序的块标识])，相同的块只保留一份
+        key = get_key_manager().subkey(CHUNK_HASH_INFO)
+        chunks = {}
+        bodies = []
+        for text in texts:
+            hashes = []
+            for chunk in split_chunks(text.encode()):
+                digest = chunk_hash(key, chunk)
+                chunks.setdefault(digest, chunk)
+                hashes.append(digest)
+            bodies.append(hashes)
+        return chunks, bodies
+
+    def _absorb(self, text):
+        # 导入附件涉及文件读写，放在写事务之外
+        return self.media.absorb_file_links(text) if self.media else text
+
+    def _write(self, kid, title, text, format):
+        # 在写事务中查找已有块，保证查到的块在写入前不会被其他保存回收
+        chunks = split_chunks(text.encode())
+        key = get_key_manager().subkey(CHUNK_HASH_INFO)
+        hashes = [chunk_hash(key, chunk) for chunk in chunks]
+        known = self.db.find_chunks(set(hashes))
+        new_chunks = {}
+        for digest, chunk in zip(hashes, chunks):
+            if digest not in known and digest not in new_chunks:
+                new_chunks[digest] = encrypt_bytes(chunk)
+        self.db.save_knowledge_chunks(kid, title, hashes, new_chunks, format=format)
+        self.db.set_knowledge_attachments(kid, MEDIA_REF.findall(text))
+        self.search.index(kid, title, text, format)
@@ -0,0 +1,34 @@
+# 密文升级模块
+# 在后台把旧格式（base64 Fernet 字符串）的正文分批改写为二进制信封
+import threading
+from core.encryption import is_legacy_token, decrypt_bytes, encrypt_bytes
+
+def upgrade_legacy_contents(db, batch_size=500):
+    """
+    分批读取旧格式密文，解密后用当前密钥重新封装写回，每批一个事务。
+    无法解密的行保持原样。返回升级的行数。
+    """
+    after_id = 0
+    upgraded = 0
+    while True:
+        rows = db.get_encrypted_contents(after_id, batch_size, legacy_only=True)
+        if not rows:
+            break
+        after_id = rows[-1][0]
+        updates = []
+        for kid, body in rows:
+            if not is_legacy_token(body):
+                continue
+            try:
+                plain = decrypt_bytes(body)
+            except Exception:
+                continue
+            updates.append((encrypt_bytes(plain), kid, body))
+        upgraded += db.replace_contents(updates)
+    return upgraded
+
+def start_legacy_upgrade(db, batch_size=500):
+    # 启动后台线程执行升级，不阻塞界面
+    thread = threading.Thread(target=upgrade_legacy_contents, args=(db, batch_size), name='legacy-upgrade', daemon=True)
+    thread.start()
+    return thread
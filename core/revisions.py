@@ -0,0 +1,172 @@
+# 历史版本模块
+# 每次保存时把被覆盖的旧版本写入 knowledge_revision，保存为相对于新版本的二进制差异（反向差异），密文存储
+# 每隔 SNAPSHOT_INTERVAL 个版本保存一次完整快照；当前正文仍在分块存储中，历史中不再重复保存
+# 恢复版本时从当前正文或最近的较新快照开始依次应用差异，最多应用 SNAPSHOT_INTERVAL 个
+from difflib import SequenceMatcher
+from core.encryption import encrypt_bytes, decrypt_bytes
+
+SNAPSHOT_INTERVAL = 16
+# 在这段时间内连续保存（如自动保存）只保留编辑开始前的版本
+MERGE_SECONDS = 300
+# 保留策略：至少保留最近 KEEP_MIN 个版本，最多 MAX_REVISIONS 个，超出 KEEP_MIN 的部分只保留 RETENTION_DAYS 天
+KEEP_MIN = 20
+MAX_REVISIONS = 200
+RETENTION_DAYS = 90
+# 中间变化部分的行数乘积超过该值时不再逐行比较，直接整体替换
+MAX_MATCH_COST = 4_000_000
+
+_COPY = 0
+_INSERT = 1
+
+def _write_varint(out, value):
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+def _common_prefix(a, b):
+    # 二分查找，每次比较都是一次 memcmp
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def _common_suffix(a, b, limit):
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:] == b[len(b) - mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def make_delta(base: bytes, target: bytes) -> bytes:
+    """
+    生成把 base 变为 target 的差异：先去掉相同的前缀和后缀，中间部分按行比较。
+    格式：base 长度 | target 长度 | 操作序列；复制操作为 (长度 << 1, base 中的偏移)，插入操作为 (长度 << 1 | 1, 数据)。
+    """
+    out = bytearray()
+    _write_varint(out, len(base))
+    _write_varint(out, len(target))
+
+    def copy(offset, length):
+        if length:
+            _write_varint(out, length << 1 | _COPY)
+            _write_varint(out, offset)
+
+    def insert(data):
+        if data:
+            _write_varint(out, len(data) << 1 | _INSERT)
+            out.extend(data)
+
+    prefix = _common_prefix(base, target)
+    suffix = _common_suffix(base, target, min(len(base), len(target)) - prefix)
+    copy(0, prefix)
+    old = base[prefix:len(base) - suffix]
+    new = target[prefix:len(target) - suffix]
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    if old_lines and new_lines and len(old_lines) * len(new_lines) <= MAX_MATCH_COST:
+        old_offsets = [prefix]
+        for line in old_lines:
+            old_offsets.append(old_offsets[-1] + len(line))
+        for tag, i1, i2, j1, j2 in SequenceMatcher(None, old_lines, new_lines, autojunk=False).get_opcodes():
+            if tag == 'equal':
+                copy(old_offsets[i1], old_offsets[i2] - old_offsets[i1])
+            else:
+                insert(b''.join(new_lines[j1:j2]))
+    else:
+        insert(new)
+    copy(len(base) - suffix, suffix)
+    return bytes(out)
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    base_size, pos = _read_varint(delta, 0)
+    if base_size != len(base):
+        raise ValueError('差异与基准版本不匹配')
+    target_size, pos = _read_varint(delta, pos)
+    parts = []
+    while pos < len(delta):
+        op, pos = _read_varint(delta, pos)
+        length = op >> 1
+        if op & 1 == _INSERT:
+            parts.append(delta[pos:pos + length])
+            pos += length
+        else:
+            offset, pos = _read_varint(delta, pos)
+            parts.append(base[offset:offset + length])
+    result = b''.join(parts)
+    if len(result) != target_size:
+        raise ValueError('差异数据已损坏')
+    return result
+
+class RevisionStore:
+    """
+    record() 在保存事务中调用，记录被覆盖的旧版本；list() 列出历史版本，text() 还原任意版本。
+    """
+    def __init__(self, db):
+        self.db = db
+
+    def record(self, kid, old_text, new_text):
+        if old_text is None or old_text == new_text:
+            return
+        old = old_text.encode()
+        new = new_text.encode()
+        latest = self.db.get_latest_revision(kid, MERGE_SECONDS)
+        if latest is not None:
+            rev_id, seq, snapshot, since, recent, body = latest
+            if recent:
+                # 合并到最近的版本：它记录的是这段编辑开始前的内容，中间状态不再保留
+                if snapshot:
+                    return
+                try:
+                    older = apply_delta(old, decrypt_bytes(body))
+                except Exception:
+                    # 正文在保存之外被改写过，差异无法应用时新记一个版本
+                    pass
+                else:
+                    self.db.update_revision(rev_id, *self._encode(older, new, False))
+                    return
+            seq, since = seq + 1, since + 1
+        else:
+            seq, since = 1, 1
+        self.db.add_revision(kid, seq, *self._encode(old, new, since >= SNAPSHOT_INTERVAL))
+        self.db.prune_revisions(kid, KEEP_MIN, MAX_REVISIONS, RETENTION_DAYS)
+
+    @staticmethod
+    def _encode(text, newer, snapshot):
+        # 返回 (snapshot, size, body)：差异比原文一半还大时直接保存快照
+        if not snapshot:
+            delta = make_delta(newer, text)
+            if len(delta) <= len(text) // 2:
+                return 0, len(text), encrypt_bytes(delta)
+        return 1, len(text), encrypt_bytes(text)
+
+    def list(self, kid):
+        # [(seq, snapshot, size, stored_size, created_at)]，最新的在前；created_at 为该版本被覆盖的时间
+        return self.db.get_revisions(kid)
+
+    def text(self, kid, seq, current):
+        """
+        还原第 seq 个版本，current 为当前正文。
+        """
+        text = current.encode() if current is not None else None
+        for _, snapshot, body in self.db.get_revision_chain(kid, seq):
+            plain = decrypt_bytes(body)
+            text = plain if snapshot else apply_delta(text, plain)
+        return text.decode()
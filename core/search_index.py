@@ -0,0 +1,163 @@
+# 全文检索模块
+# 正文加密存储，库中无法直接搜索明文；这里把标题和正文切成词，用带密钥的 HMAC 得到盲化词元后写入 FTS5 索引
+# 索引中只有排序后的盲化词元，不含明文和词序；查询词做同样处理后匹配，查询时不需要解密任何正文
+# 中日韩文字按单字和相邻两字（bigram）切分，其他文字按单词切分
+import base64
+import hmac
+import html
+import operator
+import re
+import threading
+import unicodedata
+from collections import Counter
+from core.encryption import get_key_manager
+
+SEARCH_KEY_INFO = b'knowledge-search-v1'
+# 词元取 HMAC 的前 5 字节，base32 编码为 8 个字符；索引中词元文本占大部分空间，碰撞只会多出个别误命中
+TOKEN_SIZE = 5
+# 超过该长度的“单词”多为哈希、base64 等，不建索引
+MAX_WORD = 32
+# 同一词在一篇中最多计数的次数，限制长文对排序的影响和索引体积
+MAX_REPEAT = 3
+# 标题命中的权重
+TITLE_WEIGHT = 10.0
+TOKEN_CACHE_SIZE = 100000
+# 索引所用密钥的 key_id；密钥轮换后盲化词元全部改变，需要重建索引
+INDEX_KEY_SETTING = 'search_index_key'
+
+CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+CJK_RUN_RE = re.compile(f'[{CJK}]+')
+WORD_RE = re.compile(f'[^\\W{CJK}]+')
+HTML_HEAD_RE = re.compile(r'<head>.*?</head>', re.S | re.I)
+HTML_TAG_RE = re.compile(r'<[^>]+>')
+
+def split_terms(text, query=False):
+    """
+    切词，返回词的列表（不保证顺序）：中日韩文字的连续片段产生单字和相邻两字，查询时两字以上的片段只用相邻两字；其他按单词小写。
+    """
+    text = unicodedata.normalize('NFKC', text).lower()
+    # 逐词的处理都交给正则和 map，批量导入时切词是建索引的主要开销
+    terms = [word for word in WORD_RE.findall(text) if len(word) <= MAX_WORD]
+    for run in CJK_RUN_RE.findall(text):
+        if not query or len(run) == 1:
+            terms.extend(run)
+        terms.extend(map(operator.add, run, run[1:]))
+    return terms
+
+def _plain_text(text, format):
+    # 尚未转换的旧版 Qt 富文本去掉标签再切词
+    if format == 'html' and text.lstrip().startswith('<'):
+        return html.unescape(HTML_TAG_RE.sub(' ', HTML_HEAD_RE.sub(' ', text)))
+    return text
+
+class SearchIndex:
+    """
+    index() 在保存知识点的事务中更新索引；search() 返回按相关度排序的结果；backfill() 为尚未建索引的知识点补建。
+    """
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self._key = None
+        self._tokens = {}
+
+    def _blind(self, terms):
+        key = get_key_manager().subkey(SEARCH_KEY_INFO)
+        with self._lock:
+            if key != self._key or len(self._tokens) > TOKEN_CACHE_SIZE:
+                self._key = key
+                self._tokens = {}
+            tokens = self._tokens
+            result = []
+            for term in terms:
+                token = tokens.get(term)
+                if token is None:
+                    digest = hmac.new(key, term.encode(), 'sha256').digest()[:TOKEN_SIZE]
+                    token = tokens[term] = base64.b32encode(digest).decode().lower()
+                result.append(token)
+            return result
+
+    def _field(self, text):
+        # 词元排序后拼接，保留词频但不保留词序
+        counts = Counter(split_terms(text))
+        terms = list(counts)
+        return ' '.join(token for term, token in sorted(zip(terms, self._blind(terms)), key=lambda pair: pair[1])
+            for _ in range(min(counts[term], MAX_REPEAT)))
+
+    def document(self, title, text, format='markdown'):
+        # 返回写入索引的 (标题词元, 正文词元)
+        return self._field(title or ''), self._field(_plain_text(text or '', format))
+
+    def index(self, kid, title, text, format='markdown'):
+        self.db.index_knowledge(kid, *self.document(title, text, format))
+
+    def search(self, query, limit=50):
+        """
+        返回 [(kid, title, cat_id, cat_name, sub_id, sub_name)]，按相关度排序；所有查询词都要命中。
+        """
+        tokens = sorted(set(self._blind(set(split_terms(query, query=True)))))
+        if not tokens:
+            return []
+        match = ' AND '.join(f'"{token}"' for token in tokens)
+        return self.db.search_knowledge(match, limit, TITLE_WEIGHT)
+
+    def backfill(self, store, batch_size=200):
+        """
+        为没有索引的知识点建索引；索引所用密钥与当前密钥不同时先清空重建。返回建索引的数量。
+        """
+        key_id = get_key_manager().active_key_id().hex()
+        if self.db.get_setting(INDEX_KEY_SETTING) != key_id:
+            with self.db.transaction():
+                self.db.clear_search_index()
+                self.db.set_setting(INDEX_KEY_SETTING, key_id)
+        after_id = 0
+        indexed = 0
+        while True:
+            kids = self.db.get_unindexed_knowledge_ids(after_id, batch_size)
+            if not kids:
+                return indexed
+            after_id = kids[-1]
+            rows = []
+            for kid in kids:
+                row = store.load(kid)
+                if row is None:
+                    continue
+                title, text, format = row
+                rows.append((kid, *self.document(title, text or '', format)))
+            # 期间被保存过的知识点已由保存建好索引，这里不会覆盖
+            indexed += self.db.add_missing_search_rows(rows)
+
+def start_search_indexing(store):
+    # 启动后台线程补建索引，不阻塞界面
+    thread = threading.Thread(target=store.search.backfill, args=(store,), name='search-index', daemon=True)
+    thread.start()
+    return thread
+
+def make_snippet(text, query, width=40):
+    """
+    返回正文中第一个命中处前后 width 个字符的 HTML 片段，命中的词加粗；没有命中时取开头。
+    """
+    text = ' '.join(text.split())
+    words = sorted({word for word in query.split() if word}, key=len, reverse=True)
+    pattern = None
+    match = None
+    # 先按整个查询词匹配，找不到时退回到切词结果（中文按相邻两字）
+    for candidates in (words, sorted(set(split_terms(query, query=True)), key=len, reverse=True)):
+        if candidates:
+            pattern = re.compile('|'.join(re.escape(word) for word in candidates), re.I)
+            match = pattern.search(text)
+            if match:
+                break
+    start = max(0, match.start() - width) if match else 0
+    end = min(len(text), (match.end() if match else 0) + width * 2)
+    piece = text[start:end]
+    parts = []
+    pos = 0
+    if match:
+        for hit in pattern.finditer(piece):
+            parts.append(html.escape(piece[pos:hit.start()]))
+            parts.append(f'<b>{html.escape(hit.group())}</b>')
+            pos = hit.end()
+    parts.append(html.escape(piece[pos:]))
+    # 相邻的命中（如中文的连续两字）合并为一段加粗
+    body = ''.join(parts).replace('</b><b>', '')
+    return ('…' if start > 0 else '') + body + ('…' if end < len(text) else '')
@@ -0,0 +1,160 @@
+# 标签索引模块
+# 每个标签在内存中保存一张位图，第 kid 位表示该知识点带有这个标签；多标签筛选只需把位图按位与，不查询数据库
+# 位图启动后在后台线程从 knowledge_tag 按标签顺序一次建立，之后根据数据库变更事件只修改改动的知识点对应的位
+import re
+import threading
+from itertools import groupby
+
+try:
+    _popcount = int.bit_count
+except AttributeError:
+    # Python 3.9 没有 int.bit_count
+    def _popcount(value):
+        return bin(value).count('1')
+
+# 每个字节值中为 1 的位
+_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+_NONZERO_RE = re.compile(rb'[^\x00]')
+
+def _ids_of(bits):
+    # 位图中为 1 的位即知识点 id，升序返回；用正则跳过全零的字节
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    ids = []
+    for match in _NONZERO_RE.finditer(data):
+        pos = match.start()
+        ids.extend(pos * 8 + bit for bit in _BITS[data[pos]])
+    return ids
+
+class TagIndex:
+    """
+    tags() 返回 [(tag_id, name, 知识点数)]；match(tag_ids) 返回同时带有这些标签的知识点 id（升序）；
+    counts(tag_ids) 返回在 match(tag_ids) 的结果中各标签的知识点数，用于筛选面板显示。
+    创建后为空，reload() 或 start_tag_index() 建立位图；内容改变后调用 add_listener 注册的回调。
+    """
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        # tag_id -> bytearray 位图，单个知识点增删标签时直接改对应的位
+        self._maps = {}
+        # tag_id -> 位图对应的整数，按位运算时使用，位图修改后丢弃
+        self._ints = {}
+        self._names = {}
+        self._counts = {}
+        self._listeners = []
+        db.add_listener(self._on_change)
+
+    def add_listener(self, callback):
+        # callback()，在修改索引的线程中调用
+        self._listeners.append(callback)
+
+    def _notify(self):
+        for callback in list(self._listeners):
+            callback()
+
+    def reload(self):
+        with self._lock:
+            self._maps = {}
+            self._ints = {}
+            self._names = {}
+            self._counts = {}
+            names = {tag_id: name for tag_id, name, _ in self.db.get_tags()}
+            for tag_id, rows in groupby(self.db.iter_tag_postings(), key=lambda row: row[0]):
+                kids = [kid for _, kid in rows]
+                bitmap = bytearray((kids[-1] >> 3) + 1)
+                for kid in kids:
+                    bitmap[kid >> 3] |= 1 << (kid & 7)
+                self._maps[tag_id] = bitmap
+                self._counts[tag_id] = len(kids)
+                # 两次读取之间新建的标签，名称随后由 tagged 事件补上
+                self._names[tag_id] = names.get(tag_id, '')
+        self._notify()
+
+    def _on_change(self, event):
+        # 在提交写操作的线程中调用
+        if event.kind == 'knowledge':
+            if event.action == 'tagged':
+                self._update(event.id, self.db.get_knowledge_tags(event.id))
+            elif event.action == 'deleted':
+                self._update(event.id, [])
+        elif event.action == 'deleted':
+            # 删除分类/子标题会连带删除其下的知识点，事件中没有知识点 id
+            self.reload()
+
+    def _update(self, kid, rows):
+        # 把知识点 kid 的标签改为 rows: [(tag_id, name)]
+        tags = dict(rows)
+        pos, mask = kid >> 3, 1 << (kid & 7)
+        changed = False
+        with self._lock:
+            for tag_id, bitmap in list(self._maps.items()):
+                if tag_id not in tags and pos < len(bitmap) and bitmap[pos] & mask:
+                    bitmap[pos] &= ~mask
+                    changed = True
+                    self._ints.pop(tag_id, None)
+                    self._counts[tag_id] -= 1
+                    if not self._counts[tag_id]:
+                        del self._maps[tag_id], self._counts[tag_id], self._names[tag_id]
+            for tag_id, name in tags.items():
+                bitmap = self._maps.setdefault(tag_id, bytearray())
+                changed = changed or self._names.get(tag_id) != name
+                self._names[tag_id] = name
+                if pos >= len(bitmap):
+                    bitmap.extend(bytes(pos + 1 - len(bitmap)))
+                if not bitmap[pos] & mask:
+                    bitmap[pos] |= mask
+                    changed = True
+                    self._ints.pop(tag_id, None)
+                    self._counts[tag_id] = self._counts.get(tag_id, 0) + 1
+        if changed:
+            self._notify()
+
+    def _int(self, tag_id):
+        value = self._ints.get(tag_id)
+        if value is None:
+            bitmap = self._maps.get(tag_id)
+            value = self._ints[tag_id] = int.from_bytes(bitmap, 'little') if bitmap else 0
+        return value
+
+    def _intersect(self, tag_ids):
+        # 调用方持有锁；从知识点最少的标签开始，结果为 0 时提前结束
+        bits = None
+        for tag_id in sorted(set(tag_ids), key=lambda tag_id: self._counts.get(tag_id, 0)):
+            bits = self._int(tag_id) if bits is None else bits & self._int(tag_id)
+            if not bits:
+                return 0
+        return bits
+
+    def tags(self):
+        with self._lock:
+            return sorted(((tag_id, self._names[tag_id], count) for tag_id, count in self._counts.items()),
+                key=lambda row: row[1].lower())
+
+    def match(self, tag_ids):
+        if not tag_ids:
+            return []
+        with self._lock:
+            bits = self._intersect(tag_ids)
+        return _ids_of(bits) if bits else []
+
+    def counts(self, tag_ids=()):
+        """
+        返回 {tag_id: 数量}；tag_ids 为空时为各标签的知识点总数，否则只统计同时带有 tag_ids 中所有标签的知识点。
+        """
+        with self._lock:
+            if not tag_ids:
+                return dict(self._counts)
+            bits = self._intersect(tag_ids)
+            if not bits:
+                return {}
+            counts = {}
+            for tag_id in self._maps:
+                count = _popcount(self._int(tag_id) & bits)
+                if count:
+                    counts[tag_id] = count
+            return counts
+
+def start_tag_index(index):
+    # 启动后台线程建立标签位图，不阻塞界面
+    thread = threading.Thread(target=index.reload, name='tag-index', daemon=True)
+    thread.start()
+    return thread
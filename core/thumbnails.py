@@ -0,0 +1,146 @@
+# 缩略图缓存模块
+# 在工作线程中把附件图片缩放到显示宽度，按 (sha256, 宽度) 缓存在 config/thumbs/ 下
+# 缓存总大小超过 CACHE_LIMIT 时按最近使用时间淘汰；原图加密的附件，缩略图同样加密保存
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5.QtCore import QObject, QBuffer, QByteArray, QIODevice, Qt, pyqtSignal
+from PyQt5.QtGui import QImageReader
+from core.encryption import encrypt_bytes, decrypt_bytes
+
+THUMB_DIR = os.path.join(os.path.dirname(__file__), '../config/thumbs')
+CACHE_LIMIT = 256 * 1024 * 1024
+JPEG_QUALITY = 85
+
+class ThumbnailCache(QObject):
+    """
+    get() 命中时返回缩略图数据；未命中时在后台生成，完成后发出 ready(hash, width)。
+    原图不比目标宽度大时不生成缩略图，get() 直接返回原图。
+    """
+    ready = pyqtSignal(str, int)
+
+    def __init__(self, media, root=None, limit=CACHE_LIMIT, parent=None):
+        super().__init__(parent)
+        self.media = media
+        self.root = root or THUMB_DIR
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='thumbnail')
+        self._pending = set()
+        # (digest, width)：原图不宽于 width，不生成缩略图，直接返回原图
+        self._originals = set()
+        # 文件路径 -> 大小，按最近使用排序；首次使用时扫描目录
+        self._index = None
+        self._total = 0
+
+    def path_of(self, digest, width):
+        return os.path.join(self.root, digest[:2], f'{digest}_{width}')
+
+    def get(self, digest, width):
+        if (digest, width) in self._originals:
+            return self.media.read_all(digest)
+        path = self.path_of(digest, width)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.request(digest, width)
+            return None
+        self._touch(path)
+        info = self.media.info(digest)
+        return decrypt_bytes(data) if info and info[4] else data
+
+    def request(self, digest, width):
+        with self._lock:
+            if (digest, width) in self._pending:
+                return
+            self._pending.add((digest, width))
+        self._executor.submit(self._generate, digest, width)
+
+    def _generate(self, digest, width):
+        try:
+            info = self.media.info(digest)
+            if info is None:
+                return
+            encrypted = info[4]
+            if encrypted:
+                data = self.media.read_all(digest)
+                if data is None:
+                    return
+                device = QBuffer()
+                device.setData(QByteArray(data))
+                reader = QImageReader(device)
+            else:
+                reader = QImageReader(self.media.path_of(digest))
+            reader.setAutoTransform(True)
+            size = reader.size()
+            if size.isValid() and size.width() <= width:
+                self._originals.add((digest, width))
+                self.ready.emit(digest, width)
+                return
+            if size.isValid():
+                # JPEG 等格式可以直接按缩小后的尺寸解码，不需要先解出整张原图
+                reader.setScaledSize(size.scaled(width, size.height(), Qt.KeepAspectRatio))
+            image = reader.read()
+            if image.isNull():
+                return
+            buffer = QBuffer()
+            buffer.open(QIODevice.WriteOnly)
+            image.save(buffer, 'PNG' if image.hasAlphaChannel() else 'JPG', JPEG_QUALITY)
+            payload = bytes(buffer.data())
+            if encrypted:
+                payload = encrypt_bytes(payload, codec='none')
+            self._store(self.path_of(digest, width), payload)
+            self.ready.emit(digest, width)
+        finally:
+            with self._lock:
+                self._pending.discard((digest, width))
+
+    def _load_index(self):
+        # 调用方持有 _lock
+        if self._index is not None:
+            return
+        entries = []
+        if os.path.isdir(self.root):
+            for sub in os.scandir(self.root):
+                if sub.is_dir():
+                    for entry in os.scandir(sub.path):
+                        if entry.name.endswith('.tmp'):
+                            continue
+                        st = entry.stat()
+                        entries.append((st.st_mtime, entry.path, st.st_size))
+        entries.sort()
+        self._index = OrderedDict((path, size) for _, path, size in entries)
+        self._total = sum(self._index.values())
+
+    def _touch(self, path):
+        with self._lock:
+            self._load_index()
+            if path in self._index:
+                self._index.move_to_end(path)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def _store(self, path, payload):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp, path)
+        with self._lock:
+            self._load_index()
+            self._total += len(payload) - self._index.pop(path, 0)
+            self._index[path] = len(payload)
+            while self._total > self.limit and len(self._index) > 1:
+                old, size = self._index.popitem(last=False)
+                self._total -= size
+                try:
+                    os.remove(old)
+                except FileNotFoundError:
+                    pass
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
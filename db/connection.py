@@ -0,0 +1,168 @@
+# 数据库连接管理模块
+# 同一数据库文件在进程内共享一个写连接，读连接按线程复用；统一设置 WAL 等 pragma
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+
+# 连接级 pragma，每个新连接都要设置
+PRAGMAS = (
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA foreign_keys=ON',
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA cache_size=-16000',
+)
+CACHED_STATEMENTS = 512
+# 线程结束后最多保留的空闲读连接数，多出的直接关闭
+MAX_IDLE_READERS = 4
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_connection_manager(path):
+    """
+    返回 path 对应的进程级 ConnectionManager，首次调用时创建。
+    """
+    with _managers_lock:
+        manager = _managers.get(path)
+        if manager is None:
+            manager = _managers[path] = ConnectionManager(path)
+        return manager
+
+
+def close_all():
+    with _managers_lock:
+        for manager in _managers.values():
+            manager.close()
+        _managers.clear()
+
+
+class _Reader:
+    # 放在线程局部变量中；线程结束时（Qt 线程池每个任务结束时也是）被释放，连接交回空闲池
+    __slots__ = ('conn', '__weakref__')
+
+    def __init__(self, conn):
+        self.conn = conn
+
+
+class ConnectionManager:
+    def __init__(self, path):
+        self.path = path
+        # 写连接可被后台线程使用，所有写入都在 lock 内进行
+        self.lock = threading.RLock()
+        self._writer = None
+        self._readers = threading.local()
+        self._readers_lock = threading.RLock()
+        self._all_readers = []
+        self._idle_readers = []
+        self._depth = 0
+        self._owner = None
+        self._after_commit = []
+
+    def _connect(self, check_same_thread=True):
+        conn = sqlite3.connect(self.path, cached_statements=CACHED_STATEMENTS, check_same_thread=check_same_thread)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def writer(self):
+        with self.lock:
+            if self._writer is None:
+                conn = self._connect(check_same_thread=False)
+                # journal_mode 是持久化的，写入数据库文件后对之后的所有连接生效
+                conn.execute('PRAGMA journal_mode=WAL')
+                self._writer = conn
+            return self._writer
+
+    def reader(self):
+        """
+        当前线程的只读连接。WAL 模式下读不会被写阻塞，也只会看到已提交的数据。
+        """
+        holder = getattr(self._readers, 'holder', None)
+        if holder is None:
+            with self._readers_lock:
+                conn = self._idle_readers.pop() if self._idle_readers else None
+            if conn is None:
+                self.writer()  # 确保 WAL 已启用
+                # 连接会在线程之间转交，但同一时间只属于一个线程
+                conn = self._connect(check_same_thread=False)
+                conn.execute('PRAGMA query_only=ON')
+                with self._readers_lock:
+                    self._all_readers.append(conn)
+            holder = self._readers.holder = _Reader(conn)
+            weakref.finalize(holder, self._release_reader, conn)
+        return holder.conn
+
+    def _release_reader(self, conn):
+        with self._readers_lock:
+            if conn not in self._all_readers:
+                return  # 已由 close() 关闭
+            if len(self._idle_readers) < MAX_IDLE_READERS:
+                self._idle_readers.append(conn)
+                return
+            self._all_readers.remove(conn)
+        conn.close()
+
+    def in_transaction(self):
+        return self._depth > 0 and self._owner == threading.get_ident()
+
+    @contextmanager
+    def transaction(self):
+        """
+        写事务，可嵌套：只有最外层提交一次；内层用 SAVEPOINT，异常时只回滚该层。
+        产出写连接的游标。
+        """
+        with self.lock:
+            conn = self.writer()
+            outermost = self._depth == 0
+            savepoint = f'sp{self._depth}'
+            if outermost:
+                self._owner = threading.get_ident()
+                if conn.in_transaction:
+                    conn.commit()
+                conn.execute('BEGIN IMMEDIATE')
+            else:
+                conn.execute(f'SAVEPOINT {savepoint}')
+            mark = len(self._after_commit)
+            self._depth += 1
+            try:
+                yield conn.cursor()
+            except BaseException:
+                self._depth -= 1
+                if outermost:
+                    conn.rollback()
+                    self._after_commit.clear()
+                else:
+                    conn.execute(f'ROLLBACK TO {savepoint}')
+                    conn.execute(f'RELEASE {savepoint}')
+                    del self._after_commit[mark:]
+                raise
+            self._depth -= 1
+            if not outermost:
+                conn.execute(f'RELEASE {savepoint}')
+            else:
+                conn.commit()
+                callbacks, self._after_commit = self._after_commit, []
+                for callback in callbacks:
+                    callback()
+
+    def after_commit(self, callback):
+        # 事务中登记的回调在最外层提交后执行，回滚时丢弃；不在事务中则立即执行
+        if self.in_transaction():
+            self._after_commit.append(callback)
+        else:
+            callback()
+
+    def close(self):
+        with self.lock, self._readers_lock:
+            for conn in self._all_readers:
+                conn.close()
+            self._all_readers = []
+            self._idle_readers = []
+            self._readers = threading.local()
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
@@ -1,157 +1,673 @@
 # 数据库管理模块
 # 负责sqlite3数据库的初始化、连接、基本操作
-import sqlite3
 import os
+from collections import namedtuple
+from contextlib import contextmanager
+from itertools import groupby
+from db.connection import get_connection_manager
+from db.migrations import migrate
 
 DB_PATH = os.path.join(os.path.dirname(__file__), '../config/knowledge.db')
 
+# 数据变更事件
+# action: inserted / renamed / moved / deleted / tagged（知识点的标签改变）
+# kind: category / subtitle / knowledge
+ChangeEvent = namedtuple('ChangeEvent', 'action kind id title cat_id sub_id', defaults=(None, None, None))
+
+def split_tags(tags):
+    """
+    tags 为逗号（含全角逗号）分隔的文本或标签列表；去掉多余空白，不区分大小写去重，保持原顺序。
+    """
+    if isinstance(tags, str):
+        tags = tags.replace('，', ',').split(',')
+    names = []
+    seen = set()
+    for name in tags:
+        name = ' '.join(name.split())
+        if name and name.lower() not in seen:
+            seen.add(name.lower())
+            names.append(name)
+    return names
+
 class Database:
     def __init__(self):
-        self.conn = sqlite3.connect(DB_PATH)
+        # 同一进程内的 Database 实例共享连接，见 db/connection.py
+        self.manager = get_connection_manager(DB_PATH)
+        self.conn = self.manager.writer()
+        self._listeners = []
         self.create_tables()
 
+    @property
+    def reader(self):
+        # 事务中读自己未提交的写入需要用写连接，其余读操作走不阻塞的读连接
+        if self.manager.in_transaction():
+            return self.conn
+        return self.manager.reader()
+
+    @contextmanager
+    def transaction(self):
+        """
+        将多次写操作合并为一次提交，可嵌套；变更事件在最外层提交后才发出。
+        """
+        with self.manager.transaction() as cursor:
+            yield cursor
+
+    def add_listener(self, callback):
+        # callback(ChangeEvent)，在每次写操作提交后调用
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def _emit(self, *args, **kwargs):
+        event = ChangeEvent(*args, **kwargs)
+        self.manager.after_commit(lambda: self._dispatch(event))
+
+    def _dispatch(self, event):
+        for callback in list(self._listeners):
+            callback(event)
+
     def create_tables(self):
-        cursor = self.conn.cursor()
-        # 分类表
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS category (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL
-        )''')
-        # 子标题表
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS subtitle (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            category_id INTEGER,
-            UNIQUE(name, category_id),
-            FOREIGN KEY(category_id) REFERENCES category(id) ON DELETE CASCADE
-        )''')
-        # 知识点表
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS knowledge (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT,
-            category_id INTEGER,
-            subtitle_id INTEGER,
-            content TEXT,
-            tags TEXT,
-            encrypted INTEGER DEFAULT 0,
-            created_at TEXT,
-            updated_at TEXT,
-            FOREIGN KEY(category_id) REFERENCES category(id) ON DELETE SET NULL,
-            FOREIGN KEY(subtitle_id) REFERENCES subtitle(id) ON DELETE SET NULL
-        )''')
-        # 日程表
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS schedule (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT,
-            description TEXT,
-            start_time TEXT,
-            end_time TEXT,
-            remind_time TEXT,
-            remind_type TEXT DEFAULT '提前1小时',
-            notified INTEGER DEFAULT 0,
-            finished INTEGER DEFAULT 0
-        )''')
-        # 专注记录表
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS focus (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            start_time TEXT,
-            end_time TEXT,
-            duration INTEGER
-        )''')
-        # 用户设置表
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS settings (
-            key TEXT PRIMARY KEY,
-            value TEXT
-        )''')
-        self.conn.commit()
+        # 建表与索引均由迁移步骤完成，已有数据库首次打开时自动升级
+        with self.manager.lock:
+            migrate(self.conn)
 
     # 分类操作
     def add_category(self, name):
-        cursor = self.conn.cursor()
-        cursor.execute('INSERT OR IGNORE INTO category (name) VALUES (?)', (name,))
-        self.conn.commit()
+        with self.transaction() as cursor:
+            cursor.execute('INSERT OR IGNORE INTO category (name) VALUES (?)', (name,))
+        if cursor.rowcount == 1:
+            self._emit('inserted', 'category', cursor.lastrowid, name, cursor.lastrowid)
         return cursor.lastrowid
 
     def get_categories(self):
-        cursor = self.conn.cursor()
+        cursor = self.reader.cursor()
         cursor.execute('SELECT id, name FROM category ORDER BY id')
         return cursor.fetchall()
 
     def rename_category(self, cat_id, new_name):
-        cursor = self.conn.cursor()
-        cursor.execute('UPDATE category SET name=? WHERE id=?', (new_name, cat_id))
-        self.conn.commit()
+        with self.transaction() as cursor:
+            cursor.execute('UPDATE category SET name=? WHERE id=?', (new_name, cat_id))
+        self._emit('renamed', 'category', cat_id, new_name)
 
     def delete_category(self, cat_id):
-        cursor = self.conn.cursor()
-        cursor.execute('DELETE FROM category WHERE id=?', (cat_id,))
-        self.conn.commit()
+        with self.transaction() as cursor:
+            # 与界面提示一致：连同子标题和知识点一起删除
+            chunk_ids = self._chunk_ids_of(cursor, 'SELECT id FROM knowledge WHERE category_id=?', (cat_id,))
+            cursor.execute('DELETE FROM knowledge WHERE category_id=?', (cat_id,))
+            cursor.execute('DELETE FROM subtitle WHERE category_id=?', (cat_id,))
+            cursor.execute('DELETE FROM category WHERE id=?', (cat_id,))
+            self._gc_chunks(cursor, chunk_ids)
+        self._emit('deleted', 'category', cat_id)
 
     # 子标题操作
     def add_subtitle(self, name, category_id):
-        cursor = self.conn.cursor()
-        cursor.execute('INSERT OR IGNORE INTO subtitle (name, category_id) VALUES (?, ?)', (name, category_id))
-        self.conn.commit()
+        with self.transaction() as cursor:
+            cursor.execute('INSERT OR IGNORE INTO subtitle (name, category_id) VALUES (?, ?)', (name, category_id))
+        if cursor.rowcount == 1:
+            self._emit('inserted', 'subtitle', cursor.lastrowid, name, category_id, cursor.lastrowid)
         return cursor.lastrowid
 
     def get_subtitles(self, category_id):
-        cursor = self.conn.cursor()
+        cursor = self.reader.cursor()
         cursor.execute('SELECT id, name FROM subtitle WHERE category_id=? ORDER BY id', (category_id,))
         return cursor.fetchall()
 
     def rename_subtitle(self, sub_id, new_name):
-        cursor = self.conn.cursor()
-        cursor.execute('UPDATE subtitle SET name=? WHERE id=?', (new_name, sub_id))
-        self.conn.commit()
+        with self.transaction() as cursor:
+            cursor.execute('UPDATE subtitle SET name=? WHERE id=?', (new_name, sub_id))
+        self._emit('renamed', 'subtitle', sub_id, new_name)
 
     def delete_subtitle(self, sub_id):
-        cursor = self.conn.cursor()
-        cursor.execute('DELETE FROM subtitle WHERE id=?', (sub_id,))
-        self.conn.commit()
+        with self.transaction() as cursor:
+            chunk_ids = self._chunk_ids_of(cursor, 'SELECT id FROM knowledge WHERE subtitle_id=?', (sub_id,))
+            cursor.execute('DELETE FROM knowledge WHERE subtitle_id=?', (sub_id,))
+            cursor.execute('DELETE FROM subtitle WHERE id=?', (sub_id,))
+            self._gc_chunks(cursor, chunk_ids)
+        self._emit('deleted', 'subtitle', sub_id)
 
     # 知识点操作（部分示例，后续可迁移完善）
-    def add_knowledge(self, title, category_id, subtitle_id, content, tags='', encrypted=0):
-        cursor = self.conn.cursor()
-        cursor.execute('INSERT INTO knowledge (title, category_id, subtitle_id, content, tags, encrypted, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, datetime("now"), datetime("now"))',
-            (title, category_id, subtitle_id, content, tags, encrypted))
-        self.conn.commit()
-        return cursor.lastrowid
+    def add_knowledge(self, title, category_id, subtitle_id, content, tags='', encrypted=0, format='html'):
+        with self.transaction() as cursor:
+            cursor.execute('INSERT INTO knowledge (title, category_id, subtitle_id, encrypted, format, created_at, updated_at) VALUES (?, ?, ?, ?, ?, datetime("now"), datetime("now"))',
+                (title, category_id, subtitle_id, encrypted, format))
+            kid = cursor.lastrowid
+            if tags:
+                self._set_tags(cursor, kid, tags)
+            # content 为 None 时由调用方随后写入分块正文
+            if content is not None:
+                cursor.execute('INSERT INTO knowledge_content (knowledge_id, body) VALUES (?, ?)', (kid, content))
+        self._emit('inserted', 'knowledge', kid, title, category_id, subtitle_id)
+        return kid
+
+    # get_knowledges 可选的列与排序字段；正文在 knowledge_content 表中，列表查询不会读取
+    KNOWLEDGE_COLUMNS = ('id', 'title', 'category_id', 'subtitle_id', 'tags', 'encrypted', 'format', 'created_at', 'updated_at')
+    # 由其他表计算出的列：tags 为按名称排序、逗号分隔的标签名，来自 knowledge_tag / tag，没有标签时为空串
+    KNOWLEDGE_COMPUTED = {
+        'tags': """COALESCE((SELECT group_concat(name, ', ') FROM (SELECT t.name FROM knowledge_tag kt JOIN tag t ON t.id = kt.tag_id
+            WHERE kt.knowledge_id = knowledge.id ORDER BY t.name)), '') AS tags""",
+    }
+    KNOWLEDGE_ORDERS = ('id', 'title', 'created_at', 'updated_at')
+
+    def _knowledge_query(self, category_id, subtitle_id, after_id, limit, order_by, columns):
+        for column in columns:
+            if column not in self.KNOWLEDGE_COLUMNS:
+                raise ValueError(f'不支持的列: {column}')
+        descending = order_by.startswith('-')
+        order_col = order_by.lstrip('-')
+        if order_col not in self.KNOWLEDGE_ORDERS:
+            raise ValueError(f'不支持的排序字段: {order_by}')
+        where = []
+        params = []
+        if category_id:
+            where.append('category_id=?')
+            params.append(category_id)
+            if subtitle_id:
+                where.append('subtitle_id=?')
+                params.append(subtitle_id)
+        direction = 'DESC' if descending else 'ASC'
+        if after_id is not None:
+            # 键集分页：从 after_id 这一行的排序键之后继续，id 作为相同排序值时的决胜字段
+            op = '<' if descending else '>'
+            if order_col == 'id':
+                where.append(f'id {op} ?')
+                params.append(after_id)
+            else:
+                where.append(f'({order_col}, id) {op} (SELECT {order_col}, id FROM knowledge WHERE id=?)')
+                params.append(after_id)
+        sql = f'SELECT {", ".join(self.KNOWLEDGE_COMPUTED.get(column, column) for column in columns)} FROM knowledge'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += f' ORDER BY {order_col} {direction}'
+        if order_col != 'id':
+            sql += f', id {direction}'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return sql, params
 
-    def get_knowledges(self, category_id=None, subtitle_id=None):
-        cursor = self.conn.cursor()
-        if category_id and subtitle_id:
-            cursor.execute('SELECT id, title FROM knowledge WHERE category_id=? AND subtitle_id=?', (category_id, subtitle_id))
-        elif category_id:
-            cursor.execute('SELECT id, title FROM knowledge WHERE category_id=?', (category_id,))
-        else:
-            cursor.execute('SELECT id, title FROM knowledge', ())
+    def get_knowledges(self, category_id=None, subtitle_id=None, after_id=None, limit=None, order_by='id', columns=('id', 'title')):
+        """
+        按分类/子标题列出知识点。after_id + limit 为键集分页，取上一页最后一行的 id 继续翻页；
+        order_by 可加 '-' 前缀表示降序；columns 从 KNOWLEDGE_COLUMNS 中选择，不会读取正文。
+        """
+        cursor = self.reader.cursor()
+        cursor.execute(*self._knowledge_query(category_id, subtitle_id, after_id, limit, order_by, columns))
+        return cursor.fetchall()
+
+    def iter_knowledges(self, category_id=None, subtitle_id=None, after_id=None, limit=None, order_by='id', columns=('id', 'title'), batch_size=500):
+        # 与 get_knowledges 参数相同，按 batch_size 用 fetchmany 流式产出行
+        cursor = self.reader.cursor()
+        cursor.execute(*self._knowledge_query(category_id, subtitle_id, after_id, limit, order_by, columns))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+
+    def iter_tree_outline(self):
+        """
+        单次查询读取分类及其子标题，按分类逐个产出 (cat_id, cat_name, [(sub_id, sub_name), ...])。
+        知识点不在此读取，由树模型在节点展开时按需加载。
+        """
+        cursor = self.reader.cursor()
+        cursor.execute('''
+        SELECT c.id, c.name, s.id, s.name
+        FROM category c
+        LEFT JOIN subtitle s ON s.category_id = c.id
+        ORDER BY c.id, s.id''')
+        for (cat_id, cat_name), rows in groupby(cursor, key=lambda r: (r[0], r[1])):
+            yield cat_id, cat_name, [(r[2], r[3]) for r in rows if r[2] is not None]
+
+    def get_knowledge_children(self, category_id, subtitle_id=None):
+        # 子标题下的知识点；subtitle_id 为 None 时返回直接挂在分类下的知识点
+        cursor = self.reader.cursor()
+        cursor.execute('SELECT id, title FROM knowledge WHERE category_id=? AND subtitle_id IS ? ORDER BY id', (category_id, subtitle_id))
         return cursor.fetchall()
 
     def get_knowledge(self, kid):
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT id, title, content, encrypted FROM knowledge WHERE id=?', (kid,))
+        # 返回 (id, title, body, encrypted, format)；分块存储的正文 body 为 None，见 get_knowledge_chunks
+        cursor = self.reader.cursor()
+        cursor.execute('''SELECT k.id, k.title, c.body, k.encrypted, k.format FROM knowledge k
+            LEFT JOIN knowledge_content c ON c.knowledge_id = k.id WHERE k.id=?''', (kid,))
         return cursor.fetchone()
 
-    def update_knowledge(self, kid, title, content, encrypted=1):
-        cursor = self.conn.cursor()
-        cursor.execute('UPDATE knowledge SET title=?, content=?, encrypted=?, updated_at=datetime("now") WHERE id=?', (title, content, encrypted, kid))
-        self.conn.commit()
+    def get_knowledge_content(self, kid):
+        # 只读正文，不存在时返回 None
+        row = self.reader.execute('SELECT body FROM knowledge_content WHERE knowledge_id=?', (kid,)).fetchone()
+        return row[0] if row else None
+
+    def move_knowledge(self, kid, category_id, subtitle_id=None):
+        with self.transaction() as cursor:
+            cursor.execute('UPDATE knowledge SET category_id=?, subtitle_id=?, updated_at=datetime("now") WHERE id=?', (category_id, subtitle_id, kid))
+            row = cursor.execute('SELECT title FROM knowledge WHERE id=?', (kid,)).fetchone()
+        if row:
+            self._emit('moved', 'knowledge', kid, row[0], category_id, subtitle_id)
 
     def delete_knowledge(self, kid):
-        cursor = self.conn.cursor()
-        cursor.execute('DELETE FROM knowledge WHERE id=?', (kid,))
-        self.conn.commit()
+        with self.transaction() as cursor:
+            chunk_ids = self._chunk_ids_of(cursor, 'SELECT ?', (kid,))
+            cursor.execute('DELETE FROM knowledge WHERE id=?', (kid,))
+            self._gc_chunks(cursor, chunk_ids)
+        self._emit('deleted', 'knowledge', kid)
+
+    # 分块正文：chunk 存放去重后的块密文，knowledge_chunk 记录块顺序；切块与加密见 core/note_store.py
+    def get_knowledge_chunks(self, kid):
+        # 按顺序返回块密文，未分块存储的知识点返回空列表
+        cursor = self.reader.execute('''SELECT c.body FROM knowledge_chunk kc
+            JOIN chunk c ON c.id = kc.chunk_id WHERE kc.knowledge_id=? ORDER BY kc.seq''', (kid,))
+        return [row[0] for row in cursor]
+
+    def find_chunks(self, hashes):
+        # 返回库中已存在的块 {hash: chunk_id}
+        hashes = list(hashes)
+        found = {}
+        for i in range(0, len(hashes), 500):
+            part = hashes[i:i + 500]
+            found.update(self.reader.execute(f'SELECT hash, id FROM chunk WHERE hash IN ({",".join("?" * len(part))})', part))
+        return found
+
+    def save_knowledge_chunks(self, kid, title, hashes, new_chunks, encrypted=1, format='markdown'):
+        """
+        hashes: 正文按顺序的块标识；new_chunks: {hash: 块密文}，只需包含库中还没有的块。
+        写入新块、更新块顺序、回收不再被引用的旧块，在同一事务中完成。
+        """
+        with self.transaction() as cursor:
+            cursor.executemany('INSERT OR IGNORE INTO chunk (hash, body) VALUES (?, ?)', new_chunks.items())
+            ids = self.find_chunks(set(hashes))
+            chunk_ids = [ids[h] for h in hashes]
+            old = dict(cursor.execute('SELECT seq, chunk_id FROM knowledge_chunk WHERE knowledge_id=?', (kid,)))
+            # 只改写位置上块发生变化的行
+            cursor.executemany('INSERT OR REPLACE INTO knowledge_chunk (knowledge_id, seq, chunk_id) VALUES (?, ?, ?)',
+                ((kid, seq, chunk_id) for seq, chunk_id in enumerate(chunk_ids) if old.get(seq) != chunk_id))
+            cursor.execute('DELETE FROM knowledge_chunk WHERE knowledge_id=? AND seq>=?', (kid, len(chunk_ids)))
+            cursor.execute('DELETE FROM knowledge_content WHERE knowledge_id=?', (kid,))
+            cursor.execute('UPDATE knowledge SET title=?, encrypted=?, format=?, updated_at=datetime("now") WHERE id=?', (title, encrypted, format, kid))
+            self._gc_chunks(cursor, set(old.values()) - set(chunk_ids))
+        self._emit('renamed', 'knowledge', kid, title)
+
+    def _chunk_ids_of(self, cursor, kid_sql, params):
+        # kid_sql 为返回知识点 id 的子查询，需在删除知识点之前调用
+        cursor.execute(f'SELECT DISTINCT chunk_id FROM knowledge_chunk WHERE knowledge_id IN ({kid_sql})', params)
+        return [row[0] for row in cursor.fetchall()]
+
+    def _gc_chunks(self, cursor, chunk_ids):
+        # 删除不再被任何知识点引用的块
+        cursor.executemany('DELETE FROM chunk WHERE id=? AND NOT EXISTS (SELECT 1 FROM knowledge_chunk WHERE chunk_id=?)',
+            ((chunk_id, chunk_id) for chunk_id in chunk_ids))
+
+    def get_knowledge_ids_by_format(self, format, after_id=0, limit=100):
+        cursor = self.reader.execute('SELECT id FROM knowledge WHERE format=? AND id > ? ORDER BY id LIMIT ?', (format, after_id, limit))
+        return [row[0] for row in cursor]
+
+    # 历史版本（knowledge_revision），差异编码与还原见 core/revisions.py
+    def get_latest_revision(self, kid, merge_seconds):
+        """
+        返回最新版本 (id, seq, snapshot, 距上一个快照的版本数, 是否在 merge_seconds 秒内创建, body)，没有时返回 None。
+        """
+        return self.reader.execute('''SELECT id, seq, snapshot,
+                seq - COALESCE((SELECT MAX(seq) FROM knowledge_revision s WHERE s.knowledge_id=r.knowledge_id AND s.snapshot=1), 0),
+                created_at >= datetime('now', ?), body
+            FROM knowledge_revision r WHERE knowledge_id=? ORDER BY seq DESC LIMIT 1''', (f'-{merge_seconds} seconds', kid)).fetchone()
+
+    def add_revision(self, kid, seq, snapshot, size, body):
+        with self.transaction() as cursor:
+            cursor.execute('INSERT INTO knowledge_revision (knowledge_id, seq, snapshot, size, body, created_at) VALUES (?, ?, ?, ?, ?, datetime("now"))',
+                (kid, seq, snapshot, size, body))
+
+    def update_revision(self, revision_id, snapshot, size, body):
+        with self.transaction() as cursor:
+            cursor.execute('UPDATE knowledge_revision SET snapshot=?, size=?, body=? WHERE id=?', (snapshot, size, body, revision_id))
+
+    def get_revisions(self, kid):
+        # [(seq, snapshot, size, 密文大小, created_at)]，最新的在前
+        return self.reader.execute('''SELECT seq, snapshot, size, length(body), created_at FROM knowledge_revision
+            WHERE knowledge_id=? ORDER BY seq DESC''', (kid,)).fetchall()
+
+    def get_revision_chain(self, kid, seq):
+        # 还原第 seq 个版本需要的 (seq, snapshot, body)：从 seq 之后最近的快照（没有时为最新版本）到 seq，按 seq 倒序
+        return self.reader.execute('''SELECT seq, snapshot, body FROM knowledge_revision
+            WHERE knowledge_id=? AND seq>=? AND seq<=COALESCE(
+                (SELECT MIN(seq) FROM knowledge_revision WHERE knowledge_id=? AND seq>=? AND snapshot=1), seq)
+            ORDER BY seq DESC''', (kid, seq, kid, seq)).fetchall()
+
+    def prune_revisions(self, kid, keep_min, max_count, retention_days):
+        """
+        删除超出保留策略的旧版本，返回删除的数量。每个版本只依赖更新的版本，删除最旧的一段不影响其余版本的还原。
+        """
+        with self.transaction() as cursor:
+            cursor.execute('''DELETE FROM knowledge_revision WHERE knowledge_id=? AND seq <= (
+                SELECT seq FROM knowledge_revision WHERE knowledge_id=? ORDER BY seq DESC LIMIT 1 OFFSET ?)
+                AND (created_at < datetime('now', ?) OR seq <= (
+                    SELECT seq FROM knowledge_revision WHERE knowledge_id=? ORDER BY seq DESC LIMIT 1 OFFSET ?))''',
+                (kid, kid, keep_min, f'-{retention_days} days', kid, max_count))
+            return cursor.rowcount
+
+    # 全文索引（knowledge_fts），切词与盲化见 core/search_index.py
+    def index_knowledge(self, kid, title_tokens, body_tokens):
+        with self.transaction() as cursor:
+            cursor.execute('DELETE FROM knowledge_fts WHERE rowid=?', (kid,))
+            cursor.execute('INSERT INTO knowledge_fts (rowid, title, body) VALUES (?, ?, ?)', (kid, title_tokens, body_tokens))
+
+    def add_missing_search_rows(self, rows):
+        # rows: (kid, title_tokens, body_tokens)；只写入还没有索引且仍存在的知识点，返回写入的数量
+        rows = list(rows)
+        if not rows:
+            return 0
+        with self.transaction() as cursor:
+            cursor.executemany('''INSERT INTO knowledge_fts (rowid, title, body) SELECT ?, ?, ?
+                WHERE NOT EXISTS (SELECT 1 FROM knowledge_fts WHERE rowid=?) AND EXISTS (SELECT 1 FROM knowledge WHERE id=?)''',
+                ((kid, title, body, kid, kid) for kid, title, body in rows))
+            return cursor.rowcount
+
+    def get_unindexed_knowledge_ids(self, after_id=0, limit=200):
+        cursor = self.reader.execute('''SELECT id FROM knowledge k WHERE id > ?
+            AND NOT EXISTS (SELECT 1 FROM knowledge_fts WHERE rowid = k.id) ORDER BY id LIMIT ?''', (after_id, limit))
+        return [row[0] for row in cursor]
+
+    def clear_search_index(self):
+        with self.transaction() as cursor:
+            cursor.execute('DELETE FROM knowledge_fts')
+
+    def search_knowledge(self, match, limit=50, title_weight=10.0):
+        """
+        match 为 FTS5 查询表达式，按 bm25 排序，返回 [(kid, title, cat_id, cat_name, sub_id, sub_name)]。
+        """
+        return self.reader.execute('''SELECT k.id, k.title, k.category_id, c.name, k.subtitle_id, s.name
+            FROM (SELECT rowid AS id, bm25(knowledge_fts, ?, 1.0) AS rank FROM knowledge_fts
+                WHERE knowledge_fts MATCH ? ORDER BY rank LIMIT ?) f
+            JOIN knowledge k ON k.id = f.id
+            LEFT JOIN category c ON c.id = k.category_id
+            LEFT JOIN subtitle s ON s.id = k.subtitle_id
+            ORDER BY f.rank''', (title_weight, match, limit)).fetchall()
+
+    # 标签（tag / knowledge_tag），内存中的标签索引见 core/tag_index.py
+    def get_tags(self):
+        # [(tag_id, name, 知识点数)]，按名称排序；没有知识点的标签不返回
+        return self.reader.execute('''SELECT t.id, t.name, COUNT(*) FROM tag t
+            JOIN knowledge_tag kt ON kt.tag_id = t.id GROUP BY t.id ORDER BY t.name''').fetchall()
+
+    def get_knowledge_tags(self, kid):
+        # [(tag_id, name)]，按名称排序
+        return self.reader.execute('''SELECT t.id, t.name FROM knowledge_tag kt JOIN tag t ON t.id = kt.tag_id
+            WHERE kt.knowledge_id=? ORDER BY t.name''', (kid,)).fetchall()
+
+    def set_knowledge_tags(self, kid, tags):
+        # 用 tags（逗号分隔的文本或列表）替换知识点原有的标签，返回是否有变化
+        with self.transaction() as cursor:
+            return self._set_tags(cursor, kid, tags)
+
+    def _set_tags(self, cursor, kid, tags):
+        new = set()
+        for name in split_tags(tags):
+            row = cursor.execute('SELECT id FROM tag WHERE name=?', (name,)).fetchone()
+            if row is None:
+                # INSERT OR IGNORE 被忽略时也会占用一个自增 id，先查询再插入
+                cursor.execute('INSERT INTO tag (name) VALUES (?)', (name,))
+                new.add(cursor.lastrowid)
+            else:
+                new.add(row[0])
+        old = {row[0] for row in cursor.execute('SELECT tag_id FROM knowledge_tag WHERE knowledge_id=?', (kid,))}
+        if new == old:
+            return False
+        cursor.executemany('DELETE FROM knowledge_tag WHERE knowledge_id=? AND tag_id=?', ((kid, tag_id) for tag_id in old - new))
+        cursor.executemany('INSERT INTO knowledge_tag (knowledge_id, tag_id) VALUES (?, ?)', ((kid, tag_id) for tag_id in new - old))
+        # 不再被使用的标签随之删除
+        cursor.executemany('DELETE FROM tag WHERE id=? AND NOT EXISTS (SELECT 1 FROM knowledge_tag WHERE tag_id=?)',
+            ((tag_id, tag_id) for tag_id in old - new))
+        self._emit('tagged', 'knowledge', kid)
+        return True
+
+    def iter_tag_postings(self):
+        # 逐行返回 (tag_id, kid)，按标签、知识点 id 排序，直接走 idx_knowledge_tag_tag
+        return self.reader.execute('SELECT tag_id, knowledge_id FROM knowledge_tag ORDER BY tag_id, knowledge_id')
+
+    def get_knowledge_summaries(self, kids, batch_size=500):
+        """
+        按 kids 的顺序返回 [(kid, title, cat_id, cat_name, sub_id, sub_name)]，与 search_knowledge 的结果格式相同。
+        """
+        kids = list(kids)
+        rows = {}
+        for i in range(0, len(kids), batch_size):
+            batch = kids[i:i + batch_size]
+            for row in self.reader.execute(f'''SELECT k.id, k.title, k.category_id, c.name, k.subtitle_id, s.name
+                FROM knowledge k
+                LEFT JOIN category c ON c.id = k.category_id
+                LEFT JOIN subtitle s ON s.id = k.subtitle_id
+                WHERE k.id IN ({','.join('?' * len(batch))})''', batch):
+                rows[row[0]] = row
+        return [rows[kid] for kid in kids if kid in rows]
+
+    # 附件（attachment / knowledge_attachment），文件读写见 core/attachments.py
+    def add_attachment(self, digest, mime, size, name, encrypted=0):
+        # 已存在时只刷新 added_at，避免刚插入编辑器、尚未保存的附件被回收
+        with self.transaction() as cursor:
+            cursor.execute('INSERT OR IGNORE INTO attachment (hash, mime, size, name, encrypted) VALUES (?, ?, ?, ?, ?)',
+                (digest, mime, size, name, encrypted))
+            cursor.execute('UPDATE attachment SET added_at=datetime("now") WHERE hash=?', (digest,))
+
+    def get_attachment(self, digest):
+        # 返回 (hash, mime, size, name, encrypted)，不存在时返回 None
+        return self.reader.execute('SELECT hash, mime, size, name, encrypted FROM attachment WHERE hash=?', (digest,)).fetchone()
+
+    def set_knowledge_attachments(self, kid, hashes):
+        # 用正文中出现的附件引用替换该知识点原有的引用
+        hashes = set(hashes)
+        with self.transaction() as cursor:
+            old = {row[0] for row in cursor.execute('SELECT hash FROM knowledge_attachment WHERE knowledge_id=?', (kid,))}
+            cursor.executemany('DELETE FROM knowledge_attachment WHERE knowledge_id=? AND hash=?', ((kid, h) for h in old - hashes))
+            cursor.executemany('INSERT INTO knowledge_attachment (knowledge_id, hash) VALUES (?, ?)', ((kid, h) for h in hashes - old))
+
+    def delete_orphan_attachments(self, min_age_seconds):
+        """
+        删除没有被任何知识点引用、且添加时间早于 min_age_seconds 秒之前的附件记录，返回被删除的 hash 列表。
+        """
+        cutoff = f'-{int(min_age_seconds)} seconds'
+        with self.transaction() as cursor:
+            cursor.execute('''SELECT hash FROM attachment a
+                WHERE added_at <= datetime('now', ?)
+                AND NOT EXISTS (SELECT 1 FROM knowledge_attachment ka WHERE ka.hash = a.hash)''', (cutoff,))
+            hashes = [row[0] for row in cursor.fetchall()]
+            cursor.executemany('DELETE FROM attachment WHERE hash=?', ((h,) for h in hashes))
+        return hashes
+
+    # 用户设置（settings 表）
+    def get_setting(self, key, default=None):
+        row = self.reader.execute('SELECT value FROM settings WHERE key=?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_setting(self, key, value):
+        with self.transaction() as cursor:
+            if value is None:
+                cursor.execute('DELETE FROM settings WHERE key=?', (key,))
+            else:
+                cursor.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', (key, value))
+
+    # 正文批量读写，用于密文格式升级、密钥轮换等后台任务，不发出变更事件
+    def get_encrypted_contents(self, after_id=0, limit=500, legacy_only=False, exclude_key_id=None):
+        """
+        legacy_only 时只返回以文本形式存储的旧格式密文；
+        exclude_key_id 时跳过已用该密钥封装的信封（信封第 3~6 字节为 key_id）。
+        """
+        sql = '''SELECT c.knowledge_id, c.body FROM knowledge_content c
+            JOIN knowledge k ON k.id = c.knowledge_id
+            WHERE k.encrypted=1 AND c.knowledge_id > ?'''
+        params = [after_id]
+        if legacy_only:
+            sql += " AND typeof(c.body)='text'"
+        if exclude_key_id is not None:
+            sql += " AND (typeof(c.body)!='blob' OR substr(c.body, 3, 4)!=?)"
+            params.append(exclude_key_id)
+        sql += ' ORDER BY c.knowledge_id LIMIT ?'
+        params.append(limit)
+        return self.reader.execute(sql, params).fetchall()
+
+    def replace_contents(self, rows):
+        """
+        rows: (new_body, kid, old_body)。仅当正文仍为 old_body 时才替换，避免覆盖期间用户的新保存。
+        返回实际替换的行数。
+        """
+        rows = list(rows)
+        if not rows:
+            return 0
+        with self.transaction() as cursor:
+            cursor.executemany('UPDATE knowledge_content SET body=? WHERE knowledge_id=? AND body=?', rows)
+            return cursor.rowcount
+
+    def get_encrypted_chunks(self, after_id=0, limit=500, exclude_key_id=None):
+        # 与 get_encrypted_contents 相同，返回 chunk 表的 (chunk_id, body)
+        sql = 'SELECT id, body FROM chunk WHERE id > ?'
+        params = [after_id]
+        if exclude_key_id is not None:
+            sql += ' AND substr(body, 3, 4)!=?'
+            params.append(exclude_key_id)
+        sql += ' ORDER BY id LIMIT ?'
+        params.append(limit)
+        return self.reader.execute(sql, params).fetchall()
+
+    def replace_chunks(self, rows):
+        # rows: (new_body, chunk_id, old_body)；块标识不变，只替换密文
+        rows = list(rows)
+        if not rows:
+            return 0
+        with self.transaction() as cursor:
+            cursor.executemany('UPDATE chunk SET body=? WHERE id=? AND body=?', rows)
+            return cursor.rowcount
+
+    def get_encrypted_revisions(self, after_id=0, limit=500, exclude_key_id=None):
+        # 与 get_encrypted_chunks 相同，返回 knowledge_revision 表的 (id, body)
+        sql = 'SELECT id, body FROM knowledge_revision WHERE id > ?'
+        params = [after_id]
+        if exclude_key_id is not None:
+            sql += ' AND substr(body, 3, 4)!=?'
+            params.append(exclude_key_id)
+        sql += ' ORDER BY id LIMIT ?'
+        params.append(limit)
+        return self.reader.execute(sql, params).fetchall()
+
+    def replace_revisions(self, rows):
+        # rows: (new_body, revision_id, old_body)
+        rows = list(rows)
+        if not rows:
+            return 0
+        with self.transaction() as cursor:
+            cursor.executemany('UPDATE knowledge_revision SET body=? WHERE id=? AND body=?', rows)
+            return cursor.rowcount
+
+    # 批量操作：一次事务 + executemany，每批只提交一次
+    def add_knowledges_bulk(self, rows):
+        """
+        rows: 可迭代的 (title, category_id, subtitle_id, tags, encrypted, format)，返回按输入顺序的新 id 列表。
+        只写入知识点记录，正文由 NoteStore.create_many 在同一事务中用下面几个批量方法写入。
+        """
+        rows = list(rows)
+        if not rows:
+            return []
+        with self.transaction() as cursor:
+            cursor.executemany('INSERT INTO knowledge (title, category_id, subtitle_id, encrypted, format, created_at, updated_at) VALUES (?, ?, ?, ?, ?, datetime("now"), datetime("now"))',
+                ((title, category_id, subtitle_id, encrypted, format) for title, category_id, subtitle_id, _, encrypted, format in rows))
+            # 写事务内独占写锁，AUTOINCREMENT 分配的 id 连续递增
+            last_id = cursor.execute('SELECT last_insert_rowid()').fetchone()[0]
+            ids = list(range(last_id - len(rows) + 1, last_id + 1))
+            for kid, row in zip(ids, rows):
+                if row[3]:
+                    self._set_tags(cursor, kid, row[3])
+                self._emit('inserted', 'knowledge', kid, row[0], row[1], row[2])
+        return ids
+
+    def add_knowledge_chunks_bulk(self, rows, new_chunks):
+        """
+        为新建的知识点写入正文块：rows 为 (kid, 按顺序的块标识)，new_chunks 为 {hash: 块密文}，只需包含库中还没有的块。
+        """
+        rows = list(rows)
+        with self.transaction() as cursor:
+            cursor.executemany('INSERT OR IGNORE INTO chunk (hash, body) VALUES (?, ?)', new_chunks.items())
+            ids = self.find_chunks({digest for _, hashes in rows for digest in hashes})
+            cursor.executemany('INSERT INTO knowledge_chunk (knowledge_id, seq, chunk_id) VALUES (?, ?, ?)',
+                ((kid, seq, ids[digest]) for kid, hashes in rows for seq, digest in enumerate(hashes)))
+
+    def add_knowledge_attachments_bulk(self, rows):
+        # rows: (kid, 附件 hash)，用于新建的知识点
+        with self.transaction() as cursor:
+            cursor.executemany('INSERT OR IGNORE INTO knowledge_attachment (knowledge_id, hash) VALUES (?, ?)', rows)
+
+    def index_knowledges_bulk(self, rows):
+        # rows: (kid, title_tokens, body_tokens)，用于新建、还没有索引的知识点
+        with self.transaction() as cursor:
+            cursor.executemany('INSERT INTO knowledge_fts (rowid, title, body) VALUES (?, ?, ?)', rows)
+
+    def update_knowledges_bulk(self, rows, new_chunks):
+        """
+        批量改写已有知识点的正文块：rows 为 (kid, title, 按顺序的块标识, format)，new_chunks 为 {hash: 块密文}，只需包含库中还没有的块。
+        与 save_knowledge_chunks 相同只改写位置上变化的行并回收旧块，全文索引和附件引用由调用方在同一事务中更新（见 NoteStore.save_many）。
+        """
+        rows = list(rows)
+        with self.transaction() as cursor:
+            cursor.executemany('INSERT OR IGNORE INTO chunk (hash, body) VALUES (?, ?)', new_chunks.items())
+            ids = self.find_chunks({digest for _, _, hashes, _ in rows for digest in hashes})
+            old = {}
+            for i in range(0, len(rows), 500):
+                part = [row[0] for row in rows[i:i + 500]]
+                for kid, seq, chunk_id in cursor.execute(f'''SELECT knowledge_id, seq, chunk_id FROM knowledge_chunk
+                        WHERE knowledge_id IN ({",".join("?" * len(part))})''', part).fetchall():
+                    old.setdefault(kid, {})[seq] = chunk_id
+            changed = []
+            dropped = set()
+            for kid, _, hashes, _ in rows:
+                before = old.get(kid, {})
+                chunk_ids = [ids[digest] for digest in hashes]
+                changed.extend((kid, seq, chunk_id) for seq, chunk_id in enumerate(chunk_ids) if before.get(seq) != chunk_id)
+                dropped.update(set(before.values()) - set(chunk_ids))
+            cursor.executemany('INSERT OR REPLACE INTO knowledge_chunk (knowledge_id, seq, chunk_id) VALUES (?, ?, ?)', changed)
+            cursor.executemany('DELETE FROM knowledge_chunk WHERE knowledge_id=? AND seq>=?', ((kid, len(hashes)) for kid, _, hashes, _ in rows))
+            cursor.executemany('DELETE FROM knowledge_content WHERE knowledge_id=?', ((kid,) for kid, _, _, _ in rows))
+            cursor.executemany('UPDATE knowledge SET title=?, encrypted=1, format=?, updated_at=datetime("now") WHERE id=?',
+                ((title, format, kid) for kid, title, _, format in rows))
+            self._gc_chunks(cursor, dropped)
+            for kid, title, _, _ in rows:
+                self._emit('renamed', 'knowledge', kid, title)
+
+    def set_knowledge_attachments_bulk(self, rows):
+        # rows: (kid, 附件 hash 集合)，用正文中出现的附件引用替换各知识点原有的引用
+        with self.transaction():
+            for kid, hashes in rows:
+                self.set_knowledge_attachments(kid, hashes)
+
+    def reindex_knowledges_bulk(self, rows):
+        # rows: (kid, title_tokens, body_tokens)，用于已有索引的知识点，先删除旧的索引行
+        rows = list(rows)
+        with self.transaction() as cursor:
+            cursor.executemany('DELETE FROM knowledge_fts WHERE rowid=?', ((kid,) for kid, _, _ in rows))
+            cursor.executemany('INSERT INTO knowledge_fts (rowid, title, body) VALUES (?, ?, ?)', rows)
+
+    def move_knowledges(self, kids, category_id, subtitle_id=None):
+        kids = list(kids)
+        with self.transaction() as cursor:
+            cursor.executemany('UPDATE knowledge SET category_id=?, subtitle_id=?, updated_at=datetime("now") WHERE id=?',
+                ((category_id, subtitle_id, kid) for kid in kids))
+            for kid in kids:
+                row = cursor.execute('SELECT title FROM knowledge WHERE id=?', (kid,)).fetchone()
+                if row:
+                    self._emit('moved', 'knowledge', kid, row[0], category_id, subtitle_id)
+
+    def delete_knowledges(self, kids):
+        kids = list(kids)
+        with self.transaction() as cursor:
+            # 和 find_chunks 一样每次最多 500 个 id，避免超出 SQL 参数个数上限
+            chunk_ids = set()
+            for i in range(0, len(kids), 500):
+                part = kids[i:i + 500]
+                chunk_ids.update(self._chunk_ids_of(cursor, ','.join('?' * len(part)), part))
+            cursor.executemany('DELETE FROM knowledge WHERE id=?', ((kid,) for kid in kids))
+            self._gc_chunks(cursor, chunk_ids)
+            for kid in kids:
+                self._emit('deleted', 'knowledge', kid)
 
     def close(self):
-        self.conn.close()
+        # 连接由 ConnectionManager 共享，这里只解除监听；进程退出时由 db.connection.close_all 关闭
+        self._listeners.clear()
 
     def delete_schedule(self, schedule_id):
-        cursor = self.conn.cursor()
-        cursor.execute('DELETE FROM schedule WHERE id=?', (schedule_id,))
-        self.conn.commit()
+        with self.transaction() as cursor:
+            cursor.execute('DELETE FROM schedule WHERE id=?', (schedule_id,))
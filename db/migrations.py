@@ -0,0 +1,230 @@
+# 数据库迁移模块
+# 以 PRAGMA user_version 记录结构版本，按顺序在独立事务中执行升级步骤
+# 新增结构变更时只需在 MIGRATIONS 末尾追加步骤，不要修改已发布的步骤
+
+
+def _v1_base_tables(cursor):
+    # 初始表结构；老版本创建的数据库 user_version 为 0，这里的 IF NOT EXISTS 会直接跳过
+    # 分类表
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS category (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE NOT NULL
+    )''')
+    # 子标题表
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS subtitle (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        category_id INTEGER,
+        UNIQUE(name, category_id),
+        FOREIGN KEY(category_id) REFERENCES category(id) ON DELETE CASCADE
+    )''')
+    # 知识点表
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS knowledge (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT,
+        category_id INTEGER,
+        subtitle_id INTEGER,
+        content TEXT,
+        tags TEXT,
+        encrypted INTEGER DEFAULT 0,
+        created_at TEXT,
+        updated_at TEXT,
+        FOREIGN KEY(category_id) REFERENCES category(id) ON DELETE SET NULL,
+        FOREIGN KEY(subtitle_id) REFERENCES subtitle(id) ON DELETE SET NULL
+    )''')
+    # 日程表
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS schedule (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT,
+        description TEXT,
+        start_time TEXT,
+        end_time TEXT,
+        remind_time TEXT,
+        remind_type TEXT DEFAULT '提前1小时',
+        notified INTEGER DEFAULT 0,
+        finished INTEGER DEFAULT 0
+    )''')
+    # 专注记录表
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS focus (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        start_time TEXT,
+        end_time TEXT,
+        duration INTEGER
+    )''')
+    # 用户设置表
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )''')
+
+
+def _v2_indexes(cursor):
+    # 知识点按分类/子标题列出时只走索引，不回表
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_knowledge_tree ON knowledge(category_id, subtitle_id, title)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_subtitle_category ON subtitle(category_id)')
+    # 提醒轮询按 finished 过滤、按 remind_time 查找
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_schedule_remind ON schedule(finished, remind_time)')
+
+
+def _v3_knowledge_content(cursor):
+    # 正文单独成表，列出/统计知识点时只扫描体积很小的元数据行
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS knowledge_content (
+        knowledge_id INTEGER PRIMARY KEY,
+        body BLOB,
+        FOREIGN KEY(knowledge_id) REFERENCES knowledge(id) ON DELETE CASCADE
+    )''')
+    cursor.execute('INSERT OR REPLACE INTO knowledge_content (knowledge_id, body) SELECT id, content FROM knowledge WHERE content IS NOT NULL')
+    # 旧的 content 列保留但不再使用，清空后原来的溢出页会被释放
+    cursor.execute('UPDATE knowledge SET content=NULL WHERE content IS NOT NULL')
+
+
+def _v4_knowledge_chunks(cursor):
+    # 正文按内容切块存储：chunk 按块标识（HMAC）去重，knowledge_chunk 记录每个知识点的块顺序
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS chunk (
+        id INTEGER PRIMARY KEY,
+        hash BLOB UNIQUE NOT NULL,
+        body BLOB NOT NULL
+    )''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS knowledge_chunk (
+        knowledge_id INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        chunk_id INTEGER NOT NULL,
+        PRIMARY KEY(knowledge_id, seq),
+        FOREIGN KEY(knowledge_id) REFERENCES knowledge(id) ON DELETE CASCADE,
+        FOREIGN KEY(chunk_id) REFERENCES chunk(id)
+    ) WITHOUT ROWID''')
+    # 回收块时按 chunk_id 判断是否还有引用
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_knowledge_chunk_chunk ON knowledge_chunk(chunk_id)')
+
+
+def _v5_attachments(cursor):
+    # 附件按 sha256 存放在 config/media/ 下，这里记录元数据和知识点对附件的引用
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS attachment (
+        hash TEXT PRIMARY KEY,
+        mime TEXT,
+        size INTEGER,
+        name TEXT,
+        encrypted INTEGER DEFAULT 0,
+        added_at TEXT
+    )''')
+    # 不对 attachment 建外键：正文中可能粘贴了已被回收的附件引用
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS knowledge_attachment (
+        knowledge_id INTEGER NOT NULL,
+        hash TEXT NOT NULL,
+        PRIMARY KEY(knowledge_id, hash),
+        FOREIGN KEY(knowledge_id) REFERENCES knowledge(id) ON DELETE CASCADE
+    ) WITHOUT ROWID''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_knowledge_attachment_hash ON knowledge_attachment(hash)')
+
+
+def _v6_knowledge_format(cursor):
+    # 正文格式：html 为旧版本保存的 Qt 富文本，markdown 为用户输入的原文
+    cursor.execute("ALTER TABLE knowledge ADD COLUMN format TEXT DEFAULT 'html'")
+
+
+def _v7_knowledge_revisions(cursor):
+    # 历史版本：body 为被覆盖版本的密文，snapshot=1 时为完整内容，否则为相对于下一个版本的差异，见 core/revisions.py
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS knowledge_revision (
+        id INTEGER PRIMARY KEY,
+        knowledge_id INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        snapshot INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        body BLOB NOT NULL,
+        created_at TEXT,
+        UNIQUE(knowledge_id, seq),
+        FOREIGN KEY(knowledge_id) REFERENCES knowledge(id) ON DELETE CASCADE
+    )''')
+
+
+def _v8_search_index(cursor):
+    # 全文索引：rowid 为知识点 id，内容为盲化词元，见 core/search_index.py
+    cursor.execute('CREATE VIRTUAL TABLE IF NOT EXISTS knowledge_fts USING fts5(title, body, detail=column)')
+    # 虚拟表不支持外键，删除知识点（包括删除分类/子标题时级联删除）由触发器同步删除索引
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS knowledge_fts_delete AFTER DELETE ON knowledge BEGIN
+        DELETE FROM knowledge_fts WHERE rowid = old.id;
+    END''')
+
+
+def _v9_tags(cursor):
+    # 标签规范化为 tag / knowledge_tag 两张表，替代 knowledge.tags 中逗号拼接的文本
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS tag (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE NOT NULL COLLATE NOCASE
+    )''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS knowledge_tag (
+        knowledge_id INTEGER NOT NULL,
+        tag_id INTEGER NOT NULL,
+        PRIMARY KEY(knowledge_id, tag_id),
+        FOREIGN KEY(knowledge_id) REFERENCES knowledge(id) ON DELETE CASCADE,
+        FOREIGN KEY(tag_id) REFERENCES tag(id) ON DELETE CASCADE
+    ) WITHOUT ROWID''')
+    # 按标签取知识点 id（已排序），用于建立标签索引和统计数量
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_knowledge_tag_tag ON knowledge_tag(tag_id, knowledge_id)')
+    # 迁移旧的 tags 列，迁移后清空，之后只读写新表
+    rows = cursor.execute("SELECT id, tags FROM knowledge WHERE tags IS NOT NULL AND tags != ''").fetchall()
+    tag_ids = {}
+    for kid, tags in rows:
+        for name in tags.replace('，', ',').split(','):
+            name = ' '.join(name.split())
+            if not name:
+                continue
+            if name.lower() not in tag_ids:
+                cursor.execute('INSERT INTO tag (name) VALUES (?)', (name,))
+                tag_ids[name.lower()] = cursor.lastrowid
+            cursor.execute('INSERT OR IGNORE INTO knowledge_tag (knowledge_id, tag_id) VALUES (?, ?)', (kid, tag_ids[name.lower()]))
+    cursor.execute('UPDATE knowledge SET tags=NULL WHERE tags IS NOT NULL')
+
+
+# 第 i 个步骤把数据库从版本 i 升级到 i + 1
+MIGRATIONS = [
+    _v1_base_tables,
+    _v2_indexes,
+    _v3_knowledge_content,
+    _v4_knowledge_chunks,
+    _v5_attachments,
+    _v6_knowledge_format,
+    _v7_knowledge_revisions,
+    _v8_search_index,
+    _v9_tags,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """
+    将数据库升级到 SCHEMA_VERSION，返回升级前的版本号。
+    每个步骤连同版本号写入在同一事务中提交，失败时回滚并抛出异常，下次启动会从失败的步骤重试。
+    """
+    start = get_version(conn)
+    for version in range(start, SCHEMA_VERSION):
+        cursor = conn.cursor()
+        cursor.execute('BEGIN')
+        try:
+            MIGRATIONS[version](cursor)
+            cursor.execute(f'PRAGMA user_version = {version + 1}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return start
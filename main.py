@@ -2,10 +2,17 @@ import sys
 import os
 from PyQt5.QtWidgets import QApplication
 from ui.main_window import MainWindow
+from db.connection import close_all
+from ui.media import register_media_scheme
 
 def main():
+    # 自定义协议需在创建 QApplication 之前注册
+    register_media_scheme()
     app = QApplication(sys.argv)
     window = MainWindow()
+    # 退出前先写完自动保存队列，再关闭共享的数据库连接，让 WAL 写回主库文件
+    app.aboutToQuit.connect(window.editor_tab.shutdown)
+    app.aboutToQuit.connect(close_all)
     window.show()
     sys.exit(app.exec())
 
@@ -0,0 +1,40 @@
+# 逐块渲染与整篇渲染的一致性测试
+# 预览按 split_blocks 切出的块分别渲染后拼接，结果应与整篇渲染相同（块之间的换行数量除外）
+import re
+import pytest
+from core.markdown_render import MarkdownRenderer, split_blocks
+
+@pytest.fixture(scope='module')
+def renderer():
+    return MarkdownRenderer()
+
+def _normalize(html):
+    return re.sub(r'\n+', '\n', html).strip()
+
+def _render_blocks(renderer, text):
+    # 与 ui/preview.py 中 MarkdownPreview._render 的拼接方式相同
+    blocks, references = split_blocks(text)
+    references = '\n'.join(references)
+    return '\n'.join(renderer.render_body(f'{block}\n\n{references}' if references and '[' in block else block, cache=False)
+        for block in blocks)
+
+@pytest.mark.parametrize('text', [
+    '> q1\n\n> q2\n',
+    'para\n> q1\n\n> q2\n\ntext\n',
+    '> a\n>\n> b\n\nend\n',
+    '<div>\n\nhello\n\n</div>\n',
+    '<div>\n<div>\n\na\n\n</div>\n\nb\n\n</div>\n\nc\n',
+    '<!--\n\ncomment\n\n-->\nafter\n',
+    'a\n\n<section>\n\n> q\n\n</section>\n\n> z\n',
+    '# T\n\npara [x][1]\n\n[1]: http://example.com\n\n- a\n\n- b\n\n```py\nx = 1\n\n\ny = 2\n```\n\n    code\n',
+])
+def test_blocks_match_full_render(renderer, text):
+    assert _normalize(_render_blocks(renderer, text)) == _normalize(renderer.render_body(text, cache=False))
+
+def test_quote_blocks_stay_together():
+    blocks, _ = split_blocks('> q1\n\n> q2\n\nafter\n')
+    assert blocks == ['> q1\n\n> q2', 'after\n']
+
+def test_open_html_block_is_not_split():
+    blocks, _ = split_blocks('<div>\n\nhello\n\n</div>\n\nafter\n')
+    assert blocks == ['<div>\n\nhello\n\n</div>', 'after\n']
@@ -1,17 +1,61 @@
-from PyQt5.QtWidgets import QWidget, QHBoxLayout, QSplitter, QListWidget, QVBoxLayout, QPushButton, QLabel, QLineEdit, QInputDialog, QMessageBox, QTextBrowser, QTreeWidget, QTreeWidgetItem, QCheckBox, QFileDialog, QMenu, QAction
+import html
+import os
+import time
+from PyQt5.QtWidgets import QWidget, QHBoxLayout, QSplitter, QListWidget, QVBoxLayout, QPushButton, QLabel, QLineEdit, QInputDialog, QMessageBox, QTextBrowser, QTreeView, QCheckBox, QFileDialog, QMenu, QAction, QDialog, QListWidgetItem
 from PyQt5.QtWebEngineWidgets import QWebEngineView
 from PyQt5.QtGui import QTextCursor
 from PyQt5.QtCore import Qt
+from core.autosave import Autosave
+from core.attachments import AttachmentStore, media_url, start_garbage_collection
 from core.markdown_render import MarkdownRenderer
-from core.encryption import encrypt_data, decrypt_data
-from db.database import Database
+from core.note_cache import NoteCache
+from core.thumbnails import ThumbnailCache
+from core.note_format import HtmlConversion, convert_html, html_to_markdown
+from core.note_store import NoteStore, FORMAT_HTML, FORMAT_MARKDOWN
+from core.reencrypt import start_legacy_upgrade
+from core.search_index import start_search_indexing
+from core.tag_index import TagIndex, start_tag_index
+from db.database import Database, split_tags
+from ui.history import HistoryDialog
+from ui.knowledge_model import KnowledgeTreeModel
+from ui.media import MediaTextBrowser, install_media_handler
+from ui.preview import PreviewEngine
+from ui.search import SearchEngine, SearchResultDelegate, MAX_RESULTS
+from ui.tags import TagFilterPanel
 
 class EditorWidget(QWidget):
     def __init__(self):
         super().__init__()
         self.renderer = MarkdownRenderer()
         self.db = Database()
+        self.media = AttachmentStore(self.db)
+        self.store = NoteStore(self.db, self.media)
+        # 解密后的正文缓存，切换知识点时优先从缓存读取
+        self.notes = NoteCache(self.store)
+        # 修改在停止输入或切换知识点时由后台线程自动保存
+        self.autosave = Autosave(self.store, self._snapshot, self)
+        self._loading = False
+        # 等待写入完成后再打开历史版本的 (kid, 保存序号)
+        self._history_wait = None
+        self.autosave.queue.saved.connect(self._on_history_saved)
+        self.autosave.queue.failed.connect(self._on_history_failed)
+        # 预览中的图片先显示后台生成的缩略图
+        self.thumbs = ThumbnailCache(self.media, parent=self)
+        # 旧格式密文在后台逐批升级为二进制信封
+        start_legacy_upgrade(self.db)
+        # 回收不再被任何知识点引用的附件
+        start_garbage_collection(self.media)
+        # 为尚未建立全文索引的知识点补建索引
+        start_search_indexing(self.store)
+        # 标签位图在界面建好后于后台建立，之后随标签修改增量更新
+        self.tags = TagIndex(self.db)
+        # 文字搜索同时勾选了标签时，只显示带有这些标签的结果
+        self._tag_filter = None
+        # 旧版本保存的富文本一次性转换为 Markdown 原文
+        self.html_conversion = HtmlConversion(self.store, self)
+        self.html_conversion.start()
         self.init_ui()
+        start_tag_index(self.tags)
         self.apply_theme()  # 初始化时应用主题
         self.load_knowledge_list()
 
@@ -25,10 +69,32 @@ class EditorWidget(QWidget):
         self.search_bar.setPlaceholderText('搜索知识点...')
         self.search_bar.textChanged.connect(self.search_knowledge)
         left_layout.addWidget(self.search_bar)
-        self.category_tree = QTreeWidget()
-        self.category_tree.setHeaderLabel('分类/子标题/知识点')
-        self.category_tree.itemClicked.connect(self.on_tree_item_clicked)
+        # 标签筛选：勾选多个标签时显示同时带有这些标签的知识点
+        self.tag_panel = TagFilterPanel(self.tags)
+        self.tag_panel.setMaximumHeight(160)
+        self.tag_panel.selection_changed.connect(self.filter_by_tags)
+        left_layout.addWidget(self.tag_panel)
+        self.tree_model = KnowledgeTreeModel(self.db, self)
+        self.category_tree = QTreeView()
+        self.category_tree.setModel(self.tree_model)
+        self.category_tree.setUniformRowHeights(True)
+        self.category_tree.clicked.connect(self.on_tree_item_clicked)
+        self.category_tree.expanded.connect(self.prefetch_children)
         left_layout.addWidget(self.category_tree)
+        # 搜索结果单独显示，分类树保持原样，清空搜索后直接恢复
+        self.search_results = QListWidget()
+        self.search_results.setItemDelegate(SearchResultDelegate(self.search_results))
+        self.search_results.setWordWrap(True)
+        self.search_results.itemClicked.connect(self.on_search_result_clicked)
+        self.search_results.setVisible(False)
+        left_layout.addWidget(self.search_results)
+        self.search_status = QLabel()
+        self.search_status.setVisible(False)
+        left_layout.addWidget(self.search_status)
+        self.search_engine = SearchEngine(self.store.search, self.notes, self)
+        self.search_engine.started.connect(self.on_search_started)
+        self.search_engine.results.connect(self.on_search_results)
+        self.search_engine.finished.connect(self.on_search_finished)
         self.add_cat_btn = QPushButton('添加分类')
         self.add_cat_btn.clicked.connect(self.add_category)
         left_layout.addWidget(self.add_cat_btn)
@@ -42,9 +108,16 @@ class EditorWidget(QWidget):
         self.title_edit = QLineEdit()
         self.title_edit.setPlaceholderText('知识点标题')
         self.editor_layout.addWidget(self.title_edit)
-        self.editor = QTextBrowser()
+        self.tags_edit = QLineEdit()
+        self.tags_edit.setPlaceholderText('标签，多个标签用逗号分隔')
+        self.tags_edit.editingFinished.connect(self.save_tags)
+        self.editor_layout.addWidget(self.tags_edit)
+        self.editor = MediaTextBrowser(self.media)
         self.editor.setOpenExternalLinks(True)
-        self.editor.setAcceptRichText(True)
+        self.editor.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.editor.customContextMenuRequested.connect(self.show_context_menu)
+        # 正文以 Markdown 原文编辑和保存
+        self.editor.setAcceptRichText(False)
         self.editor.setReadOnly(False)
         self.editor_layout.addWidget(self.editor)
         # 去除多余按钮，只保留必要操作
@@ -60,7 +133,11 @@ class EditorWidget(QWidget):
         self.splitter.addWidget(self.editor_panel)
         # 右侧预览区
         self.preview = QWebEngineView()
+        install_media_handler(self.preview.page().profile(), self.media, self.thumbs)
         self.preview.setVisible(False)
+        # 预览页只加载一次，之后在后台线程增量渲染
+        self.preview_engine = PreviewEngine(self.preview, self.renderer, self.editor.toPlainText, self)
+        self.preview_engine.rendered.connect(self.on_preview_rendered)
         self.splitter.addWidget(self.preview)
         self.splitter.setSizes([220, 700, 700])
         layout.addWidget(self.splitter)
@@ -70,10 +147,12 @@ class EditorWidget(QWidget):
             QPushButton { background: #4F8EF7; color: white; border-radius: 4px; padding: 7px 16px; }
             QPushButton:hover { background: #357AE8; }
             QLineEdit, QTextEdit, QTextBrowser { border-radius: 4px; border: 1px solid #ccc; padding: 4px; background: #fff; }
-            QTreeWidget { border-radius: 4px; border: 1px solid #ccc; }
+            QTreeView { border-radius: 4px; border: 1px solid #ccc; }
             QCheckBox { margin: 6px; }
         ''')
         self.editor.textChanged.connect(self.update_preview)
+        self.editor.textChanged.connect(self.on_content_edited)
+        self.title_edit.textEdited.connect(self.on_content_edited)
         # 添加导入导出按钮
         btn_layout = QHBoxLayout()
         self.save_btn = QPushButton('保存知识点')
@@ -85,7 +164,14 @@ class EditorWidget(QWidget):
         self.export_btn = QPushButton('导出知识点')
         self.export_btn.clicked.connect(self.export_knowledge)
         btn_layout.addWidget(self.export_btn)
+        self.history_btn = QPushButton('历史版本')
+        self.history_btn.clicked.connect(self.show_history)
+        btn_layout.addWidget(self.history_btn)
         self.editor_layout.addLayout(btn_layout)
+        # 保存状态只在这里显示，不弹出对话框
+        self.save_status = QLabel()
+        self.editor_layout.addWidget(self.save_status)
+        self.autosave.status_changed.connect(self.save_status.setText)
 
     def apply_theme(self, theme_name=None):
         """
@@ -98,8 +184,8 @@ class EditorWidget(QWidget):
                 QPushButton { background: #3b4252; color: #e0e0e0; border-radius: 4px; padding: 7px 16px; border: 1px solid #4F8EF7; }
                 QPushButton:hover { background: #4F8EF7; color: #fff; }
                 QLineEdit, QTextEdit, QTextBrowser { border-radius: 4px; border: 1px solid #444; padding: 4px; background: #2e3440; color: #e0e0e0; }
-                QTreeWidget { border-radius: 4px; border: 1px solid #444; background: #2e3440; color: #e0e0e0; }
-                QTreeWidget::item:selected { background: #4F8EF7; color: #fff; }
+                QTreeView { border-radius: 4px; border: 1px solid #444; background: #2e3440; color: #e0e0e0; }
+                QTreeView::item:selected { background: #4F8EF7; color: #fff; }
                 QCheckBox { margin: 6px; color: #e0e0e0; }
             '''
         else:
@@ -108,8 +194,8 @@ class EditorWidget(QWidget):
                 QPushButton { background: #4F8EF7; color: white; border-radius: 4px; padding: 7px 16px; }
                 QPushButton:hover { background: #357AE8; }
                 QLineEdit, QTextEdit, QTextBrowser { border-radius: 4px; border: 1px solid #ccc; padding: 4px; background: #fff; color: #222; }
-                QTreeWidget { border-radius: 4px; border: 1px solid #ccc; background: #fff; color: #222; }
-                QTreeWidget::item:selected { background: #4F8EF7; color: #fff; }
+                QTreeView { border-radius: 4px; border: 1px solid #ccc; background: #fff; color: #222; }
+                QTreeView::item:selected { background: #4F8EF7; color: #fff; }
                 QCheckBox { margin: 6px; color: #222; }
             '''
         self.setStyleSheet(style)
@@ -122,50 +208,46 @@ class EditorWidget(QWidget):
         self.load_knowledge_list()
 
     def load_knowledge_list(self, selected_cat_id=None, selected_sub_id=None):
-        self.category_tree.clear()
-        categories = self.db.get_categories()
-        for cat_id, cat_name in categories:
-            cat_item = QTreeWidgetItem([cat_name])
-            cat_item.setData(0, Qt.UserRole, ('category', cat_id))
-            subtitles = self.db.get_subtitles(cat_id)
-            for sub_id, sub_name in subtitles:
-                sub_item = QTreeWidgetItem([sub_name])
-                sub_item.setData(0, Qt.UserRole, ('subtitle', sub_id, cat_id))
-                knowledges = self.db.get_knowledges(category_id=cat_id, subtitle_id=sub_id)
-                for kid, title in knowledges:
-                    k_item = QTreeWidgetItem([title])
-                    k_item.setData(0, Qt.UserRole, ('knowledge', kid))
-                    sub_item.addChild(k_item)
-                cat_item.addChild(sub_item)
-            self.category_tree.addTopLevelItem(cat_item)
-            # 自动展开新加的分类/子标题
-            if selected_cat_id and cat_id == selected_cat_id:
-                cat_item.setExpanded(True)
-                if selected_sub_id:
-                    for i in range(cat_item.childCount()):
-                        if cat_item.child(i).data(0, Qt.UserRole)[1] == selected_sub_id:
-                            cat_item.child(i).setExpanded(True)
+        # 重新加载模型，保留刷新前的展开与选中状态
+        view = self.category_tree
+        expanded = [index.data(Qt.UserRole) for index in self.tree_model.container_indexes() if view.isExpanded(index)]
+        current = view.currentIndex().data(Qt.UserRole)
+        self.tree_model.reload()
+        for key in expanded:
+            index = self.tree_model.find_index(key)
+            if index.isValid():
+                view.expand(index)
+        index = self.tree_model.find_index(current)
+        if index.isValid():
+            view.setCurrentIndex(index)
+        self._expand_to(selected_cat_id, selected_sub_id)
+
+    def _expand_to(self, cat_id, sub_id=None):
+        # 自动展开新加的分类/子标题；树节点由数据库变更事件增量更新
+        if cat_id:
+            self.category_tree.expand(self.tree_model.find_index(('category', cat_id)))
+        if sub_id:
+            self.category_tree.expand(self.tree_model.find_index(('subtitle', sub_id, cat_id)))
 
     def add_category(self):
         cat, ok = QInputDialog.getText(self, '新建分类', '输入分类名:')
         if ok and cat:
             cat_id = self.db.add_category(cat)
-            self.load_knowledge_list(selected_cat_id=cat_id)
+            self._expand_to(cat_id)
 
     def add_subtitle(self):
-        cat_item = self.category_tree.currentItem()
-        if cat_item and cat_item.data(0, Qt.UserRole) and cat_item.data(0, Qt.UserRole)[0] == 'category':
-            cat_id = cat_item.data(0, Qt.UserRole)[1]
+        data = self.category_tree.currentIndex().data(Qt.UserRole)
+        if data and data[0] == 'category':
+            cat_id = data[1]
             subtitle, ok = QInputDialog.getText(self, '新建子标题', '输入子标题名:')
             if ok and subtitle:
                 sub_id = self.db.add_subtitle(subtitle, cat_id)
-                self.load_knowledge_list(selected_cat_id=cat_id, selected_sub_id=sub_id)
+                self._expand_to(cat_id, sub_id)
 
     def add_knowledge(self):
-        item = self.category_tree.currentItem()
+        data = self.category_tree.currentIndex().data(Qt.UserRole)
         cat_id = sub_id = None
-        if item:
-            data = item.data(0, Qt.UserRole)
+        if data:
             if data[0] == 'category':
                 cat_id = data[1]
             elif data[0] == 'subtitle':
@@ -173,141 +255,253 @@ class EditorWidget(QWidget):
                 cat_id = data[2]
         title, ok = QInputDialog.getText(self, '新建知识点', '输入标题:')
         if ok and title and cat_id:
-            enc_content = encrypt_data('')  # 修复：去除.decode('utf-8')
-            kid = self.db.add_knowledge(title, cat_id, sub_id, enc_content, encrypted=1)
-            self.load_knowledge_list(selected_cat_id=cat_id, selected_sub_id=sub_id)
+            self.store.create(title, cat_id, sub_id, '')
+            self._expand_to(cat_id, sub_id)
 
-    def on_tree_item_clicked(self, item, col):
-        data = item.data(0, Qt.UserRole)
+    def on_tree_item_clicked(self, index):
+        # 切换前先提交当前知识点的修改
+        self.autosave.flush()
+        data = index.data(Qt.UserRole)
         if data and data[0] == 'knowledge':
             kid = data[1]
-            row = self.db.get_knowledge(kid)
+            # 还在保存队列中的修改比数据库中的新，必须先查队列：写线程提交后才移出队列，此时缓存已失效
+            pending = self.autosave.pending(kid)
+            if pending:
+                # 自动保存总是以 Markdown 写入
+                row = (*pending, FORMAT_MARKDOWN)
+            else:
+                row = self.notes.load(kid)
+            # 同一子标题下的其他知识点在后台预先解密，离当前知识点近的优先
+            self.prefetch_children(index.parent(), index.row())
             if row:
-                _, title, content, encrypted = row
+                title, content, fmt = row
                 # 路径显示：类别/子标题/知识点标题
-                parent = item.parent()
-                if parent:
-                    sub_name = parent.text(0)
-                    cat_name = parent.parent().text(0) if parent.parent() else ''
-                else:
-                    sub_name = ''
-                    cat_name = ''
+                sub_name, cat_name = self._knowledge_path(index)
                 # 只显示知识点标题，便于编辑
                 self.title_edit.setText(title)
                 self.title_edit.setReadOnly(False)
-                if encrypted:
-                    try:
-                        # 兼容历史数据：如果content不是base64字符串，直接显示原文
-                        import base64
-                        try:
-                            # 检查是否为base64字符串
-                            base64.b64decode(content)
-                            content = decrypt_data(content)
-                        except Exception:
-                            pass  # 不是base64密文，直接显示
-                    except Exception:
-                        content = '[解密失败]'
-                self.editor.setHtml(content)
+                self.tags_edit.setText(', '.join(name for _, name in self.db.get_knowledge_tags(kid)))
+                if content is None:
+                    content = '[解密失败]'
+                elif fmt == FORMAT_HTML:
+                    # 尚未转换的旧数据，保存时会以 Markdown 写回
+                    content, lossless = convert_html(content)
+                    if not lossless:
+                        self.save_status.setText('该知识点含有无法完整转换为 Markdown 的旧格式内容，修改保存后将丢失')
+                # 切换知识点时清空预览并回到顶部，setPlainText 触发的 textChanged 会重新生成预览
+                self.preview_engine.clear(kid)
+                self._set_content(content)
                 self.current_kid = kid
+                self.current_title = title
                 self.current_cat = cat_name
                 self.current_sub = sub_name
-                # 实时预览
-                if self.preview_checkbox.isChecked():
-                    text = self.editor.toPlainText()
-                    html = self.renderer.render(text)
-                    self.preview.setHtml(html)
         else:
             self.title_edit.clear()
             self.title_edit.setReadOnly(False)
-            self.editor.clear()
+            self.tags_edit.clear()
+            self._set_content('')
             self.current_kid = None
+            self.current_title = None
             self.current_cat = None
             self.current_sub = None
-            self.preview.setHtml('')
+            self.preview_engine.clear()
+
+    def _set_content(self, text):
+        # 加载知识点引起的 textChanged 不算修改
+        self._loading = True
+        try:
+            self.editor.setPlainText(text)
+        finally:
+            self._loading = False
+
+    def on_content_edited(self, *args):
+        if not self._loading and getattr(self, 'current_kid', None):
+            self.autosave.mark_dirty()
+
+    def _snapshot(self):
+        # 自动保存取当前编辑内容；标题为空时用正文第一行，仍为空则保留原标题
+        kid = getattr(self, 'current_kid', None)
+        if not kid:
+            return None
+        content = self.editor.toPlainText()
+        title = self.title_edit.text().strip()
+        if not title:
+            stripped = content.strip()
+            title = stripped.split('\n', 1)[0] if stripped else self.current_title
+        return kid, title, content
+
+    def shutdown(self, timeout=10):
+        # 退出前写完排队中的修改，并等待进行中的搜索结束
+        self.search_engine.cancel()
+        self.search_engine.wait(1000)
+        self.autosave.close(timeout)
+        self.notes.shutdown()
+        self.thumbs.shutdown()
+
+    def prefetch_children(self, parent, around=0):
+        # 展开分类/子标题或打开知识点时，预取该节点下的知识点正文
+        model = self.tree_model
+        # expanded 信号可能先于懒加载发出
+        if model.canFetchMore(parent):
+            model.fetchMore(parent)
+        rows = sorted(range(model.rowCount(parent)), key=lambda row: abs(row - around))
+        kids = []
+        for row in rows:
+            data = model.index(row, 0, parent).data(Qt.UserRole)
+            if data and data[0] == 'knowledge' and data[1] != getattr(self, 'current_kid', None):
+                kids.append(data[1])
+        if kids:
+            self.notes.prefetch(kids)
+
+    def _knowledge_path(self, index):
+        # 返回知识点所在的 (子标题名, 分类名)，直接挂在分类下的知识点子标题名为空
+        parent = index.parent()
+        if not parent.isValid():
+            return '', ''
+        if parent.data(Qt.UserRole)[0] == 'category':
+            return '', parent.data()
+        return parent.data(), parent.parent().data() or ''
 
     # 右键菜单支持重命名/删除分类和子标题
     def contextMenuEvent(self, event):
-        item = self.category_tree.itemAt(self.category_tree.viewport().mapFromGlobal(event.globalPos()))
-        if not item:
+        index = self.category_tree.indexAt(self.category_tree.viewport().mapFromGlobal(event.globalPos()))
+        if not index.isValid():
             return
-        data = item.data(0, Qt.UserRole)
+        data = index.data(Qt.UserRole)
         menu = QMenu(self)
         if data:
             if data[0] == 'category':
                 rename_action = QAction('重命名分类', self)
-                rename_action.triggered.connect(lambda: self.rename_category(item))
+                rename_action.triggered.connect(lambda: self.rename_category(data))
                 del_action = QAction('删除分类', self)
-                del_action.triggered.connect(lambda: self.delete_category(item))
+                del_action.triggered.connect(lambda: self.delete_category(data))
                 menu.addAction(rename_action)
                 menu.addAction(del_action)
             elif data[0] == 'subtitle':
                 rename_action = QAction('重命名子标题', self)
-                rename_action.triggered.connect(lambda: self.rename_subtitle(item))
+                rename_action.triggered.connect(lambda: self.rename_subtitle(data))
                 del_action = QAction('删除子标题', self)
-                del_action.triggered.connect(lambda: self.delete_subtitle(item))
+                del_action.triggered.connect(lambda: self.delete_subtitle(data))
                 menu.addAction(rename_action)
                 menu.addAction(del_action)
         menu.exec_(event.globalPos())
 
-    def rename_category(self, item):
-        cat_id = item.data(0, Qt.UserRole)[1]
+    def rename_category(self, data):
+        cat_id = data[1]
         new_name, ok = QInputDialog.getText(self, '重命名分类', '新分类名:')
         if ok and new_name:
             self.db.rename_category(cat_id, new_name)
-            self.load_knowledge_list(selected_cat_id=cat_id)
 
-    def delete_category(self, item):
-        cat_id = item.data(0, Qt.UserRole)[1]
+    def delete_category(self, data):
+        cat_id = data[1]
         reply = QMessageBox.question(self, '删除分类', '确定要删除该分类及其下所有内容吗？', QMessageBox.Yes | QMessageBox.No)
         if reply == QMessageBox.Yes:
             self.db.delete_category(cat_id)
-            self.load_knowledge_list()
 
-    def rename_subtitle(self, item):
-        sub_id = item.data(0, Qt.UserRole)[1]
+    def rename_subtitle(self, data):
+        sub_id = data[1]
         new_name, ok = QInputDialog.getText(self, '重命名子标题', '新子标题名:')
         if ok and new_name:
             self.db.rename_subtitle(sub_id, new_name)
-            cat_id = item.data(0, Qt.UserRole)[2]
-            self.load_knowledge_list(selected_cat_id=cat_id, selected_sub_id=sub_id)
 
-    def delete_subtitle(self, item):
-        sub_id = item.data(0, Qt.UserRole)[1]
-        cat_id = item.data(0, Qt.UserRole)[2]
+    def delete_subtitle(self, data):
+        sub_id = data[1]
         reply = QMessageBox.question(self, '删除子标题', '确定要删除该子标题及其下所有知识点吗？', QMessageBox.Yes | QMessageBox.No)
         if reply == QMessageBox.Yes:
             self.db.delete_subtitle(sub_id)
-            self.load_knowledge_list(selected_cat_id=cat_id)
 
     def search_knowledge(self, text):
-        self.category_tree.clear()
-        cursor = self.db.conn.cursor()
-        cursor.execute('SELECT DISTINCT category FROM knowledge WHERE title LIKE ? OR content LIKE ?', (f'%{text}%', f'%{text}%'))
-        for cat_row in cursor.fetchall():
-            cat = cat_row[0] or '未分类'
-            cat_item = QTreeWidgetItem([cat])
-            cursor.execute('SELECT id, title FROM knowledge WHERE category=? AND (title LIKE ? OR content LIKE ?)', (cat, f'%{text}%', f'%{text}%'))
-            for row in cursor.fetchall():
-                kid, title = row
-                item = QTreeWidgetItem([title])
-                item.setData(0, 1, kid)
-                cat_item.addChild(item)
-            self.category_tree.addTopLevelItem(cat_item)
+        searching = bool(text.strip())
+        tag_ids = self.tag_panel.selected()
+        filtering = searching or bool(tag_ids)
+        self.category_tree.setVisible(not filtering)
+        self.search_results.setVisible(filtering)
+        self.search_status.setVisible(filtering)
+        if not searching:
+            self.search_engine.cancel()
+            self.search_results.clear()
+            self._tag_filter = None
+            if tag_ids:
+                self.show_tag_results(tag_ids)
+            return
+        self._tag_filter = set(self.tags.match(tag_ids)) if tag_ids else None
+        # 停止输入后在后台线程查询，结果分批返回
+        self.search_status.setText('搜索中…')
+        self.search_engine.request(text)
+
+    def filter_by_tags(self, tag_ids):
+        self.search_knowledge(self.search_bar.text())
+
+    def show_tag_results(self, tag_ids):
+        # 位图求交在内存中完成，只为显示的结果查询标题和路径；新建的知识点排在前面
+        started = time.perf_counter()
+        kids = self.tags.match(tag_ids)
+        ms = (time.perf_counter() - started) * 1000
+        for row in self.db.get_knowledge_summaries(reversed(kids[-MAX_RESULTS:])):
+            self._add_result(*row)
+        if not kids:
+            self.search_status.setText('没有同时带有这些标签的知识点')
+        elif len(kids) > MAX_RESULTS:
+            self.search_status.setText(f'{len(kids)} 条结果（{ms:.1f} ms），显示最新的 {MAX_RESULTS} 条')
+        else:
+            self.search_status.setText(f'{len(kids)} 条结果（{ms:.1f} ms）')
+
+    def _add_result(self, kid, title, cat_id, cat_name, sub_id, sub_name, snippet=''):
+        path = ' / '.join(name for name in (cat_name, sub_name) if name)
+        text = f'<b>{html.escape(title or "")}</b> <span style="color:#888;">{html.escape(path)}</span>'
+        item = QListWidgetItem()
+        item.setData(Qt.DisplayRole, f'{text}<br>{snippet}' if snippet else text)
+        item.setData(Qt.UserRole, ('knowledge', kid, cat_id, sub_id))
+        self.search_results.addItem(item)
+
+    def on_search_started(self, query):
+        self.search_results.clear()
+
+    def on_search_results(self, batch):
+        for row in batch:
+            if self._tag_filter is None or row[0] in self._tag_filter:
+                self._add_result(*row)
+
+    def on_search_finished(self, count, ms):
+        if self._tag_filter is not None:
+            # 相关度最高的 MAX_RESULTS 条中带有所选标签的部分
+            count = self.search_results.count()
+        self.search_status.setText(f'{count} 条结果（{ms:.0f} ms）' if count else '没有找到匹配的知识点')
+
+    def save_tags(self):
+        kid = getattr(self, 'current_kid', None)
+        if not kid:
+            return
+        names = split_tags(self.tags_edit.text())
+        self.db.set_knowledge_tags(kid, names)
+        self.tags_edit.setText(', '.join(names))
+
+    def on_search_result_clicked(self, item):
+        # 在分类树中定位并打开，保存时按树中的位置确定分类
+        key = item.data(Qt.UserRole)
+        index = self.tree_model.find_index(key)
+        if index.isValid():
+            self._expand_to(key[2], key[3])
+            self.category_tree.setCurrentIndex(index)
+            self.on_tree_item_clicked(index)
 
     def update_preview(self):
         if self.preview_checkbox.isChecked():
-            text = self.editor.toPlainText()
-            html = self.renderer.render(text)
-            self.preview.setHtml(html)
+            # 停止输入后才在后台渲染
+            self.preview_engine.request()
+
+    def on_preview_rendered(self, doc_id, ms):
+        stats = self.preview_engine.timings
+        self.preview_checkbox.setToolTip(f'本次渲染 {ms:.1f} ms（切块 {stats["split_ms"]:.1f} ms，渲染 {stats["blocks"]} 块 {stats["render_ms"]:.1f} ms），最长 {stats["max_ms"]:.1f} ms')
 
     def toggle_preview(self, state):
         self.preview.setVisible(bool(state))
         if state:
             self.splitter.setSizes([220, 500, 500])
-            self.update_preview()
+            self.preview_engine.update(self.editor.toPlainText())
         else:
             self.splitter.setSizes([220, 1000, 0])
-            self.preview.setHtml('')
+            self.preview_engine.clear(getattr(self, 'current_kid', None))
 
     def show_context_menu(self, pos):
         menu = self.editor.createStandardContextMenu()
@@ -321,61 +515,51 @@ class EditorWidget(QWidget):
         video_action = QAction('插入视频', self)
         video_action.triggered.connect(self.insert_video)
         menu.addAction(video_action)
-        menu.exec_(self.editor.mapToGlobal(pos))
+        digest = self.editor.image_at(pos)
+        if digest:
+            original_action = QAction('查看原图', self)
+            original_action.triggered.connect(lambda: self.editor.show_original(digest))
+            menu.addAction(original_action)
+        menu.exec_(self.editor.viewport().mapToGlobal(pos))
 
     def insert_image(self):
         fname, _ = QFileDialog.getOpenFileName(self, '选择图片', '', 'Images (*.png *.jpg *.bmp *.jpeg *.gif)')
         if fname:
-            html = f'<img src="file://{fname}" style="max-width:100%;" />'
-            cursor = self.editor.textCursor()
-            cursor.insertHtml(html)
+            # 图片导入附件库，正文中只保存 kbmedia 引用
+            name = os.path.basename(fname)
+            self.editor.textCursor().insertText(f'![{name}]({media_url(self.media.import_file(fname))})')
 
     def insert_code(self):
         code, ok = QInputDialog.getMultiLineText(self, '插入代码', '输入代码:')
         if ok and code:
-            html = f'<pre style="background:#232629;color:#eee;padding:8px;border-radius:4px;"><code>{code}</code></pre>'
-            cursor = self.editor.textCursor()
-            cursor.insertHtml(html)
+            self.editor.textCursor().insertText(f'\n```\n{code}\n```\n')
 
     def insert_video(self):
         fname, _ = QFileDialog.getOpenFileName(self, '选择视频', '', 'Videos (*.mp4 *.webm *.ogg)')
         if fname:
-            html = f'<video src="file://{fname}" controls style="max-width:100%;"></video>'
-            cursor = self.editor.textCursor()
-            cursor.insertHtml(html)
+            # Markdown 没有视频语法，直接写 HTML 标签，预览时原样输出
+            html = f'<video src="{media_url(self.media.import_file(fname))}" controls style="max-width:100%;"></video>'
+            self.editor.textCursor().insertText(html)
 
     def save_knowledge(self):
         # 允许新建/编辑知识点时，自动用文本框标题或内容第一行作为标题
-        item = self.category_tree.currentItem()
+        index = self.category_tree.currentIndex()
         # 获取父路径（分类/子标题）
         cat_id = sub_id = None
         cat_name = sub_name = None
-        if item:
-            data = item.data(0, Qt.UserRole)
+        if index.isValid():
+            data = index.data(Qt.UserRole)
             # 选中知识点时，父节点为子标题或分类
             if data and data[0] == 'knowledge':
-                parent = item.parent()
-                if parent:
-                    sub_name = parent.text(0)
-                    cat_name = parent.parent().text(0) if parent.parent() else ''
-                else:
-                    sub_name = ''
-                    cat_name = ''
+                cat_id, sub_id = data[2], data[3]
+                sub_name, cat_name = self._knowledge_path(index)
             elif data and data[0] == 'subtitle':
-                sub_name = item.text(0)
-                cat_name = item.parent().text(0) if item.parent() else ''
+                sub_id, cat_id = data[1], data[2]
+                sub_name = index.data()
+                cat_name = index.parent().data() or ''
             elif data and data[0] == 'category':
-                cat_name = item.text(0)
-        # 查找cat_id和sub_id
-        for cid, cname in self.db.get_categories():
-            if cname == cat_name:
-                cat_id = cid
-                break
-        if sub_name:
-            for sid, sname in self.db.get_subtitles(cat_id):
-                if sname == sub_name:
-                    sub_id = sid
-                    break
+                cat_id = data[1]
+                cat_name = index.data()
         # 获取标题：优先用标题输入框，否则用内容第一行
         title = self.title_edit.text().strip()
         if not title:
@@ -384,40 +568,70 @@ class EditorWidget(QWidget):
         if not title or not cat_id:
             QMessageBox.warning(self, '保存失败', '知识点标题和分类不能为空')
             return
-        content = self.editor.toHtml()
-        enc_content = encrypt_data(content)  # 已是str，无需decode
-        # 判断是更新还是新建
+        content = self.editor.toPlainText()
+        self.title_edit.setText(title)
+        # 已有知识点交给后台写线程保存；新建的知识点需要先拿到 id，直接写入
         if hasattr(self, 'current_kid') and self.current_kid:
-            self.db.update_knowledge(self.current_kid, title, enc_content, encrypted=1)
+            self.autosave.flush(force=True)
         else:
-            self.db.add_knowledge(title, cat_id, sub_id, enc_content, encrypted=1)
-        self.load_knowledge_list(selected_cat_id=cat_id, selected_sub_id=sub_id)
-        QMessageBox.information(self, '保存成功', '知识点内容已加密保存')
-        self.title_edit.setText(title)
+            self.current_kid = self.store.create(title, cat_id, sub_id, content)
+            self.db.set_knowledge_tags(self.current_kid, self.tags_edit.text())
+            self.current_title = title
+            self._expand_to(cat_id, sub_id)
+            self.save_status.setText('已保存')
         self.current_cat = cat_name
         self.current_sub = sub_name
 
-    def export_knowledge(self):
-        from PyQt5.QtWidgets import QFileDialog
-        item = self.category_tree.currentItem()
-        if not item:
+    def show_history(self):
+        kid = getattr(self, 'current_kid', None)
+        if not kid:
             QMessageBox.warning(self, '未选择', '请先选择一个知识点')
             return
-        data = item.data(0, Qt.UserRole)
+        # 历史版本相对于已保存的正文还原，排队中的修改写完后（saved 信号）再打开，不阻塞界面
+        self.autosave.flush()
+        seq = self.autosave.queue.pending_seq(kid)
+        if seq is None:
+            self._open_history(kid)
+        else:
+            self._history_wait = (kid, seq)
+
+    def _on_history_saved(self, kid, seq):
+        if self._history_wait is None or self._history_wait[0] != kid or seq < self._history_wait[1]:
+            return
+        self._history_wait = None
+        # 等待期间切换了知识点时不再打开
+        if getattr(self, 'current_kid', None) == kid:
+            self._open_history(kid)
+
+    def _on_history_failed(self, kid, seq, error):
+        if self._history_wait is None or self._history_wait[0] != kid or seq < self._history_wait[1]:
+            return
+        self._history_wait = None
+        QMessageBox.warning(self, '保存失败', f'修改尚未保存，暂时无法查看历史版本：{error}')
+
+    def _open_history(self, kid):
+        dialog = HistoryDialog(self.store, kid, self.editor.toPlainText(), self)
+        if dialog.exec_() == QDialog.Accepted and dialog.selected_text() is not None:
+            # 恢复也是一次保存，恢复前的内容同样会记入历史
+            self.editor.setPlainText(dialog.selected_text())
+            self.autosave.flush()
+
+    def export_knowledge(self):
+        from PyQt5.QtWidgets import QFileDialog
+        data = self.category_tree.currentIndex().data(Qt.UserRole)
         if not data or data[0] != 'knowledge':
             QMessageBox.warning(self, '未选择', '请先选择一个知识点')
             return
         kid = data[1]
-        row = self.db.get_knowledge(kid)
+        row = self.notes.load(kid)
         if not row:
             QMessageBox.warning(self, '错误', '知识点不存在')
             return
-        _, title, content, encrypted = row
-        if encrypted:
-            try:
-                content = decrypt_data(content)
-            except Exception:
-                content = '[解密失败]'
+        title, content, fmt = row
+        if content is None:
+            content = '[解密失败]'
+        elif fmt == FORMAT_HTML:
+            content = html_to_markdown(content)
         fname, _ = QFileDialog.getSaveFileName(self, '导出知识点', f'{title}.md', 'Markdown Files (*.md);;All Files (*)')
         if fname:
             with open(fname, 'w', encoding='utf-8') as f:
@@ -426,10 +640,9 @@ class EditorWidget(QWidget):
 
     def import_knowledge(self):
         from PyQt5.QtWidgets import QFileDialog
-        item = self.category_tree.currentItem()
+        data = self.category_tree.currentIndex().data(Qt.UserRole)
         cat_id = sub_id = None
-        if item:
-            data = item.data(0, Qt.UserRole)
+        if data:
             if data[0] == 'category':
                 cat_id = data[1]
             elif data[0] == 'subtitle':
@@ -438,13 +651,24 @@ class EditorWidget(QWidget):
         if not cat_id:
             QMessageBox.warning(self, '未选择', '请先选择一个分类或子标题')
             return
-        fname, _ = QFileDialog.getOpenFileName(self, '导入知识点', '', 'Markdown Files (*.md);;All Files (*)')
-        if fname:
-            with open(fname, 'r', encoding='utf-8') as f:
+        fnames, _ = QFileDialog.getOpenFileNames(self, '导入知识点', '', 'Markdown Files (*.md);;All Files (*)')
+        if len(fnames) == 1:
+            with open(fnames[0], 'r', encoding='utf-8') as f:
                 content = f.read()
             title, ok = QInputDialog.getText(self, '知识点标题', '输入知识点标题:')
             if ok and title:
-                enc_content = encrypt_data(content)  # 已是str，无需decode
-                self.db.add_knowledge(title, cat_id, sub_id, enc_content, encrypted=1)
-                self.load_knowledge_list(selected_cat_id=cat_id, selected_sub_id=sub_id)
+                self.store.create(title, cat_id, sub_id, content)
+                self._expand_to(cat_id, sub_id)
                 QMessageBox.information(self, '导入成功', f'已导入知识点“{title}”')
+        elif fnames:
+            # 多个文件以文件名作为标题，一次事务批量写入
+            titles = []
+            contents = []
+            for fname in fnames:
+                with open(fname, 'r', encoding='utf-8') as f:
+                    contents.append(f.read())
+                titles.append(os.path.splitext(os.path.basename(fname))[0])
+            rows = [(title, cat_id, sub_id, content) for title, content in zip(titles, contents)]
+            self.store.create_many(rows)
+            self._expand_to(cat_id, sub_id)
+            QMessageBox.information(self, '导入成功', f'已导入 {len(rows)} 个知识点')
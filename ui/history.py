@@ -0,0 +1,65 @@
+# 历史版本浏览
+# 左侧列出知识点的历史版本，选中后还原并显示内容，可恢复到编辑器
+import datetime
+from PyQt5.QtWidgets import QDialog, QHBoxLayout, QVBoxLayout, QListWidget, QListWidgetItem, QPlainTextEdit, QPushButton, QLabel
+from PyQt5.QtCore import Qt
+from core.note_format import html_to_markdown
+
+def _local_time(text):
+    # 数据库中为 UTC 时间
+    moment = datetime.datetime.strptime(text, '%Y-%m-%d %H:%M:%S').replace(tzinfo=datetime.timezone.utc)
+    return moment.astimezone().strftime('%Y-%m-%d %H:%M')
+
+class HistoryDialog(QDialog):
+    def __init__(self, store, kid, current, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.kid = kid
+        self.current = current
+        self.setWindowTitle('历史版本')
+        self.resize(900, 600)
+        layout = QHBoxLayout(self)
+        self.list = QListWidget()
+        self.list.setMaximumWidth(260)
+        layout.addWidget(self.list)
+        right = QVBoxLayout()
+        self.info = QLabel()
+        right.addWidget(self.info)
+        self.viewer = QPlainTextEdit()
+        self.viewer.setReadOnly(True)
+        right.addWidget(self.viewer)
+        self.restore_btn = QPushButton('恢复此版本')
+        self.restore_btn.setEnabled(False)
+        self.restore_btn.clicked.connect(self.accept)
+        right.addWidget(self.restore_btn)
+        layout.addLayout(right)
+        item = QListWidgetItem('当前版本')
+        item.setData(Qt.UserRole, None)
+        self.list.addItem(item)
+        for seq, snapshot, size, stored, created_at in store.revisions.list(kid):
+            item = QListWidgetItem(f'{_local_time(created_at)} 保存前（{size} 字节）')
+            item.setData(Qt.UserRole, seq)
+            item.setToolTip(f'版本 {seq}，{"完整快照" if snapshot else "差异"}，占用 {stored} 字节')
+            self.list.addItem(item)
+        self.text = None
+        self.list.currentItemChanged.connect(self.on_selected)
+        self.list.setCurrentRow(0)
+
+    def on_selected(self, item, previous=None):
+        if item is None:
+            return
+        seq = item.data(Qt.UserRole)
+        if seq is None:
+            text = self.current
+        else:
+            text = self.store.load_revision(self.kid, seq)
+            if text is not None:
+                # 转换前的旧版本为 Qt 富文本
+                text = html_to_markdown(text)
+        self.text = text
+        self.viewer.setPlainText(text if text is not None else '[无法还原该版本]')
+        self.info.setText(item.text())
+        self.restore_btn.setEnabled(seq is not None and text is not None)
+
+    def selected_text(self):
+        return self.text
@@ -0,0 +1,217 @@
+# 知识库树模型
+# 分类/子标题常驻内存，知识点在节点展开时按需加载
+from PyQt5.QtCore import QAbstractItemModel, QModelIndex, Qt, pyqtSignal
+
+
+class _Node:
+    __slots__ = ('kind', 'id', 'title', 'cat_id', 'sub_id', 'parent', 'row', 'children', 'fetched')
+
+    def __init__(self, kind, node_id, title, cat_id=None, sub_id=None, parent=None):
+        self.kind = kind
+        self.id = node_id
+        self.title = title
+        self.cat_id = cat_id
+        self.sub_id = sub_id
+        self.parent = parent
+        self.row = 0
+        self.children = []
+        # 知识点节点没有子节点，视为已加载
+        self.fetched = kind == 'knowledge'
+
+    def key(self):
+        # 与原 QTreeWidgetItem 的 UserRole 数据保持一致
+        if self.kind == 'category':
+            return ('category', self.id)
+        if self.kind == 'subtitle':
+            return ('subtitle', self.id, self.cat_id)
+        return ('knowledge', self.id, self.cat_id, self.sub_id)
+
+
+class KnowledgeTreeModel(QAbstractItemModel):
+    # 变更事件在提交写操作的线程中发出，经信号转到界面线程再更新模型
+    _changed = pyqtSignal(object)
+
+    def __init__(self, db, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self._root = _Node('root', None, '')
+        self._root.fetched = True
+        # (kind, id) -> _Node，既保证节点存活，也用于按 id 定位
+        self._nodes = {}
+        self._changed.connect(self.apply_change)
+        db.add_listener(self._changed.emit)
+
+    # 数据加载
+    def reload(self):
+        self.beginResetModel()
+        self._root.children = []
+        self._nodes = {}
+        for cat_id, cat_name, subtitles in self.db.iter_tree_outline():
+            cat_node = self._add_child(self._root, _Node('category', cat_id, cat_name, cat_id))
+            for sub_id, sub_name in subtitles:
+                self._add_child(cat_node, _Node('subtitle', sub_id, sub_name, cat_id, sub_id))
+        self.endResetModel()
+
+    def _add_child(self, parent, node):
+        node.parent = parent
+        node.row = len(parent.children)
+        parent.children.append(node)
+        self._nodes[(node.kind, node.id)] = node
+        return node
+
+    def _fetch(self, node, parent_index):
+        if node.fetched:
+            return
+        node.fetched = True
+        sub_id = node.id if node.kind == 'subtitle' else None
+        rows = self.db.get_knowledge_children(node.cat_id, sub_id)
+        if not rows:
+            return
+        first = len(node.children)
+        self.beginInsertRows(parent_index, first, first + len(rows) - 1)
+        for kid, title in rows:
+            self._add_child(node, _Node('knowledge', kid, title, node.cat_id, sub_id))
+        self.endInsertRows()
+
+    # 增量变更
+    def apply_change(self, event):
+        """
+        根据数据库发出的 ChangeEvent 局部更新节点，不触发整树重载。
+        """
+        node = self._nodes.get((event.kind, event.id))
+        if event.action == 'inserted':
+            if node is None:
+                self._insert_node(_Node(event.kind, event.id, event.title, event.cat_id, event.sub_id))
+        elif event.action == 'renamed':
+            if node is not None and node.title != event.title:
+                node.title = event.title
+                index = self.node_index(node)
+                self.dataChanged.emit(index, index, [Qt.DisplayRole])
+        elif event.action == 'moved':
+            if node is not None:
+                self._remove_node(node)
+            self._insert_node(_Node('knowledge', event.id, event.title, event.cat_id, event.sub_id))
+        elif event.action == 'deleted':
+            if node is not None:
+                self._remove_node(node)
+
+    def _container_of(self, node):
+        if node.kind == 'category':
+            return self._root
+        if node.kind == 'subtitle':
+            return self._nodes.get(('category', node.cat_id))
+        if node.sub_id:
+            return self._nodes.get(('subtitle', node.sub_id))
+        return self._nodes.get(('category', node.cat_id))
+
+    def _insert_node(self, node):
+        parent = self._container_of(node)
+        # 子标题随分类常驻；知识点的父节点尚未加载时，等展开时再从数据库读取
+        if parent is None or (node.kind == 'knowledge' and not parent.fetched):
+            return
+        children = parent.children
+        if node.kind == 'subtitle':
+            # 子标题排在分类下直接挂载的知识点之前
+            row = sum(1 for child in children if child.kind == 'subtitle')
+        else:
+            row = len(children)
+        self.beginInsertRows(self.node_index(parent), row, row)
+        node.parent = parent
+        children.insert(row, node)
+        self._renumber(parent, row)
+        self._nodes[(node.kind, node.id)] = node
+        self.endInsertRows()
+
+    def _remove_node(self, node):
+        parent = node.parent
+        row = node.row
+        self.beginRemoveRows(self.node_index(parent), row, row)
+        del parent.children[row]
+        self._renumber(parent, row)
+        self._forget(node)
+        self.endRemoveRows()
+
+    def _forget(self, node):
+        self._nodes.pop((node.kind, node.id), None)
+        for child in node.children:
+            self._forget(child)
+
+    @staticmethod
+    def _renumber(parent, start):
+        for row in range(start, len(parent.children)):
+            parent.children[row].row = row
+
+    # 定位
+    def node_index(self, node):
+        if node is None or node is self._root:
+            return QModelIndex()
+        return self.createIndex(node.row, 0, node)
+
+    def find_index(self, key):
+        """
+        根据 UserRole 数据定位节点，知识点所在的父节点未加载时先加载。
+        """
+        if not key:
+            return QModelIndex()
+        node = self._nodes.get((key[0], key[1]))
+        if node is None and key[0] == 'knowledge':
+            _, _, cat_id, sub_id = key
+            parent = self._nodes.get(('subtitle', sub_id)) if sub_id else self._nodes.get(('category', cat_id))
+            if parent is not None:
+                self._fetch(parent, self.node_index(parent))
+                node = self._nodes.get((key[0], key[1]))
+        return self.node_index(node)
+
+    def container_indexes(self):
+        # 所有分类/子标题节点的索引，用于保存展开状态
+        for (kind, _), node in self._nodes.items():
+            if kind != 'knowledge':
+                yield self.node_index(node)
+
+    # QAbstractItemModel 接口
+    def _node(self, index):
+        return index.internalPointer() if index.isValid() else self._root
+
+    def index(self, row, column, parent=QModelIndex()):
+        node = self._node(parent)
+        if column != 0 or not 0 <= row < len(node.children):
+            return QModelIndex()
+        return self.createIndex(row, column, node.children[row])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        return self.node_index(index.internalPointer().parent)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        return len(self._node(parent).children)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent=QModelIndex()):
+        node = self._node(parent)
+        return bool(node.children) or not node.fetched
+
+    def canFetchMore(self, parent):
+        return not self._node(parent).fetched
+
+    def fetchMore(self, parent):
+        self._fetch(self._node(parent), parent)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        node = index.internalPointer()
+        if role == Qt.DisplayRole:
+            return node.title
+        if role == Qt.UserRole:
+            return node.key()
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole and section == 0:
+            return '分类/子标题/知识点'
+        return None
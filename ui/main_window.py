@@ -68,6 +68,8 @@ class MainWindow(QMainWindow):
 
     def closeEvent(self, event):
         if getattr(self, 'minimize_to_tray', False):
+            # 隐藏到托盘前提交未保存的修改
+            self.editor_tab.autosave.flush()
             self.hide()
             self.tray.showMessage('知识库管理工具', '程序已最小化到托盘，可在托盘区还原。')
             event.ignore()
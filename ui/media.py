@@ -0,0 +1,121 @@
+# 附件显示模块
+# 为预览区 QWebEngineView 提供 kbmedia: 协议，从附件库按需读取，图片优先返回缩略图
+from PyQt5.QtCore import QIODevice, QByteArray, QBuffer, QUrlQuery, Qt
+from PyQt5.QtGui import QPixmap
+from PyQt5.QtWidgets import QTextBrowser, QDialog, QVBoxLayout, QScrollArea, QLabel
+from PyQt5.QtWebEngineCore import QWebEngineUrlScheme, QWebEngineUrlSchemeHandler, QWebEngineUrlRequestJob
+from core.attachments import MEDIA_SCHEME, MEDIA_REF
+
+# 预览中图片默认使用的缩略图宽度；URL 带 ?original 时返回原图
+PREVIEW_THUMB_WIDTH = 960
+
+def register_media_scheme():
+    # QtWebEngine 要求在创建 QApplication 之前注册自定义协议
+    scheme = QWebEngineUrlScheme(MEDIA_SCHEME.encode())
+    scheme.setSyntax(QWebEngineUrlScheme.Syntax.Path)
+    scheme.setFlags(QWebEngineUrlScheme.SecureScheme | QWebEngineUrlScheme.LocalAccessAllowed | QWebEngineUrlScheme.CorsEnabled)
+    QWebEngineUrlScheme.registerScheme(scheme)
+
+class MediaDevice(QIODevice):
+    """
+    把 MediaReader 包装为 QIODevice，WebEngine 按需分段读取（视频拖动进度时随机读取）。
+    """
+    def __init__(self, reader, parent=None):
+        super().__init__(parent)
+        self.reader = reader
+        self.open(QIODevice.ReadOnly)
+
+    def isSequential(self):
+        return False
+
+    def size(self):
+        return self.reader.size
+
+    def bytesAvailable(self):
+        return self.reader.size - self.pos() + super().bytesAvailable()
+
+    def readData(self, maxlen):
+        return self.reader.read(self.pos(), maxlen)
+
+    def writeData(self, data):
+        return -1
+
+    def close(self):
+        self.reader.close()
+        super().close()
+
+def _image_mime(data, default):
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'image/png'
+    if data[:2] == b'\xff\xd8':
+        return 'image/jpeg'
+    return default
+
+class MediaSchemeHandler(QWebEngineUrlSchemeHandler):
+    def __init__(self, store, thumbs=None, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.thumbs = thumbs
+
+    def requestStarted(self, job):
+        url = job.requestUrl()
+        digest = url.path()
+        row = self.store.info(digest)
+        if row and self.thumbs is not None and row[1].startswith('image/') and not QUrlQuery(url).hasQueryItem('original'):
+            # 缩略图已生成时直接返回；否则本次返回原图，后台生成缩略图供下次使用
+            data = self.thumbs.get(digest, PREVIEW_THUMB_WIDTH)
+            if data is not None:
+                buffer = QBuffer(job)
+                buffer.setData(QByteArray(data))
+                buffer.open(QIODevice.ReadOnly)
+                job.reply(_image_mime(data, row[1]).encode(), buffer)
+                return
+        reader = self.store.open(digest) if row else None
+        if reader is None:
+            job.fail(QWebEngineUrlRequestJob.UrlNotFound)
+            return
+        # 设备挂在 job 下，请求结束时随 job 一起释放
+        device = MediaDevice(reader, job)
+        job.destroyed.connect(device.close)
+        job.reply(row[1].encode(), device)
+
+def install_media_handler(profile, store, thumbs=None):
+    handler = MediaSchemeHandler(store, thumbs, profile)
+    profile.installUrlSchemeHandler(MEDIA_SCHEME.encode(), handler)
+    return handler
+
+class MediaTextBrowser(QTextBrowser):
+    """
+    编辑 Markdown 原文的 QTextBrowser，可以找出光标处的 kbmedia 图片引用并查看原图。
+    图片只在预览中显示，缩略图由 MediaSchemeHandler 提供。
+    """
+    def __init__(self, store, parent=None):
+        super().__init__(parent)
+        self.store = store
+
+    def image_at(self, pos):
+        # 返回 pos 处 Markdown 原文中 kbmedia 引用的附件 hash，不在引用上时返回 None
+        cursor = self.cursorForPosition(pos)
+        offset = cursor.positionInBlock()
+        for match in MEDIA_REF.finditer(cursor.block().text()):
+            if match.start() <= offset <= match.end():
+                return match.group(1)
+        return None
+
+    def show_original(self, digest):
+        data = self.store.read_all(digest)
+        if data is None:
+            return
+        pixmap = QPixmap()
+        pixmap.loadFromData(data)
+        dialog = QDialog(self)
+        dialog.setWindowTitle('查看原图')
+        layout = QVBoxLayout(dialog)
+        scroll = QScrollArea()
+        label = QLabel()
+        label.setPixmap(pixmap)
+        label.setAlignment(Qt.AlignCenter)
+        scroll.setWidget(label)
+        layout.addWidget(scroll)
+        dialog.resize(min(pixmap.width() + 40, 1400), min(pixmap.height() + 40, 900))
+        dialog.exec_()
@@ -0,0 +1,199 @@
+# Markdown 实时预览模块
+# 预览页只加载一次，之后按顶层块比较新旧文本，只渲染变化的块，并通过 runJavaScript 替换对应的 DOM 节点
+# 页面不重新加载，滚动位置保持不变；切块和渲染在后台线程进行，连续输入时合并请求，过期的结果直接丢弃
+import hashlib
+import json
+import time
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QTimer, pyqtSignal
+from core.markdown_render import split_blocks
+
+# 停止输入多久后开始渲染
+DEBOUNCE_MS = 80
+
+PREVIEW_SHELL = '''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><style id="kb-style">%s</style></head>
+<body><div id="kb-root"></div>
+<script>
+function kbPatch(start, removeCount, blocks) {
+    var root = document.getElementById('kb-root');
+    for (var i = 0; i < removeCount; i++) {
+        root.removeChild(root.children[start]);
+    }
+    var ref = root.children[start] || null;
+    for (var j = 0; j < blocks.length; j++) {
+        var div = document.createElement('div');
+        div.className = 'kb-block';
+        div.innerHTML = blocks[j];
+        root.insertBefore(div, ref);
+    }
+}
+function kbReset(css) {
+    document.getElementById('kb-style').textContent = css;
+    document.getElementById('kb-root').innerHTML = '';
+    window.scrollTo(0, 0);
+}
+</script></body></html>'''
+
+class _RenderTask(QRunnable):
+    def __init__(self, engine, generation, doc_id, text, base_keys, base_references):
+        super().__init__()
+        self.engine = engine
+        self.generation = generation
+        self.doc_id = doc_id
+        self.text = text
+        self.base_keys = base_keys
+        self.base_references = base_references
+
+    def cancelled(self):
+        return self.engine._generation != self.generation
+
+    def run(self):
+        result = self.engine._compute(self)
+        if result is not None:
+            self.engine._finished.emit(result)
+
+class PreviewEngine(QObject):
+    """
+    增量预览：request() 在停止输入 DEBOUNCE_MS 后从 source 取文本渲染；update(text) 立即提交；
+    clear() 清空页面（切换知识点时调用）。每次提交递增代号，只有最新代号的结果会应用到页面。
+    当前文档的渲染耗时记录在 timings 中（切换文档时清空），并通过 rendered(doc_id, 毫秒) 信号通知。
+    """
+    rendered = pyqtSignal(object, float)
+    _finished = pyqtSignal(object)
+
+    def __init__(self, view, renderer, source=None, parent=None):
+        super().__init__(parent)
+        self.view = view
+        self.renderer = renderer
+        self.source = source
+        self.doc_id = None
+        self.timings = self._new_timings()
+        self._keys = []
+        self._references = None
+        self._loaded = False
+        self._pending = None
+        self._generation = 0
+        # 渲染器不是线程安全的，单线程执行即可保证顺序
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(1)
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(DEBOUNCE_MS)
+        self._timer.timeout.connect(self._on_timeout)
+        self._finished.connect(self._apply)
+        view.loadFinished.connect(self._on_loaded)
+        view.setHtml(PREVIEW_SHELL % renderer.css_text)
+
+    @staticmethod
+    def _new_timings():
+        return {'count': 0, 'last_ms': 0.0, 'max_ms': 0.0, 'total_ms': 0.0, 'split_ms': 0.0, 'render_ms': 0.0, 'blocks': 0}
+
+    def _on_loaded(self, ok):
+        self._loaded = True
+        if self._pending is not None:
+            text, self._pending = self._pending, None
+            self.update(text)
+
+    def _run(self, script):
+        self.view.page().runJavaScript(script)
+
+    def clear(self, doc_id=None):
+        # 丢弃进行中的渲染，之后的结果属于 doc_id
+        self._timer.stop()
+        self._generation += 1
+        self.doc_id = doc_id
+        self.timings = self._new_timings()
+        self._keys = []
+        self._references = None
+        self._pending = None
+        if self._loaded:
+            self._run(f'kbReset({json.dumps(self.renderer.css_text)})')
+
+    def request(self):
+        # 连续输入时只重新计时，停止输入后才取文本渲染
+        self._timer.start()
+
+    def _on_timeout(self):
+        if self.source is not None:
+            self.update(self.source())
+
+    def update(self, text):
+        self._timer.stop()
+        if not self._loaded:
+            self._pending = text
+            return
+        self._generation += 1
+        task = _RenderTask(self, self._generation, self.doc_id, text, self._keys, self._references)
+        # 还没开始执行的旧任务直接取消
+        self._pool.clear()
+        self._pool.start(task)
+
+    def wait(self, msecs=-1):
+        return self._pool.waitForDone(msecs)
+
+    def _compute(self, task):
+        """
+        在后台线程执行：切块、与页面当前的块比较并渲染变化的块。任务过期时返回 None。
+        """
+        if task.cancelled():
+            return None
+        started = time.perf_counter()
+        blocks, references = split_blocks(task.text)
+        references = '\n'.join(references)
+        keys = [hashlib.sha1(block.encode()).digest() for block in blocks]
+        # 链接引用定义变化时含链接的块都可能变化，整体重新渲染
+        reset = references != task.base_references
+        old = [] if reset else task.base_keys
+        # 新旧块序列去掉相同的前缀和后缀，中间部分即为变化的块
+        start = 0
+        limit = min(len(old), len(keys))
+        while start < limit and old[start] == keys[start]:
+            start += 1
+        end_old, end_new = len(old), len(keys)
+        while end_old > start and end_new > start and old[end_old - 1] == keys[end_new - 1]:
+            end_old -= 1
+            end_new -= 1
+        split_done = time.perf_counter()
+        html = []
+        for block in blocks[start:end_new]:
+            if task.cancelled():
+                return None
+            html.append(self._render(block, references))
+        finished = time.perf_counter()
+        return {
+            'generation': task.generation,
+            'doc_id': task.doc_id,
+            'reset': reset,
+            'start': start,
+            'remove': end_old - start,
+            'html': html,
+            'keys': keys,
+            'references': references,
+            'split_ms': (split_done - started) * 1000,
+            'render_ms': (finished - split_done) * 1000,
+        }
+
+    def _render(self, block, references):
+        if references and '[' in block:
+            block = f'{block}\n\n{references}'
+        return self.renderer.render_body(block, cache=False)
+
+    def _apply(self, result):
+        if result['generation'] != self._generation:
+            return
+        if result['reset']:
+            self._run(f'kbReset({json.dumps(self.renderer.css_text)})')
+        self._keys = result['keys']
+        self._references = result['references']
+        if result['html'] or result['remove']:
+            self._run(f"kbPatch({result['start']}, {result['remove']}, {json.dumps(result['html'])})")
+        total = result['split_ms'] + result['render_ms']
+        stats = self.timings
+        stats['count'] += 1
+        stats['last_ms'] = total
+        stats['max_ms'] = max(stats['max_ms'], total)
+        stats['total_ms'] += total
+        stats['split_ms'] = result['split_ms']
+        stats['render_ms'] = result['render_ms']
+        stats['blocks'] = len(result['html'])
+        self.rendered.emit(result['doc_id'], total)
@@ -85,7 +85,7 @@ class ScheduleWidget(QWidget):
     def on_calendar_select(self):
         date = self.calendar.selectedDate().toString('yyyy-MM-dd')
         self.list_widget.clear()
-        cursor = self.db.conn.cursor()
+        cursor = self.db.reader.cursor()
         cursor.execute('SELECT id, title, remind_time FROM schedule WHERE remind_time LIKE ? ORDER BY remind_time DESC', (f'{date}%',))
         for row in cursor.fetchall():
             self.list_widget.addItem(f'{row[0]}: {row[1]} - {row[2]}')
@@ -101,10 +101,9 @@ class ScheduleWidget(QWidget):
             if not title or not start_time or not end_time:
                 QMessageBox.warning(self, '输入不完整', '标题和时间不能为空')
                 return
-            cursor = self.db.conn.cursor()
-            cursor.execute('INSERT INTO schedule (title, description, start_time, end_time, remind_time, remind_type) VALUES (?, ?, ?, ?, ?, ?)',
-                (title, desc, start_time, end_time, start_time, remind_type))
-            self.db.conn.commit()
+            with self.db.transaction() as cursor:
+                cursor.execute('INSERT INTO schedule (title, description, start_time, end_time, remind_time, remind_type) VALUES (?, ?, ?, ?, ?, ?)',
+                    (title, desc, start_time, end_time, start_time, remind_type))
             self.load_schedule_list()
 
     def delete_selected_schedule(self):
@@ -121,7 +120,7 @@ class ScheduleWidget(QWidget):
 
     def show_schedule(self, item):
         sid = int(item.text().split(':')[0])
-        cursor = self.db.conn.cursor()
+        cursor = self.db.reader.cursor()
         cursor.execute('SELECT title, description, start_time, end_time, remind_type FROM schedule WHERE id=?', (sid,))
         row = cursor.fetchone()
         if row:
@@ -137,7 +136,7 @@ class ScheduleWidget(QWidget):
     def month_stats(self):
         # 统计本月每天日程数
         from collections import Counter
-        cursor = self.db.conn.cursor()
+        cursor = self.db.reader.cursor()
         month = self.calendar.selectedDate().toString('yyyy-MM')
         cursor.execute('SELECT remind_time FROM schedule WHERE remind_time LIKE ?', (f'{month}%',))
         days = [r[0][8:10] for r in cursor.fetchall()]
@@ -149,7 +148,7 @@ class ScheduleWidget(QWidget):
         # 统计本周每天日程数
         from collections import Counter
         import datetime
-        cursor = self.db.conn.cursor()
+        cursor = self.db.reader.cursor()
         today = self.calendar.selectedDate().toPyDate()
         start = today - datetime.timedelta(days=today.weekday())
         end = start + datetime.timedelta(days=6)
@@ -161,7 +160,7 @@ class ScheduleWidget(QWidget):
 
     def check_reminders(self):
         now = QDT.currentDateTime().toString('yyyy-MM-dd HH:mm')
-        cursor = self.db.conn.cursor()
+        cursor = self.db.reader.cursor()
         cursor.execute('SELECT id, title, remind_time, remind_type, finished FROM schedule WHERE finished=0')
         for sid, title, remind_time, remind_type, finished in cursor.fetchall():
             # 计算提醒时间
@@ -178,7 +177,7 @@ class ScheduleWidget(QWidget):
                     QMessageBox.information(self, '日程提醒', f'日程“{title}”正在进行中，请注意进度！')
 
     def get_end_time(self, sid):
-        cursor = self.db.conn.cursor()
+        cursor = self.db.reader.cursor()
         cursor.execute('SELECT end_time FROM schedule WHERE id=?', (sid,))
         row = cursor.fetchone()
         return row[0] if row else ''
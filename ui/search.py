@@ -0,0 +1,136 @@
+# 搜索模块
+# 输入停止 DEBOUNCE_MS 后在后台线程查询全文索引，按相关度分批解密正文生成摘要，逐批显示到结果列表
+# 查询词变化时递增代号，进行中的查询在下一批之前结束，过期的结果直接丢弃
+import time
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QTimer, QSize, Qt, pyqtSignal
+from PyQt5.QtGui import QTextDocument
+from PyQt5.QtWidgets import QStyledItemDelegate, QStyle
+from core.search_index import make_snippet
+
+DEBOUNCE_MS = 150
+MAX_RESULTS = 200
+BATCH_SIZE = 20
+
+class _SearchTask(QRunnable):
+    def __init__(self, engine, generation, query):
+        super().__init__()
+        self.engine = engine
+        self.generation = generation
+        self.query = query
+
+    def cancelled(self):
+        return self.engine._generation != self.generation
+
+    def run(self):
+        self.engine._run(self)
+
+class SearchEngine(QObject):
+    """
+    request(text) 重新计时，停止输入后查询；cancel() 丢弃进行中的查询。
+    started(查询词) 后依次发出 results(一批结果)，全部完成后发出 finished(结果数, 毫秒)。
+    每条结果为 (kid, title, cat_id, cat_name, sub_id, sub_name, 摘要 HTML)。
+    """
+    started = pyqtSignal(str)
+    results = pyqtSignal(list)
+    finished = pyqtSignal(int, float)
+    _batch = pyqtSignal(int, list)
+    _done = pyqtSignal(int, int, float)
+
+    def __init__(self, index, notes, parent=None):
+        super().__init__(parent)
+        self.index = index
+        self.notes = notes
+        self._query = ''
+        self._generation = 0
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(1)
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(DEBOUNCE_MS)
+        self._timer.timeout.connect(self._on_timeout)
+        self._batch.connect(self._on_batch)
+        self._done.connect(self._on_done)
+
+    def request(self, text):
+        self._query = text
+        self._generation += 1
+        self._timer.start()
+
+    def cancel(self):
+        self._timer.stop()
+        self._generation += 1
+        self._pool.clear()
+
+    def wait(self, msecs=-1):
+        return self._pool.waitForDone(msecs)
+
+    def _on_timeout(self):
+        self._generation += 1
+        task = _SearchTask(self, self._generation, self._query)
+        # 还没开始执行的旧查询直接取消
+        self._pool.clear()
+        self._pool.start(task)
+        self.started.emit(self._query)
+
+    def _run(self, task):
+        # 在后台线程执行
+        started = time.perf_counter()
+        try:
+            rows = self.index.search(task.query, MAX_RESULTS)
+        except Exception:
+            rows = []
+        for i in range(0, len(rows), BATCH_SIZE):
+            batch = []
+            for row in rows[i:i + BATCH_SIZE]:
+                if task.cancelled():
+                    return
+                batch.append((*row, self._snippet(row[0], task.query)))
+            self._batch.emit(task.generation, batch)
+        self._done.emit(task.generation, len(rows), (time.perf_counter() - started) * 1000)
+
+    def _snippet(self, kid, query):
+        try:
+            row = self.notes.load(kid)
+        except Exception:
+            row = None
+        if not row or row[1] is None:
+            return ''
+        return make_snippet(row[1], query)
+
+    def _on_batch(self, generation, batch):
+        if generation == self._generation:
+            self.results.emit(batch)
+
+    def _on_done(self, generation, count, ms):
+        if generation == self._generation:
+            self.finished.emit(count, ms)
+
+class SearchResultDelegate(QStyledItemDelegate):
+    # 结果列表中的条目为 HTML（标题、路径和加粗的摘要）
+    def _document(self, option, index):
+        document = QTextDocument()
+        document.setDefaultFont(option.font)
+        document.setHtml(index.data(Qt.DisplayRole) or '')
+        width = option.rect.width()
+        if width <= 0 and option.widget is not None:
+            # sizeHint 时 option.rect 为空，按列表可见宽度排版
+            width = option.widget.viewport().width()
+        document.setTextWidth(max(width, 100))
+        return document
+
+    def paint(self, painter, option, index):
+        self.initStyleOption(option, index)
+        document = self._document(option, index)
+        option.text = ''
+        style = option.widget.style() if option.widget else None
+        if style:
+            style.drawControl(QStyle.CE_ItemViewItem, option, painter, option.widget)
+        painter.save()
+        painter.translate(option.rect.topLeft())
+        document.drawContents(painter)
+        painter.restore()
+
+    def sizeHint(self, option, index):
+        self.initStyleOption(option, index)
+        document = self._document(option, index)
+        return QSize(int(document.idealWidth()), int(document.size().height()))
@@ -0,0 +1,69 @@
+# 标签筛选面板
+# 列出所有标签及知识点数；勾选多个标签时筛选同时带有这些标签的知识点，其余标签的数量改为在筛选结果中的数量
+from PyQt5.QtCore import Qt, QTimer, pyqtSignal
+from PyQt5.QtWidgets import QListWidget, QListWidgetItem
+
+class TagFilterPanel(QListWidget):
+    """
+    勾选改变时发出 selection_changed(已勾选的 tag_id 列表)。
+    标签索引改变（编辑标签、删除知识点等）后合并刷新列表，有勾选时同样发出 selection_changed 以便刷新结果。
+    """
+    selection_changed = pyqtSignal(list)
+    # 索引在写操作的线程中改变，经信号转到界面线程
+    _changed = pyqtSignal()
+
+    def __init__(self, index, parent=None):
+        super().__init__(parent)
+        self.index = index
+        self._selected = []
+        self._updating = False
+        # 批量导入等连续修改只刷新一次
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(100)
+        self._timer.timeout.connect(self._on_index_changed)
+        self._changed.connect(self._timer.start)
+        index.add_listener(self._changed.emit)
+        self.itemChanged.connect(self._on_item_changed)
+        self.refresh()
+
+    def selected(self):
+        return list(self._selected)
+
+    def refresh(self):
+        # 已勾选的标签排在前面；有勾选时隐藏在筛选结果中数量为 0 的标签
+        tags = self.index.tags()
+        known = {tag_id for tag_id, _, _ in tags}
+        self._selected = [tag_id for tag_id in self._selected if tag_id in known]
+        counts = self.index.counts(self._selected)
+        self._updating = True
+        self.clear()
+        for tag_id, name, _ in sorted(tags, key=lambda row: row[0] not in self._selected):
+            checked = tag_id in self._selected
+            count = counts.get(tag_id, 0)
+            if not checked and not count:
+                continue
+            item = QListWidgetItem(f'{name} ({count})')
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked if checked else Qt.Unchecked)
+            item.setData(Qt.UserRole, tag_id)
+            self.addItem(item)
+        self._updating = False
+
+    def _on_item_changed(self, item):
+        if self._updating:
+            return
+        tag_id = item.data(Qt.UserRole)
+        if item.checkState() == Qt.Checked:
+            if tag_id not in self._selected:
+                self._selected.append(tag_id)
+        elif tag_id in self._selected:
+            self._selected.remove(tag_id)
+        # 在 itemChanged 处理中不能直接清空列表，留到事件循环中刷新
+        QTimer.singleShot(0, self.refresh)
+        self.selection_changed.emit(self.selected())
+
+    def _on_index_changed(self):
+        self.refresh()
+        if self._selected:
+            self.selection_changed.emit(self.selected())